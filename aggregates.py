@@ -0,0 +1,192 @@
+import os
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+DEFAULT_HALF_LIFE = float(os.getenv("TRENDING_HALF_LIFE", 7 * 24 * 3600))
+METRICS = ("popular", "top-rated", "trending")
+_MAX_EXPONENT = 512.0
+
+
+class RankedIndex:
+    """
+    Movies kept sorted by a value, best first, so top-N queries slice instead of sorting.
+    An update finds the old and new positions by binary search, but the list delete and
+    insert shift the keys after them, so it costs O(N) element moves (one memmove each).
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._key_by_movie = {}
+
+    def update(self, movie, value):
+        old = self._key_by_movie.get(movie)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+        key = (-value, movie)
+        insort(self._keys, key)
+        self._key_by_movie[movie] = key
+
+    def top(self, limit=10, offset=0):
+        if limit < 1 or offset < 0:
+            raise ValueError("limit must be positive and offset non-negative")
+        return [(movie, -value) for value, movie in self._keys[offset:offset + limit]]
+
+    def __contains__(self, movie):
+        return movie in self._key_by_movie
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class MovieAggregates:
+    """
+    Per-movie like counts, user rating count/mean/variance and a time-decayed like score,
+    each updated in O(1) as facts arrive, plus per-genre sorted indexes for top-N lists,
+    updated in O(N) per changed value (see RankedIndex).
+
+    Ratings use Welford's running mean and variance; a user re-rating a movie replaces
+    their earlier rating. The trending score uses forward decay: each like adds
+    2 ** ((t - landmark) / half_life), so the relative order never changes as time passes
+    and only the reported value is scaled down to the current time.
+    """
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE, clock=time.time):
+        self.half_life = half_life or None
+        self.clock = clock
+        self.like_counts = defaultdict(int)
+        self.rating_stats = {}
+        self.user_ratings = {}
+        self.catalog_ratings = {}
+        self.genres_by_movie = defaultdict(set)
+        self._trending = defaultdict(float)
+        self._landmark = clock()
+        self._rankings = defaultdict(lambda: {metric: RankedIndex() for metric in METRICS})
+
+    def add_like(self, movie, timestamp=None):
+        self.like_counts[movie] += 1
+        self._refresh(movie, "popular")
+        if self.half_life:
+            timestamp = self.clock() if timestamp is None else timestamp
+            exponent = (timestamp - self._landmark) / self.half_life
+            if exponent > _MAX_EXPONENT:
+                self._rebase(timestamp)
+                exponent = 0.0
+            self._trending[movie] += 2.0 ** exponent
+            self._refresh(movie, "trending")
+
+    def add_rating(self, user, movie, rating):
+        """
+        Fold a user's rating into the movie's running count, mean and variance.
+        """
+        count, mean, m2 = self.rating_stats.get(movie, (0, 0.0, 0.0))
+        previous = self.user_ratings.get((user, movie))
+        if previous is not None:
+            if count == 1:
+                count, mean, m2 = 0, 0.0, 0.0
+            else:
+                old_mean = mean
+                mean = (count * mean - previous) / (count - 1)
+                m2 -= (previous - old_mean) * (previous - mean)
+                count -= 1
+        count += 1
+        delta = rating - mean
+        mean += delta / count
+        m2 += delta * (rating - mean)
+        self.rating_stats[movie] = (count, mean, max(m2, 0.0))
+        self.user_ratings[(user, movie)] = rating
+        self._refresh(movie, "top-rated")
+
+    def set_catalog_rating(self, movie, rating):
+        """
+        Catalog rating, used for top-rated lists until the movie has user ratings.
+        """
+        self.catalog_ratings[movie] = rating
+        self._refresh(movie, "top-rated")
+
+    def add_genre(self, movie, genre):
+        if genre in self.genres_by_movie[movie]:
+            return
+        self.genres_by_movie[movie].add(genre)
+        for metric in METRICS:
+            if movie in self._rankings[None][metric]:
+                self._rankings[genre][metric].update(movie, self._value(movie, metric))
+
+    def like_count(self, movie):
+        return self.like_counts.get(movie, 0)
+
+    def rating_count(self, movie):
+        return self.rating_stats.get(movie, (0, 0.0, 0.0))[0]
+
+    def rating_mean(self, movie):
+        count, mean, _ = self.rating_stats.get(movie, (0, 0.0, 0.0))
+        return mean if count else None
+
+    def rating_variance(self, movie):
+        count, _, m2 = self.rating_stats.get(movie, (0, 0.0, 0.0))
+        return m2 / count if count else None
+
+    def rating_score(self, movie):
+        """
+        Mean user rating, or the catalog rating for movies nobody has rated yet.
+        """
+        mean = self.rating_mean(movie)
+        if mean is not None:
+            return mean
+        rating = self.catalog_ratings.get(movie)
+        return rating if isinstance(rating, (int, float)) else 0.0
+
+    def trending_score(self, movie, now=None):
+        """
+        Likes weighted by age, halving every half_life seconds.
+        """
+        if not self.half_life:
+            return 0.0
+        return self._trending.get(movie, 0.0) * self._decay(now)
+
+    def top(self, metric, genre=None, limit=10, offset=0):
+        """
+        [(movie, value), ...] for the best movies overall or in one genre, best first.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        if metric == "trending" and not self.half_life:
+            raise ValueError("Trending scores are disabled (TRENDING_HALF_LIFE=0)")
+        if limit < 1 or offset < 0:
+            raise ValueError("limit must be positive and offset non-negative")
+        if genre is not None and genre not in self._rankings:
+            return []
+        ranked = self._rankings[genre][metric].top(limit, offset)
+        if metric == "trending":
+            decay = self._decay()
+            ranked = [(movie, value * decay) for movie, value in ranked]
+        return ranked
+
+    def _decay(self, now=None):
+        now = self.clock() if now is None else now
+        return 2.0 ** (-(now - self._landmark) / self.half_life)
+
+    def _value(self, movie, metric):
+        if metric == "popular":
+            return self.like_counts.get(movie, 0)
+        if metric == "top-rated":
+            return self.rating_score(movie)
+        return self._trending.get(movie, 0.0)
+
+    def _refresh(self, movie, metric):
+        value = self._value(movie, metric)
+        for genre in [None, *self.genres_by_movie.get(movie, ())]:
+            self._rankings[genre][metric].update(movie, value)
+
+    def _rebase(self, timestamp):
+        """
+        Move the decay landmark forward before the stored weights overflow.
+        """
+        factor = 2.0 ** (-(timestamp - self._landmark) / self.half_life)
+        for movie in self._trending:
+            self._trending[movie] *= factor
+        self._landmark = timestamp
+        for rankings in self._rankings.values():
+            rankings["trending"] = RankedIndex()
+        for movie in self._trending:
+            self._refresh(movie, "trending")
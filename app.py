@@ -1,77 +1,457 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template
 from dotenv import load_dotenv
+import base64
+import binascii
+import json
+import logging
 import os
-from utils import initialize_metta, execute_simple_list, execute_query, get_explanations, user_exists, add_new_user
-from parser import parse_question_to_json, map_json_to_metta
+import secrets
+import threading
+import time
+from utils import (initialize_metta, execute_prepared, describe_movies, get_explanations,
+                   recommend_with_explanations, ranked_recommendations, graph_recommendations, iter_recommendations,
+                   batch_recommendations, top_movies, registry_page,
+                   user_exists, add_new_user, add_metta_atom, affected_users, watched_movies)
+from parser import parse_question_to_json, map_json_to_metta, parser_stats
+from rec_cache import RecommendationCache
+from materialize import MaterializedRecommendations
+from replica_pool import ReplicaPool
+from shards import ShardedKnowledgeBase
+from persistence import KnowledgeStore
+from prepared import bind_query
+from metrics import CACHE_LOOKUPS, REQUEST_SECONDS, configure_logging, log_if_slow, render_metrics, timed_query
 
 
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, template_folder="src/templates", static_folder="src/static")
 
 
 metta_file_path = os.getenv("METTA_FILE_PATH", "recommendation.metta")
-metta = initialize_metta(metta_file_path)
+persistence_dir = os.getenv("PERSISTENCE_DIR")
+knowledge_store = KnowledgeStore(
+    persistence_dir,
+    snapshot_every=int(os.getenv("SNAPSHOT_EVERY", 1000)),
+    fsync=os.getenv("PERSISTENCE_FSYNC", "False").lower() == "true"
+) if persistence_dir else None
+shard_count = int(os.getenv("SHARD_COUNT", 0))
+replica_pool_size = int(os.getenv("REPLICA_POOL_SIZE", 0))
+if shard_count > 0 and (knowledge_store is not None or replica_pool_size > 0):
+    raise ValueError("SHARD_COUNT cannot be combined with PERSISTENCE_DIR or REPLICA_POOL_SIZE")
+rec_cache = RecommendationCache(
+    max_entries=int(os.getenv("REC_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("REC_CACHE_TTL", 300))
+)
+like_rating_threshold = float(os.getenv("LIKE_RATING_THRESHOLD", 7))
+default_limit = int(os.getenv("DEFAULT_RECOMMENDATION_LIMIT", 10))
+catalog_page_size = int(os.getenv("CATALOG_PAGE_SIZE", 500))
+materialized_path = os.getenv("MATERIALIZED_RECS_PATH", "materialized_recs.sqlite")
+materialized = None
+metta = None
+sharded_kb = None
+replica_pool = None
+write_lock = threading.Lock()
+kb_version = 0
+instance_id = secrets.token_hex(4)
+_startup_lock = threading.Lock()
+
+def open_knowledge_base():
+    """
+    Load the knowledge base and start the replica pool or the shards on first use rather
+    than at import. Spawned replica and shard processes re-import __main__ and the debug
+    reloader's watcher process never serves requests, so neither may start workers of its own.
+    """
+    global metta, sharded_kb, replica_pool, kb_version
+    if metta is not None:
+        return metta
+    with _startup_lock:
+        if metta is None:
+            if knowledge_store is not None:
+                space = knowledge_store.open(metta_file_path, cf_metric=os.getenv("CF_METRIC", "cosine"))
+                kb_version = knowledge_store.version
+            elif shard_count > 0:
+                sharded_kb = ShardedKnowledgeBase(metta_file_path, shard_count, os.getenv("SHARD_DIR"))
+                space = sharded_kb.metta
+            else:
+                space = initialize_metta(metta_file_path, cf_metric=os.getenv("CF_METRIC", "cosine"))
+            if sharded_kb is not None:
+                replica_pool = sharded_kb
+            elif replica_pool_size > 0:
+                replica_pool = ReplicaPool(
+                    metta_file_path,
+                    size=replica_pool_size,
+                    read_your_writes=os.getenv("READ_YOUR_WRITES", "True").lower() == "true",
+                    persistence_dir=persistence_dir,
+                    base_version=kb_version
+                )
+            metta = space
+    return metta
+
+def read_kb(fn, *args, **kwargs):
+    """
+    Run a read helper from utils on a replica when the pool is enabled, otherwise on the local space.
+    """
+    if replica_pool is not None:
+        with timed_query(f"replica:{fn.__name__}"):
+            return replica_pool.read(fn.__name__, *args, **kwargs)
+    return fn(metta, *args, **kwargs)
+
+def cache_lookup(user, template):
+    """
+    Look up a cached response and record the hit or miss for the current request, along
+    with the user's cache version for cache_result() to check once the response is computed.
+    """
+    g.cache_version = rec_cache.version(user)
+    cached = rec_cache.get(user, template)
+    g.cache_status = "hit" if cached is not None else "miss"
+    CACHE_LOOKUPS.inc(request.path, g.cache_status)
+    return cached
+
+def page_params(data):
+    """
+    Read and validate limit/offset from a request body. Missing or null values take the
+    defaults; anything that is not an integer raises ValueError.
+    """
+    limit = data.get('limit')
+    offset = data.get('offset')
+    try:
+        limit = default_limit if limit is None else int(limit)
+        offset = 0 if offset is None else int(offset)
+    except (TypeError, ValueError):
+        raise ValueError("limit and offset must be integers")
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be positive and offset non-negative")
+    return limit, offset
+
+def optional_limit(limit):
+    """
+    Validate an optional limit from a request body: None when missing or null, otherwise a
+    positive integer. Raises ValueError for anything else.
+    """
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return limit
+
+def user_list(users):
+    """
+    True if users is a non-empty list of user names.
+    """
+    return isinstance(users, list) and bool(users) and all(isinstance(user, str) for user in users)
+
+def cache_result(user, template, response, version):
+    """
+    Cache a response unless replica reads may lag behind writes, in which case a stale
+    result could outlive the invalidation of the write it missed. The version is the one
+    cache_lookup() read before the response was computed, so a response that a write
+    invalidated in the meantime is not cached.
+    """
+    if replica_pool is None or replica_pool.read_your_writes:
+        rec_cache.put(user, template, response, version)
+
+def stream_format(data):
+    """
+    'ndjson' or 'sse' when the client asked for a streamed response, through the "stream"
+    field or the Accept header, otherwise None.
+    """
+    requested = data.get('stream')
+    if requested in ('ndjson', 'sse'):
+        return requested
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson', 'text/event-stream'])
+    return {'application/x-ndjson': 'ndjson', 'text/event-stream': 'sse'}.get(best)
+
+def events_from_response(response):
+    """
+    Replay a complete get-recommendations response as the events iter_recommendations yields.
+    """
+    yield "similar_users", response["similar_users"]
+    for rank, (movie, explanations) in enumerate(zip(response["recommendations"], response["explanations"]),
+                                                 response["offset"]):
+        yield "recommendation", {"rank": rank, "movie": movie, "explanations": explanations}
+    yield "watched", response["watched"]
+    yield "done", {"total": response["total"]}
+
+def recommendation_events(user, limit, offset):
+    """
+    Recommendation events for a user. Replicas cannot stream across the process boundary,
+    so with a replica pool the page is computed there and then replayed as events.
+    """
+    if replica_pool is None:
+        return iter_recommendations(metta, user, limit, offset)
+    ranked = read_kb(ranked_recommendations, user, limit, offset)
+    ranked.update(watched=read_kb(watched_movies, user), offset=offset)
+    return events_from_response(ranked)
+
+def encode_event(kind, data, fmt):
+    if fmt == 'sse':
+        return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": kind, "data": data}) + "\n"
+
+def stream_recommendations(user, limit, offset, template, fmt, version, cached=None):
+    """
+    Stream recommendation events as NDJSON lines or server-sent events. The events are
+    also collected into the regular response, which is cached once the stream completes.
+    """
+    response = {"recommendations": [], "explanations": [], "limit": limit, "offset": offset}
+    events = events_from_response(cached) if cached is not None else recommendation_events(user, limit, offset)
+    try:
+        for kind, data in events:
+            if kind == "recommendation":
+                response["recommendations"].append(data["movie"])
+                response["explanations"].append(data["explanations"])
+            elif kind == "watched":
+                data = data if data else [{"id": "none", "title": "No movies watched"}]
+                response["watched"] = data
+            elif kind == "done":
+                response["total"] = data["total"]
+            else:
+                response[kind] = data
+            yield encode_event(kind, data, fmt)
+    except Exception as e:
+        logger.exception("Error streaming recommendations for %s: %s", user, e)
+        yield encode_event("error", {"error": f"Error fetching recommendations: {str(e)}"}, fmt)
+        return
+    if cached is None:
+        cache_result(user, template, response, version)
+
+def kb_etag():
+    """
+    ETag for responses derived from the knowledge base: the space version, scoped to this
+    process so that versions from an earlier run never validate.
+    """
+    return f"{instance_id}-{kb_version}"
+
+def encode_cursor(after):
+    return base64.urlsafe_b64encode(after.encode("utf-8")).decode("ascii") if after is not None else None
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def registry_listing(kind):
+    """
+    Serve a page of the user or movie registry with a cursor to the next page, answering
+    304 Not Modified when the client's If-None-Match still matches the space version.
+    """
+    etag = kb_etag()
+    if request.if_none_match.contains(etag):
+        g.cache_status = "not-modified"
+        response = Response(status=304)
+    else:
+        try:
+            limit = int(request.args.get('limit', catalog_page_size))
+            if limit < 1:
+                raise ValueError("limit must be positive")
+            after = decode_cursor(request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        items, next_after, total = registry_page(metta, kind, after, limit)
+        if not items and after is None:
+            logger.warning("No %s found in MeTTa knowledge base", kind)
+        response = jsonify({kind: items, "next_cursor": encode_cursor(next_after), "total": total,
+                            "version": kb_version})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def record_fact(atom):
+    """
+    Add a fact atom to the knowledge base through the single writer path, log it durably,
+    replicate it and evict the cached results it affects. The atom is only written out as
+    text for the mutation log, the replicas and the shards. A fact that is already present
+    changes nothing: it is not logged or replicated and leaves the version and the cache
+    alone. Returns whether the fact was added.
+    """
+    global kb_version
+    with write_lock:
+        if sharded_kb is not None:
+            if sharded_kb.write(str(atom)) is None:
+                return False
+            kb_version += 1
+            rec_cache.invalidate_users(sharded_kb.affected_users(atom))
+            return True
+        if add_metta_atom(metta, atom) is None:
+            return False
+        if knowledge_store is not None:
+            knowledge_store.record(str(atom), metta)
+        if replica_pool is not None:
+            replica_pool.write(str(atom))
+        kb_version += 1
+        rec_cache.invalidate_users(affected_users(metta, atom))
+    return True
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def load_knowledge_base():
+    open_knowledge_base()
+
+@app.after_request
+def record_request(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        seconds = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(seconds, request.method, route, str(response.status_code))
+        logger.info("%s %s status=%d latency_ms=%.2f cache=%s", request.method, route, response.status_code,
+                    seconds * 1000, getattr(g, 'cache_status', None))
+        log_if_slow("request", f"{request.method} {route}", seconds, path=request.path,
+                    status=response.status_code, cache=getattr(g, 'cache_status', None))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/')
 def index():
-    print("Serving index.html")
+    logger.debug("Serving index.html")
     return render_template('index.html')
 
 @app.route('/get-recommendations', methods=['POST'])
 def get_recommendations():
     data = request.json
     user = data.get('user')
-    print(f"Received get-recommendations request for user: {user}")
+    logger.debug("Received get-recommendations request for user: %s", user)
     if not user:
         return jsonify({"error": "User is required"}), 400
     try:
-        rec_list = execute_simple_list(metta, f'!(recommend-to {user} $movie)')
-        print(f"Raw recommendations for {user}: {rec_list}")
-        final_recs = execute_query(metta, f'!(recommend-to {user} $movie)')
-        explanations = get_explanations(metta, user, final_recs)
-        similar_users = execute_simple_list(metta, f'!(similar-users {user} $user)')
-        watched = execute_query(metta, f'!(watched {user} $movie)')
+        limit, offset = page_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    template = f'get-recommendations:{limit}:{offset}'
+    cached = cache_lookup(user, template)
+    fmt = stream_format(data)
+    if fmt is not None:
+        mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+        return Response(stream_recommendations(user, limit, offset, template, fmt, g.cache_version, cached),
+                        mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if cached is not None:
+        logger.debug("get-recommendations cache hit for user: %s", user)
+        return jsonify(cached)
+    try:
+        ranked = read_kb(ranked_recommendations, user, limit, offset)
+        watched = read_kb(watched_movies, user)
         response = {
-            "recommendations": final_recs,
-            "explanations": explanations,
-            "similar_users": similar_users,
-            "watched": watched if watched else [{"id": "none", "title": "No movies watched"}]
+            "recommendations": ranked["recommendations"],
+            "explanations": ranked["explanations"],
+            "similar_users": ranked["similar_users"],
+            "watched": watched if watched else [{"id": "none", "title": "No movies watched"}],
+            "total": ranked["total"],
+            "limit": limit,
+            "offset": offset
         }
-        print(f"get-recommendations response: {response}")
+        logger.debug("get-recommendations response: %s", response)
+        cache_result(user, template, response, g.cache_version)
         return jsonify(response)
     except Exception as e:
-        print(f"Error in get-recommendations: {str(e)}")
+        logger.exception("Error in get-recommendations: %s", e)
         return jsonify({"error": f"Error fetching recommendations: {str(e)}"}), 500
 
+@app.route('/batch-recommendations', methods=['POST'])
+def get_batch_recommendations():
+    data = request.json or {}
+    users = data.get('users')
+    limit = data.get('limit')
+    logger.debug("Received batch-recommendations request for users: %s, limit: %s", users, limit)
+    if users != "all" and not user_list(users):
+        return jsonify({"error": "users must be a list of users or \"all\""}), 400
+    try:
+        limit = optional_limit(limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        results = read_kb(batch_recommendations, None if users == "all" else users, limit)
+        return jsonify({"results": results})
+    except Exception as e:
+        logger.exception("Error in batch-recommendations: %s", e)
+        return jsonify({"error": f"Error fetching batch recommendations: {str(e)}"}), 500
+
+@app.route('/materialized-recommendations', methods=['POST'])
+def get_materialized_recommendations():
+    global materialized
+    data = request.json or {}
+    users = data.get('users')
+    limit = data.get('limit')
+    if not user_list(users):
+        return jsonify({"error": "users must be a non-empty list of users"}), 400
+    try:
+        limit = optional_limit(limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not os.path.exists(materialized_path):
+        return jsonify({"error": f"No materialized table at {materialized_path}; run materialize.py first"}), 404
+    try:
+        if materialized is None:
+            materialized = MaterializedRecommendations(materialized_path)
+        results = materialized.lookup(users, limit)
+        return jsonify({"results": results, "meta": materialized.meta()})
+    except Exception as e:
+        logger.exception("Error in materialized-recommendations: %s", e)
+        return jsonify({"error": f"Error reading materialized recommendations: {str(e)}"}), 500
+
 @app.route('/parse-query', methods=['POST'])
 def parse_query():
     data = request.json
     question = data.get('question')
     assumed_subject = data.get('user', 'Alice')
-    print(f"Received parse-query request: question='{question}', user='{assumed_subject}'")
+    logger.debug("Received parse-query request: question='%s', user='%s'", question, assumed_subject)
     if not question:
         return jsonify({"error": "Question is required"}), 400
     try:
         parsed_json = parse_question_to_json(question, assumed_subject)
-        print(f"Parsed question '{question}' to: {parsed_json}")
-        metta_query = map_json_to_metta(parsed_json)
-        results = execute_simple_list(metta, metta_query)
-      
-        if parsed_json['relation'] == "Likes" and parsed_json.get('target_attribute'):
-            recommendations = [{"id": parsed_json['target_attribute']['value'], "title": parsed_json['target_attribute']['value'].replace("-", " ").title()}] if results else []
+        logger.debug("Parsed question '%s' to: %s", question, parsed_json)
+        query_name, query_params = map_json_to_metta(parsed_json)
+        cache_key = (query_name, tuple(sorted(query_params.items())), str(data.get('limit')), str(data.get('offset')))
+        if (parsed_json.get('max_depth') or 1) > 1:
+            # A write anywhere in the graph can change multi-hop results, beyond the users it invalidates
+            cache_key += (kb_version,)
+        cached = cache_lookup(parsed_json['subject'], cache_key)
+        if cached is not None:
+            logger.debug("parse-query cache hit for query: %s %s", query_name, query_params)
+            return jsonify(cached)
+        if parsed_json['relation'] not in ("Likes", "Watched", "SimilarUser"):
+            limit, offset = page_params(data)
+            depth = parsed_json.get('max_depth') or 1
+            if depth > 1:
+                result = read_kb(graph_recommendations, parsed_json['subject'], depth, limit, offset)
+                recommendations, explanations = result["recommendations"], result["explanations"]
+            else:
+                recommendations, explanations = read_kb(recommend_with_explanations, parsed_json['subject'], limit,
+                                                        offset)
         else:
-            recommendations = execute_query(metta, metta_query)
-        explanations = get_explanations(metta, parsed_json['subject'], recommendations) if parsed_json['relation'] != "Likes" else [results or ["No preference found"]]
+            results = read_kb(execute_prepared, query_name, **query_params)
+            if parsed_json['relation'] == "Likes" and parsed_json.get('target_attribute'):
+                recommendations = [{"id": parsed_json['target_attribute']['value'], "title": parsed_json['target_attribute']['value'].replace("-", " ").title()}] if results else []
+            else:
+                recommendations = read_kb(describe_movies, results)
+            explanations = read_kb(get_explanations, parsed_json['subject'], recommendations) if parsed_json['relation'] != "Likes" else [results or ["No preference found"]]
         response = {
             "parsed_query": parsed_json,
             "recommendations": recommendations,
             "explanations": explanations
         }
-        print(f"parse-query response: {response}")
+        logger.debug("parse-query response: %s", response)
+        cache_result(parsed_json['subject'], cache_key, response, g.cache_version)
         return jsonify(response)
+    except ValueError as e:
+        logger.warning("Rejected parse-query: %s", e)
+        return jsonify({"error": f"Error parsing query: {str(e)}"}), 400
     except Exception as e:
-        print(f"Error in parse-query: {str(e)}")
+        logger.exception("Error in parse-query: %s", e)
         return jsonify({"error": f"Error parsing query: {str(e)}"}), 500
 
 
@@ -80,19 +460,22 @@ def parse_query():
 @app.route('/add-user', methods=['POST'])
 def add_user():
     data = request.get_json()
-    print(f"Received add-user request: {data}")
-    username = data.get('username', '').strip().lower()
+    logger.debug("Received add-user request: %s", data)
+    username = (data.get('username') or data.get('user') or '').strip().lower()
     if not username:
-        print("Error: Username is empty or missing")
+        logger.warning("Username is empty or missing")
         return jsonify({"error": "Username is required"}), 400
-    query = f'!(match &self (user {username}) $x)'
-    results = execute_simple_list(query)
-    print(f"Check user query: {query}, results: {results}")
+    try:
+        fact = bind_query("user-fact", {"user": username})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    results = execute_prepared(metta, "user-atom", user=username)
+    logger.debug("Check user query for %s, results: %s", username, results)
     if results:
-        print(f"Error: User '{username}' already exists")
+        logger.warning("User '%s' already exists", username)
         return jsonify({"error": f"User '{username}' already exists"}), 409
-    add_metta_atom(f'(user {username})')
-    print(f"Added user: {username}")
+    record_fact(fact)
+    logger.info("Added user: %s", username)
     return jsonify({"message": f"User '{username}' added successfully"}), 201
 
 @app.route('/update-preferences', methods=['POST'])
@@ -100,30 +483,28 @@ def update_preferences():
     data = request.json
     user = data.get('user')
     new_genre = data.get('new_genre')
-    print(f"Received update-preferences request: user={user}, genre={new_genre}")
+    logger.debug("Received update-preferences request: user=%s, genre=%s", user, new_genre)
     if not user or not new_genre:
         return jsonify({"error": "User and genre are required"}), 400
     try:
+        fact = bind_query("preference-fact", {"user": user, "genre": new_genre})
         if not user_exists(metta, user):
             add_new_user(metta, user)
-        metta.run(f'(preference {user} {new_genre})')
+        record_fact(fact)
         return jsonify({"message": f"Genre preference '{new_genre}' added for {user}"})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error in update-preferences: {str(e)}")
+        logger.exception("Error in update-preferences: %s", e)
         return jsonify({"error": f"Error updating preferences: {str(e)}"}), 500
 
 @app.route('/get-users', methods=['GET'])
 def get_users():
     try:
-        print("Received get-users request")
-        results = execute_simple_list(metta, '!(match &self (watched $user $movie) $user)')
-        response = {"users": results}
-        print(f"get-users response: {response}")
-        if not results:
-            print("No users found in MeTTa knowledge base")
-        return jsonify(response)
+        logger.debug("Received get-users request")
+        return registry_listing("users")
     except Exception as e:
-        print(f"Error fetching users: {str(e)}")
+        logger.exception("Error fetching users: %s", e)
         return jsonify({"error": f"Error fetching users: {str(e)}"}), 500
 
 @app.route('/add-rating', methods=['POST'])
@@ -132,30 +513,65 @@ def add_rating():
     user = data.get('user')
     movie = data.get('movie')
     rating = data.get('rating')
-    print(f"Received add-rating request: user={user}, movie={movie}, rating={rating}")
+    logger.debug("Received add-rating request: user=%s, movie=%s, rating=%s", user, movie, rating)
     if not user or not movie or not rating:
         return jsonify({"error": "User, movie, and rating required"}), 400
     try:
-        metta.run(f'(user-rating {user} {movie} {rating})')
+        rating_fact = bind_query("rating-fact", {"user": user, "movie": movie, "rating": rating})
+        likes_fact = bind_query("likes-fact", {"user": user, "movie": movie})
+        record_fact(rating_fact)
+        if float(rating) >= like_rating_threshold:
+            record_fact(likes_fact)
         return jsonify({"message": f"Rating {rating} added for {movie} by {user}"})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error in add-rating: {str(e)}")
+        logger.exception("Error in add-rating: %s", e)
         return jsonify({"error": f"Error adding rating: {str(e)}"}), 500
 
+@app.route('/kb-version', methods=['GET'])
+def get_kb_version():
+    response = {"version": kb_version}
+    if replica_pool is not None:
+        response["replicas"] = replica_pool.replica_versions()
+    return jsonify(response)
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(rec_cache.stats())
+
+@app.route('/parser-stats', methods=['GET'])
+def get_parser_stats():
+    return jsonify(parser_stats())
+
+@app.route('/top-movies', methods=['GET'])
+def get_top_movies():
+    metric = request.args.get('metric', 'popular')
+    genre = request.args.get('genre') or None
+    try:
+        limit = int(request.args.get('limit', default_limit))
+        offset = int(request.args.get('offset', 0))
+        movies = read_kb(top_movies, metric, genre, limit, offset)
+        return jsonify({"metric": metric, "genre": genre, "movies": movies})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error fetching top movies: %s", e)
+        return jsonify({"error": f"Error fetching top movies: {str(e)}"}), 500
+
 @app.route('/get-movies', methods=['GET'])
 def get_movies():
     try:
-        print("Received get-movies request")
-        results = execute_simple_list(metta, '!(match &self (movie $id $title $genre $director $rating) $id)')
-        response = {"movies": results}
-        print(f"get-movies response: {response}")
-        return jsonify(response)
+        logger.debug("Received get-movies request")
+        return registry_listing("movies")
     except Exception as e:
-        print(f"Error fetching movies: {str(e)}")
+        logger.exception("Error fetching movies: %s", e)
         return jsonify({"error": f"Error fetching movies: {str(e)}"}), 500
 
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 5000))
     debug = os.getenv("DEBUG", "True").lower() == "true"
-    print(f"Starting Flask server on port {port}, debug={debug}")
+    logger.info("Starting Flask server on port %d, debug=%s", port, debug)
+    if not debug or os.getenv("WERKZEUG_RUN_MAIN") == "true":
+        open_knowledge_base()
     app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
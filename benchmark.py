@@ -0,0 +1,364 @@
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+
+RULES = [
+    ("content-similarity", "!(content-similarity {user} $movie)"),
+    ("director-match", "!(director-match {user} $movie)"),
+    ("similar-users", "!(similar-users {user} $other)"),
+    ("collaborative-rec", "!(collaborative-rec {user} $movie)"),
+    ("explain-genre", "!(explain-genre {user} {movie} $explanation)"),
+    ("explain-director", "!(explain-director {user} {movie} $explanation)"),
+    ("explain-collab", "!(explain-collab {user} {movie} $explanation)"),
+    ("index-recommend-to", "!(index-recommend-to {user})"),
+    ("cf-similar-users", "!(cf-similar-users {user})"),
+    ("content-recommend-to", "!(content-recommend-to {user} 10)"),
+    ("popularity", "!(popularity {movie} $count)"),
+]
+
+ENDPOINTS = [
+    ("POST /get-recommendations", "post", "/get-recommendations", lambda user, users: {"user": user}),
+    ("POST /batch-recommendations", "post", "/batch-recommendations", lambda user, users: {"users": users}),
+    ("POST /parse-query", "post", "/parse-query",
+     lambda user, users: {"user": user, "question": f"What movies has {user} watched?"}),
+    ("GET /get-users", "get", "/get-users", None),
+    ("GET /get-movies", "get", "/get-movies", None),
+    ("GET /top-movies", "get", "/top-movies?metric=popular&genre=genre-0", None),
+    ("POST /add-rating", "post", "/add-rating", lambda user, users: {"user": user, "movie": "movie-0", "rating": 9}),
+]
+
+
+def _zipf_weights(count, skew):
+    return [1.0 / (rank + 1) ** skew for rank in range(count)]
+
+
+def generate_kb(users, movies, like_density=0.05, genres=8, directors=20, skew=1.0, watch_ratio=1.5, seed=0):
+    """
+    Generate a synthetic catalog and interaction log as fact tuples.
+
+    Genres, directors and liked movies are drawn from Zipf distributions with exponent
+    skew (0 is uniform), each user likes about like_density * movies titles and has
+    watched about watch_ratio times as many.
+    """
+    rng = random.Random(seed)
+    genre_weights = _zipf_weights(genres, skew)
+    director_weights = _zipf_weights(directors, skew)
+    movie_weights = _zipf_weights(movies, skew)
+    facts = []
+    for m in range(movies):
+        movie = f"movie-{m}"
+        genre = rng.choices(range(genres), genre_weights)[0]
+        director = rng.choices(range(directors), director_weights)[0]
+        rating = round(rng.uniform(5.0, 9.5), 1)
+        facts.append(("movie", movie, f"Movie {m}", f"Genre {genre}", f"Director {director}", rating))
+        facts.append(("genre", movie, f"genre-{genre}"))
+        facts.append(("director", movie, f"director-{director}"))
+        facts.append(("rating", movie, rating))
+    per_user = max(1, round(like_density * movies))
+    for u in range(users):
+        user = f"user-{u}"
+        liked = set()
+        while len(liked) < min(per_user, movies):
+            liked.update(rng.choices(range(movies), movie_weights, k=per_user - len(liked)))
+        watched = set(liked)
+        while len(watched) < min(round(per_user * watch_ratio), movies):
+            watched.add(rng.randrange(movies))
+        facts.extend(("likes", user, f"movie-{m}") for m in sorted(liked))
+        facts.extend(("watched", user, f"movie-{m}") for m in sorted(watched))
+    return facts
+
+
+def format_fact(fact):
+    parts = []
+    for i, part in enumerate(fact):
+        if isinstance(part, str) and (fact[0] == "movie" and i >= 2):
+            parts.append(json.dumps(part))
+        else:
+            parts.append(str(part))
+    return f"({' '.join(parts)})"
+
+
+def rule_source(metta_file_path):
+    """
+    The rule definitions of a .metta file, without its facts and queries.
+    """
+    from hyperon import MeTTa
+    from persistence import encode_fact, split_top_level
+    metta = MeTTa()
+    with open(metta_file_path, "r", encoding="utf-8") as f:
+        segments = split_top_level(f.read())
+    return [segment for segment in segments
+            if not segment.startswith("!") and encode_fact(metta.parse_single(segment)) is None]
+
+
+def write_metta(path, facts, rules_from="recommendation.metta"):
+    """
+    Write the facts, followed by the rules of rules_from, as a loadable .metta file.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for fact in facts:
+            f.write(format_fact(fact) + "\n")
+        f.write("\n")
+        for rule in rule_source(rules_from):
+            f.write(rule + "\n\n")
+    return path
+
+
+def write_import_files(directory, facts):
+    """
+    Write movies.csv, likes.csv and watched.csv in the layout importer.py reads.
+    Returns the (kind, path) sources for bulk_import.
+    """
+    os.makedirs(directory, exist_ok=True)
+    movies = {}
+    for fact in facts:
+        if fact[0] == "movie":
+            movies[fact[1]] = {"movieId": fact[1], "title": fact[2], "genres": fact[3], "director": fact[4],
+                               "rating": fact[5]}
+    sources = [("movies", os.path.join(directory, "movies.csv"))]
+    with open(sources[0][1], "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, ["movieId", "title", "genres", "director", "rating"])
+        writer.writeheader()
+        writer.writerows(movies.values())
+    for relation in ("likes", "watched"):
+        path = os.path.join(directory, f"{relation}.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["userId", "movieId"])
+            writer.writerows(fact[1:] for fact in facts if fact[0] == relation)
+        sources.append((relation, path))
+    return sources
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+    }
+
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def time_rules(metta, users, repeat=3):
+    """
+    Time each MeTTa rule for the sample users. Explain rules are run against a movie
+    recommended to the user, so they have something to match.
+    """
+    index = metta.kb_index
+    results = {}
+    for name, template in RULES:
+        samples = []
+        for user in users:
+            candidates = sorted(index.recommend_to(user)) or sorted(index.catalog.ids())
+            query = template.format(user=user, movie=candidates[0])
+            samples.extend(_timed(lambda: metta.run(query), repeat))
+        results[name] = summarize(samples)
+    return results
+
+
+def time_endpoints(client, rec_cache, users, repeat=3):
+    """
+    Time each Flask endpoint through the test client with the recommendation cache
+    cleared before every request, so the numbers reflect uncached work.
+    """
+    results = {}
+    for name, method, path, body in ENDPOINTS:
+        samples = []
+        for user in users:
+            def call():
+                rec_cache.invalidate_users(None)
+                if method == "get":
+                    response = client.get(path)
+                else:
+                    response = client.post(path, json=body(user, users))
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{name} returned {response.status_code}: {response.get_data(as_text=True)}")
+            samples.extend(_timed(call, repeat))
+        results[name] = summarize(samples)
+    return results
+
+
+def _bench_size(task):
+    """
+    Generate one knowledge base, load it through app.py in this (fresh) process and time
+    the rules and endpoints against it.
+    """
+    size, options = task
+    users, movies = size
+    workdir = tempfile.mkdtemp(prefix="metta-bench-")
+    facts = generate_kb(users, movies, options["density"], options["genres"], options["directors"],
+                        options["skew"], seed=options["seed"])
+    path = write_metta(os.path.join(workdir, "kb.metta"), facts, options["rules_from"])
+    os.environ.update({
+        "METTA_FILE_PATH": path,
+        "PERSISTENCE_DIR": "",
+        "REPLICA_POOL_SIZE": "0",
+        "PARSER_MODEL": "stub",
+        "LOG_LEVEL": "WARNING",
+        "MATERIALIZED_RECS_PATH": os.path.join(workdir, "none.sqlite"),
+    })
+    sample = [f"user-{u}" for u in random.Random(options["seed"]).sample(range(users), min(options["sample"], users))]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        import app
+        app.open_knowledge_base()
+        load_seconds = time.perf_counter() - started
+        rules = time_rules(app.metta, sample, options["repeat"])
+        endpoints = time_endpoints(app.app.test_client(), app.rec_cache, sample, options["repeat"])
+    return {
+        "users": users,
+        "movies": movies,
+        "facts": len(facts),
+        "load_seconds": round(load_seconds, 3),
+        "rules": rules,
+        "endpoints": endpoints,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, density=0.05, genres=8, directors=20, skew=1.0, sample=5, repeat=3, seed=0,
+                   rules_from="recommendation.metta"):
+    """
+    Benchmark every (users, movies) size in its own process and return the results,
+    with per-rule and per-endpoint scaling curves of mean time against fact count.
+    """
+    options = {"density": density, "genres": genres, "directors": directors, "skew": skew, "sample": sample,
+               "repeat": repeat, "seed": seed, "rules_from": os.path.abspath(rules_from)}
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(_bench_size, [(size, options) for size in sizes]):
+            print(f"{result['users']} users x {result['movies']} movies ({result['facts']} facts): "
+                  f"loaded in {result['load_seconds']}s")
+            results.append(result)
+    curves = {}
+    for result in results:
+        for group in ("rules", "endpoints"):
+            for name, stats in result[group].items():
+                curves.setdefault(name, []).append([result["facts"], stats["mean_ms"]])
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": {key: value for key, value in options.items() if key != "rules_from"},
+        },
+        "results": results,
+        "curves": curves,
+    }
+
+
+def print_curves(report):
+    sizes = [f"{r['users']}x{r['movies']}" for r in report["results"]]
+    print(f"{'mean ms':<32}" + "".join(f"{size:>14}" for size in sizes))
+    for name, points in report["curves"].items():
+        print(f"{name:<32}" + "".join(f"{mean_ms:>14.2f}" for _, mean_ms in points))
+
+
+def compare(baseline, candidate):
+    """
+    Print the candidate/baseline ratio of mean times for every rule and endpoint at
+    every size the two reports share.
+    """
+    base = {(r["users"], r["movies"]): r for r in baseline["results"]}
+    print(f"{baseline['meta'].get('commit')} -> {candidate['meta'].get('commit')}")
+    for result in candidate["results"]:
+        key = (result["users"], result["movies"])
+        if key not in base:
+            continue
+        print(f"\n{key[0]} users x {key[1]} movies")
+        for group in ("rules", "endpoints"):
+            for name, stats in result[group].items():
+                old = base[key][group].get(name)
+                if old is None:
+                    continue
+                ratio = stats["mean_ms"] / old["mean_ms"] if old["mean_ms"] else float("inf")
+                print(f"  {name:<32}{old['mean_ms']:>12.2f}{stats['mean_ms']:>12.2f}{ratio:>9.2f}x")
+
+
+def _parse_sizes(text):
+    return [tuple(int(part) for part in size.split("x")) for size in text.split(",")]
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate synthetic knowledge bases and benchmark rules and endpoints.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    def add_kb_options(command):
+        command.add_argument("--density", type=float, default=0.05, help="fraction of movies each user likes")
+        command.add_argument("--genres", type=int, default=8)
+        command.add_argument("--directors", type=int, default=20)
+        command.add_argument("--skew", type=float, default=1.0,
+                             help="Zipf exponent for genre, director and like popularity (0 = uniform)")
+        command.add_argument("--seed", type=int, default=0)
+
+    generate = commands.add_parser("generate", help="write a synthetic .metta file or bulk-import CSVs")
+    generate.add_argument("--users", type=int, required=True)
+    generate.add_argument("--movies", type=int, required=True)
+    generate.add_argument("--format", choices=["metta", "import"], default="metta")
+    generate.add_argument("--output", required=True, help=".metta file, or directory for import CSVs")
+    add_kb_options(generate)
+
+    run = commands.add_parser("run", help="time every rule and endpoint at each size")
+    run.add_argument("--sizes", type=_parse_sizes, default="25x50,50x100,100x200",
+                     help="comma-separated USERSxMOVIES sizes")
+    run.add_argument("--sample", type=int, default=5, help="users timed per size")
+    run.add_argument("--repeat", type=int, default=3, help="runs per user per rule/endpoint")
+    run.add_argument("--output", help="write the JSON report here")
+    add_kb_options(run)
+
+    diff = commands.add_parser("compare", help="compare two JSON reports")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    args = arg_parser.parse_args()
+
+    if args.command == "generate":
+        facts = generate_kb(args.users, args.movies, args.density, args.genres, args.directors, args.skew,
+                            seed=args.seed)
+        if args.format == "metta":
+            write_metta(args.output, facts)
+        else:
+            write_import_files(args.output, facts)
+        print(f"Wrote {len(facts)} facts to {args.output}")
+    elif args.command == "run":
+        report = run_benchmarks(args.sizes, args.density, args.genres, args.directors, args.skew, args.sample,
+                                args.repeat, args.seed)
+        print_curves(report)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Wrote {args.output}")
+    else:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.candidate, encoding="utf-8") as f:
+            candidate = json.load(f)
+        compare(baseline, candidate)
@@ -0,0 +1,186 @@
+import logging
+import threading
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_ROWS = 1024
+
+
+class CollaborativeEngine:
+    """
+    Sparse user x item like matrix with interned integer IDs.
+
+    Neighbours are scored with cosine or Jaccard similarity computed from one sparse
+    matrix product, and new likes are buffered and folded into the CSR matrix on the
+    next query, so writes stay O(1). The buffer and the fold are guarded by a lock, so
+    readers may fold while a writer adds likes; each fold publishes a new matrix.
+    """
+
+    def __init__(self, metric="cosine"):
+        if metric not in ("cosine", "jaccard"):
+            raise ValueError(f"Unsupported similarity metric: {metric}")
+        self.metric = metric
+        self.user_ids = {}
+        self.users = []
+        self.item_ids = {}
+        self.items = []
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _intern_user(self, user):
+        uid = self.user_ids.get(user)
+        if uid is None:
+            uid = self.user_ids[user] = len(self.users)
+            self.users.append(user)
+        return uid
+
+    def _intern_item(self, movie):
+        iid = self.item_ids.get(movie)
+        if iid is None:
+            iid = self.item_ids[movie] = len(self.items)
+            self.items.append(movie)
+        return iid
+
+    def add_like(self, user, movie):
+        """
+        Record a like. The matrix is rebuilt lazily before the next query.
+        """
+        with self._lock:
+            pair = (self._intern_user(user), self._intern_item(movie))
+            if pair in self._pending or self._has(pair):
+                return False
+            self._pending.add(pair)
+            return True
+
+    def _has(self, pair):
+        uid, iid = pair
+        if uid >= self._matrix.shape[0] or iid >= self._matrix.shape[1]:
+            return False
+        return self._matrix[uid, iid] != 0
+
+    @property
+    def matrix(self):
+        """
+        The CSR like matrix, with any buffered likes folded in as one sparse delta.
+        """
+        with self._lock:
+            shape = (len(self.users), len(self.items))
+            if self._pending or self._matrix.shape != shape:
+                rows, cols = zip(*self._pending) if self._pending else ((), ())
+                delta = sparse.csr_matrix(
+                    (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape
+                )
+                base = self._matrix.copy()
+                base.resize(shape)
+                self._matrix = (base + delta).tocsr()
+                self._pending.clear()
+            return self._matrix
+
+    def similarity(self, user_rows):
+        """
+        Similarity of each user in user_rows against every user, as a dense array of
+        shape (len(user_rows), n_users). Users never share a score with themselves.
+        """
+        matrix = self.matrix
+        rows = matrix[user_rows]
+        overlap = (rows @ matrix.T).toarray()
+        counts = np.asarray(matrix.sum(axis=1)).ravel()
+        row_counts = counts[user_rows][:, None]
+        if self.metric == "cosine":
+            denom = np.sqrt(row_counts * counts[None, :])
+        else:
+            denom = row_counts + counts[None, :] - overlap
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(denom > 0, overlap / denom, 0.0)
+        scores[np.arange(len(user_rows)), user_rows] = 0.0
+        return scores
+
+    def top_neighbors(self, users, k=None):
+        """
+        Ranked (neighbour, score) lists for a batch of users. Only users sharing at least
+        one like are returned; k limits each list. Similarities are computed for
+        _CHUNK_ROWS users at a time, so a batch of every user never materialises the full
+        user x user matrix.
+        """
+        known = [user for user in users if user in self.user_ids]
+        results = {user: [] for user in users}
+        if not known or not self.items:
+            return results
+        for start in range(0, len(known), _CHUNK_ROWS):
+            chunk = known[start:start + _CHUNK_ROWS]
+            scores = self.similarity(np.array([self.user_ids[user] for user in chunk]))
+            for i, user in enumerate(chunk):
+                results[user] = self._top_users(scores[i], k)
+        return results
+
+    def neighbors_of(self, liked, k=None, exclude=()):
+        """
+        Ranked (user, score) pairs for users similar to someone who likes exactly the movies
+        in liked, e.g. a user held on another shard. Scores match top_neighbors for that user.
+        """
+        liked = set(liked)
+        cols = [self.item_ids[movie] for movie in liked if movie in self.item_ids]
+        if not cols or not self.users:
+            return []
+        matrix = self.matrix
+        overlap = np.asarray(matrix[:, cols].sum(axis=1)).ravel()
+        counts = np.asarray(matrix.sum(axis=1)).ravel()
+        if self.metric == "cosine":
+            denom = np.sqrt(len(liked) * counts)
+        else:
+            denom = len(liked) + counts - overlap
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(denom > 0, overlap / denom, 0.0)
+        for user in exclude:
+            if user in self.user_ids:
+                scores[self.user_ids[user]] = 0.0
+        return self._top_users(scores, k)
+
+    def _top_users(self, row, k=None):
+        candidates = np.flatnonzero(row > 0)
+        if k is not None and len(candidates) > k:
+            candidates = candidates[np.argpartition(-row[candidates], k - 1)[:k]]
+        order = sorted(candidates, key=lambda c: (-row[c], self.users[c]))
+        return [(self.users[c], float(row[c])) for c in order]
+
+    def recommend(self, users, k_neighbors=None):
+        """
+        Collaborative candidates for a batch of users: every movie liked by a neighbour,
+        scored by the summed similarity of the neighbours who like it. Users are scored
+        _CHUNK_ROWS at a time.
+        """
+        users = list(users)
+        results = {}
+        for start in range(0, len(users), _CHUNK_ROWS):
+            chunk = users[start:start + _CHUNK_ROWS]
+            neighbors = self.top_neighbors(chunk, k_neighbors)
+            rows, cols, data = [], [], []
+            for i, user in enumerate(chunk):
+                for other, score in neighbors[user]:
+                    rows.append(i)
+                    cols.append(self.user_ids[other])
+                    data.append(score)
+            matrix = self.matrix
+            weights = sparse.csr_matrix((data, (rows, cols)), shape=(len(chunk), matrix.shape[0]), dtype=np.float32)
+            item_scores = (weights @ matrix).toarray()
+            for i, user in enumerate(chunk):
+                row = item_scores[i]
+                order = sorted(np.flatnonzero(row > 0), key=lambda c: (-row[c], self.items[c]))
+                results[user] = [(self.items[c], float(row[c])) for c in order]
+        return results
+
+
+def build_engine(index, metric="cosine"):
+    """
+    Build a CollaborativeEngine from the likes held by a KnowledgeIndex.
+    """
+    engine = CollaborativeEngine(metric)
+    for user, movies in sorted(index.likes_of(index.users()).items()):
+        for movie in sorted(movies):
+            engine.add_like(user, movie)
+    logger.info("Collaborative engine built: %d users x %d movies", len(engine.users), len(engine.items))
+    return engine
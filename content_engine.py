@@ -0,0 +1,219 @@
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEATURE_WEIGHTS = {
+    "genre": 1.0,
+    "director": 1.0,
+    "rating": 0.5,
+}
+DEFAULT_ATTRIBUTES = tuple(name.strip() for name in os.getenv("CONTENT_ATTRIBUTES", "").split(",") if name.strip())
+DEFAULT_NEIGHBORS = int(os.getenv("CONTENT_NEIGHBORS", 0))
+_CHUNK_ROWS = 1024
+
+
+def rating_bucket(rating):
+    """
+    The whole-point bucket a catalog rating falls in, e.g. 8.7 -> 8.
+    """
+    return int(math.floor(rating))
+
+
+class ContentEngine:
+    """
+    Sparse movie x feature matrix over genre, director, rating bucket and any extra
+    attribute relations, with L2-normalised rows.
+
+    A user's profile is the sum of the rows of the movies they like; every candidate is
+    scored by cosine similarity to the profile in one sparse matrix product per batch of
+    users. With neighbors=k a precomputed item-item table of each movie's k most similar
+    movies is used instead, so large catalogs score only the neighbours of liked movies.
+    Features are added and the matrices rebuilt under a lock; each query scores against one
+    snapshot of them.
+    """
+
+    def __init__(self, weights=None, attributes=DEFAULT_ATTRIBUTES, neighbors=DEFAULT_NEIGHBORS):
+        self.weights = dict(DEFAULT_FEATURE_WEIGHTS, **(weights or {}))
+        self.attributes = set(attributes)
+        self.neighbors = neighbors
+        self.item_ids = {}
+        self.items = []
+        self.feature_ids = {}
+        self.features = []
+        self._rows = []
+        self._matrix = None
+        self._neighbor_table = None
+        self._lock = threading.RLock()
+
+    def _intern_item(self, movie):
+        iid = self.item_ids.get(movie)
+        if iid is None:
+            iid = self.item_ids[movie] = len(self.items)
+            self.items.append(movie)
+            self._rows.append({})
+        return iid
+
+    def _intern_feature(self, feature):
+        fid = self.feature_ids.get(feature)
+        if fid is None:
+            fid = self.feature_ids[feature] = len(self.features)
+            self.features.append(feature)
+        return fid
+
+    def indexes(self, relation):
+        """
+        True if facts of this relation become features.
+        """
+        return relation in ("genre", "director") or relation in self.attributes
+
+    def add_feature(self, movie, kind, value, weight=None):
+        """
+        Give the movie the feature (kind, value). The matrix is rebuilt lazily before the next query.
+        """
+        with self._lock:
+            row = self._rows[self._intern_item(movie)]
+            fid = self._intern_feature((kind, str(value)))
+            weight = weight if weight is not None else self.weights.get(kind, 1.0)
+            if row.get(fid) == weight:
+                return False
+            row[fid] = weight
+            self._invalidate()
+            return True
+
+    def set_rating(self, movie, rating):
+        """
+        Put the movie in the bucket of its catalog rating, replacing any earlier bucket.
+        """
+        with self._lock:
+            row = self._rows[self._intern_item(movie)]
+            for fid in [fid for fid in row if self.features[fid][0] == "rating"]:
+                del row[fid]
+            self.add_feature(movie, "rating", rating_bucket(rating))
+
+    def _invalidate(self):
+        self._matrix = None
+        self._neighbor_table = None
+
+    @property
+    def matrix(self):
+        """
+        The CSR movie x feature matrix with unit-length rows.
+        """
+        with self._lock:
+            if self._matrix is None:
+                rows, cols, data = [], [], []
+                for iid, row in enumerate(self._rows):
+                    norm = math.sqrt(sum(weight * weight for weight in row.values()))
+                    for fid, weight in row.items():
+                        rows.append(iid)
+                        cols.append(fid)
+                        data.append(weight / norm)
+                self._matrix = sparse.csr_matrix((data, (rows, cols)), shape=(len(self.items), len(self.features)),
+                                                 dtype=np.float32)
+            return self._matrix
+
+    def neighbor_table(self):
+        """
+        Sparse movie x movie table holding each movie's `neighbors` most similar movies,
+        computed in row chunks so the full similarity matrix is never materialised.
+        """
+        with self._lock:
+            if self._neighbor_table is None:
+                matrix = self.matrix
+                n = matrix.shape[0]
+                k = min(self.neighbors, max(n - 1, 0))
+                rows, cols, data = [], [], []
+                for start in range(0, n, _CHUNK_ROWS):
+                    block = (matrix[start:start + _CHUNK_ROWS] @ matrix.T).toarray()
+                    for offset, row in enumerate(block):
+                        row[start + offset] = 0.0
+                        if k == 0:
+                            continue
+                        top = np.argpartition(-row, k - 1)[:k]
+                        top = top[row[top] > 0]
+                        rows.extend([start + offset] * len(top))
+                        cols.extend(top)
+                        data.extend(row[top])
+                self._neighbor_table = sparse.csr_matrix((data, (rows, cols)), shape=(n, n), dtype=np.float32)
+                logger.info("Content neighbour table built: %d movies x %d neighbours", n, k)
+            return self._neighbor_table
+
+    def _snapshot(self):
+        """
+        The matrix and, with neighbors set, the neighbour table, built from the same features.
+        """
+        with self._lock:
+            return self.matrix, self.neighbor_table() if self.neighbors else None
+
+    def _likes_matrix(self, users, likes_by_user, n_items):
+        rows, cols = [], []
+        for i, user in enumerate(users):
+            for movie in likes_by_user.get(user, ()):
+                iid = self.item_ids.get(movie)
+                if iid is not None and iid < n_items:
+                    rows.append(i)
+                    cols.append(iid)
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                 shape=(len(users), n_items))
+
+    def scores(self, users, likes_by_user):
+        """
+        Content score of every movie for each user, as a dense array of shape
+        (len(users), n_movies): cosine similarity to the user's profile, or with a
+        neighbour table the summed similarity to the user's liked movies.
+        """
+        matrix, table = self._snapshot()
+        likes = self._likes_matrix(users, likes_by_user, matrix.shape[0])
+        if table is not None:
+            return (likes @ table).toarray()
+        profiles = (likes @ matrix).toarray()
+        norms = np.linalg.norm(profiles, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            profiles = np.where(norms[:, None] > 0, profiles / norms[:, None], 0.0)
+        return np.asarray(matrix @ profiles.T).T
+
+    def recommend(self, users, likes_by_user, k=None):
+        """
+        Ranked (movie, score) lists for a batch of users, leaving out the movies each user
+        already likes. Only movies with a positive score are returned; k limits each list.
+        """
+        results = {user: [] for user in users}
+        if not users or not self.items:
+            return results
+        scores = self.scores(users, likes_by_user)
+        for i, user in enumerate(users):
+            row = scores[i]
+            for movie in likes_by_user.get(user, ()):
+                iid = self.item_ids.get(movie)
+                if iid is not None and iid < len(row):
+                    row[iid] = 0.0
+            results[user] = self._top(row, k)
+        return results
+
+    def similar_movies(self, movie, k=None):
+        """
+        The movies most similar to the given one, as ranked (movie, score) pairs.
+        """
+        matrix, table = self._snapshot()
+        iid = self.item_ids.get(movie)
+        if iid is None or iid >= matrix.shape[0]:
+            return []
+        if table is not None:
+            row = table[iid].toarray().ravel()
+        else:
+            row = (matrix @ matrix[iid].T).toarray().ravel()
+            row[iid] = 0.0
+        return self._top(row, k)
+
+    def _top(self, row, k=None):
+        candidates = np.flatnonzero(row > 0)
+        if k is not None and len(candidates) > k:
+            candidates = candidates[np.argpartition(-row[candidates], k - 1)[:k]]
+        order = sorted(candidates, key=lambda c: (-row[c], self.items[c]))
+        return [(self.items[c], float(row[c])) for c in order]
@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESTART = float(os.getenv("GRAPH_RESTART", 0.15))
+DEFAULT_MEMO_BYTES = int(os.getenv("GRAPH_MEMO_BYTES", 64 * 2 ** 20))
+MAX_DEPTH = 5
+
+
+def walk_steps(depth):
+    """
+    Edges walked for a depth: each hop goes from a movie through a genre, director or
+    user to another movie, after the first edge from the user to a liked movie. Depth 1
+    reaches what content-similarity, director-match and collaborative-rec reach.
+    """
+    return 2 * depth + 1
+
+
+class GraphRecommender:
+    """
+    Undirected user-movie-genre/director graph with interned integer node IDs.
+
+    Movies are scored by personalised PageRank truncated at the requested depth: a random
+    walk from the user that restarts with probability `restart` at each step, computed by
+    sparse matrix-vector iteration. The per-step frontier vectors of recent users are
+    memoised up to memo_bytes in total, least recently used first out, so a deeper query
+    extends a shallower one instead of starting over; the memo is dropped whenever an edge
+    is added. Edges are added and the matrix rebuilt under a
+    lock, and each walk runs on one snapshot of the matrix and the nodes it covers.
+    """
+
+    def __init__(self, restart=DEFAULT_RESTART, memo_bytes=DEFAULT_MEMO_BYTES):
+        self.restart = restart
+        self.memo_bytes = memo_bytes
+        self.node_ids = {}
+        self.nodes = []
+        self._edges = set()
+        self._pending = False
+        self._transition = None
+        self._frontiers = OrderedDict()
+        self._memo_used = 0
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def _intern(self, node):
+        nid = self.node_ids.get(node)
+        if nid is None:
+            nid = self.node_ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return nid
+
+    def add_edge(self, source, target):
+        """
+        Connect two (kind, name) nodes, e.g. ('user', 'alice') and ('movie', 'inception').
+        The transition matrix is rebuilt lazily before the next walk.
+        """
+        with self._lock:
+            edge = (self._intern(source), self._intern(target))
+            if edge in self._edges or edge[::-1] in self._edges:
+                return False
+            self._edges.add(edge)
+            self._pending = True
+            self._generation += 1
+            self._frontiers.clear()
+            self._memo_used = 0
+            return True
+
+    @property
+    def transition(self):
+        """
+        CSR matrix T with T[j, i] the probability of stepping from node i to node j, so a
+        distribution over nodes advances one step as T @ x.
+        """
+        with self._lock:
+            if self._pending or self._transition is None or self._transition.shape[0] != len(self.nodes):
+                n = len(self.nodes)
+                rows, cols = zip(*self._edges) if self._edges else ((), ())
+                ones = np.ones(len(rows), dtype=np.float32)
+                adjacency = sparse.csr_matrix((ones, (rows, cols)), shape=(n, n))
+                adjacency = (adjacency + adjacency.T).tocsr()
+                degree = np.asarray(adjacency.sum(axis=1)).ravel()
+                with np.errstate(divide="ignore"):
+                    inverse = np.where(degree > 0, 1.0 / degree, 0.0)
+                self._transition = (adjacency @ sparse.diags(inverse)).tocsr()
+                self._pending = False
+            return self._transition
+
+    def frontiers(self, user, steps):
+        """
+        Walk distributions after 0..steps steps from the user, extending the memoised ones.
+        All of them are computed on the same transition matrix; the extended list is only
+        memoised if no edge was added meanwhile.
+        """
+        with self._lock:
+            transition = self.transition
+            generation = self._generation
+            start = self.node_ids.get(("user", user))
+            cached = list(self._frontiers.get(user, ()))
+        if start is None or start >= transition.shape[0]:
+            return []
+        if not cached:
+            origin = np.zeros(transition.shape[0], dtype=np.float32)
+            origin[start] = 1.0
+            cached = [origin]
+        while len(cached) <= steps:
+            cached.append(transition @ cached[-1])
+        with self._lock:
+            if generation == self._generation:
+                self._remember(user, cached)
+        return cached[:steps + 1]
+
+    def _remember(self, user, frontiers):
+        """
+        Memoise a user's frontiers, evicting the least recently used users until the memo
+        fits in memo_bytes. Lists larger than the whole budget are not kept. Caller holds the lock.
+        """
+        size = sum(frontier.nbytes for frontier in frontiers)
+        previous = self._frontiers.pop(user, None)
+        if previous is not None:
+            self._memo_used -= sum(frontier.nbytes for frontier in previous)
+        if size > self.memo_bytes:
+            return
+        while self._frontiers and self._memo_used + size > self.memo_bytes:
+            _, evicted = self._frontiers.popitem(last=False)
+            self._memo_used -= sum(frontier.nbytes for frontier in evicted)
+        self._frontiers[user] = frontiers
+        self._memo_used += size
+
+    def walk(self, user, steps):
+        """
+        Truncated personalised PageRank of every node for the user, and the first step at
+        which each node was reached (-1 if never).
+        """
+        frontiers = self.frontiers(user, steps)
+        n = len(frontiers[0]) if frontiers else 0
+        scores = np.zeros(n, dtype=np.float64)
+        reached = np.full(n, -1)
+        decay = 1.0
+        for step, frontier in enumerate(frontiers):
+            scores += self.restart * decay * frontier
+            reached[(reached < 0) & (frontier > 0)] = step
+            decay *= 1.0 - self.restart
+        return scores, reached
+
+    def _ranked(self, user, kind, steps, exclude=(), limit=None, offset=0):
+        scores, reached = self.walk(user, steps)
+        candidates = [
+            (name, float(scores[nid]), int(reached[nid]))
+            for nid, (node_kind, name) in enumerate(self.nodes[:len(scores)])
+            if node_kind == kind and scores[nid] > 0 and name not in exclude
+        ]
+        candidates.sort(key=lambda item: (-item[1], item[0]))
+        end = None if limit is None else offset + limit
+        return candidates[offset:end], len(candidates)
+
+    def recommend(self, user, depth=1, exclude=(), limit=None, offset=0):
+        """
+        One page of (movie, score, hops) for movies within depth hops of the user's likes,
+        best first, and the total number of candidates. Movies in exclude are left out.
+        """
+        steps = walk_steps(depth)
+        ranked, total = self._ranked(user, "movie", steps, exclude, limit, offset)
+        return [(movie, score, (reached - 1) // 2) for movie, score, reached in ranked], total
+
+    def similar_users(self, user, depth=1, limit=None):
+        """
+        Other users connected to the user within depth hops, as ranked (user, score) pairs.
+        """
+        ranked, _ = self._ranked(user, "user", walk_steps(depth) - 1, {user}, limit)
+        return [(other, score) for other, score, _ in ranked]
@@ -0,0 +1,221 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import time
+
+from hyperon import E, S, ValueAtom
+
+from kb_index import get_index
+from utils import initialize_metta
+
+logger = logging.getLogger(__name__)
+
+
+def slug(value, prefix=None):
+    """
+    Turn an external ID or name into a MeTTa symbol, e.g. "Christopher Nolan" -> christopher-nolan.
+    Purely numeric IDs get a prefix (user-1, movie-1) so they are not read back as numbers.
+    """
+    text = re.sub(r"[^0-9a-z]+", "-", str(value).strip().lower()).strip("-")
+    if prefix and (not text or text[0].isdigit()):
+        text = f"{prefix}-{text}"
+    return text
+
+
+def read_records(path, chunk_size=10000):
+    """
+    Stream rows from a CSV (with header) or JSON-lines file as lists of dicts of at most chunk_size.
+    """
+    chunk = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith((".jsonl", ".ndjson", ".json")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _field(row, *names, default=None):
+    for name in names:
+        value = row.get(name)
+        if value not in (None, ""):
+            return value
+    return default
+
+
+def _number(value):
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+class BulkImporter:
+    """
+    Streams MovieLens-style movies, likes, watches and ratings into a MeTTa space.
+
+    Facts are built directly as atoms and added in batches, so the program text is never
+    assembled in memory. Facts the fact index already holds, from the space or from earlier
+    in this import, are skipped, and throughput is reported per file.
+    """
+
+    def __init__(self, metta, batch_size=10000, like_threshold=None):
+        self.metta = metta
+        self.space = metta.space()
+        self.index = get_index(metta)
+        self.batch_size = batch_size
+        self.like_threshold = like_threshold
+        self.rows = 0
+        self.added = 0
+        self.duplicates = 0
+        self.elapsed = 0.0
+        self._batch = []
+
+    def _emit(self, fact):
+        if self.index is not None and self.index.has_fact(fact):
+            self.duplicates += 1
+            return
+        if self.index is not None and fact[0] == "user-rating" and (fact[1], fact[2]) in self.index.aggregates.user_ratings:
+            # A re-rating: the index keeps only the latest score, so look for this one in the space
+            self.flush()
+            if not self.space.query(fact_to_atom(fact)).is_empty():
+                self.duplicates += 1
+                return
+        if self.index is not None:
+            self.index.add_fact(fact)
+        self._batch.append(fact)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for fact in self._batch:
+            self.space.add_atom(fact_to_atom(fact))
+        self.added += len(self._batch)
+        self._batch = []
+
+    def _movie_facts(self, row):
+        movie = slug(_field(row, "movieId", "movie_id", "id", "movie"), "movie")
+        title = _field(row, "title", default=movie)
+        genres = [g for g in re.split(r"[|,]", _field(row, "genres", "genre", default="")) if g.strip()]
+        director = _field(row, "director")
+        rating = _field(row, "rating")
+        # Like a missing genre or director, a missing rating is left empty rather than
+        # recorded as 0, which scoring would take for a real (bottom) rating
+        facts = [("movie", movie, title, genres[0] if genres else "", director or "",
+                  _number(rating) if rating is not None else "")]
+        facts.extend(("genre", movie, slug(genre)) for genre in genres if slug(genre) != "no-genres-listed")
+        if director:
+            facts.append(("director", movie, slug(director)))
+        if rating is not None:
+            facts.append(("rating", movie, _number(rating)))
+        return facts
+
+    def _pair_facts(self, relation):
+        def facts(row):
+            user = slug(_field(row, "userId", "user_id", "user"), "user")
+            movie = slug(_field(row, "movieId", "movie_id", "movie"), "movie")
+            return [(relation, user, movie)]
+        return facts
+
+    def _rating_facts(self, row):
+        user = slug(_field(row, "userId", "user_id", "user"), "user")
+        movie = slug(_field(row, "movieId", "movie_id", "movie"), "movie")
+        rating = _number(_field(row, "rating"))
+        facts = [("user-rating", user, movie, rating), ("watched", user, movie)]
+        if self.like_threshold is not None and rating >= self.like_threshold:
+            facts.append(("likes", user, movie))
+        return facts
+
+    def import_file(self, path, kind, chunk_size=10000):
+        """
+        Import one file of the given kind: movies, likes, watched or ratings.
+        """
+        to_facts = {
+            "movies": self._movie_facts,
+            "likes": self._pair_facts("likes"),
+            "watched": self._pair_facts("watched"),
+            "ratings": self._rating_facts,
+        }[kind]
+        started = time.perf_counter()
+        rows = 0
+        added_before = self.added + len(self._batch)
+        for chunk in read_records(path, chunk_size):
+            for row in chunk:
+                for fact in to_facts(row):
+                    self._emit(fact)
+            rows += len(chunk)
+            rate = rows / max(time.perf_counter() - started, 1e-9)
+            logger.info("%s: %d rows imported (%.0f rows/s)", path, rows, rate)
+        self.flush()
+        elapsed = time.perf_counter() - started
+        self.rows += rows
+        self.elapsed += elapsed
+        logger.info("Imported %s from %s: %d rows, %d facts added in %.2fs (%.0f rows/s)",
+                    kind, path, rows, self.added - added_before, elapsed, rows / max(elapsed, 1e-9))
+        return rows
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "facts_added": self.added,
+            "duplicates_skipped": self.duplicates,
+            "seconds": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows / self.elapsed, 1) if self.elapsed else 0.0,
+        }
+
+
+def fact_to_atom(fact):
+    """
+    Build the atom for a fact tuple. Numbers and the title/genre/director fields of
+    (movie ...) facts become grounded values; everything else is a symbol.
+    """
+    return E(*[ValueAtom(part) if not isinstance(part, str) or (fact[0] == "movie" and i >= 2) else S(part)
+               for i, part in enumerate(fact)])
+
+
+def bulk_import(metta, sources, batch_size=10000, like_threshold=None):
+    """
+    Import a list of (kind, path) sources into metta and return the import stats.
+    """
+    importer = BulkImporter(metta, batch_size, like_threshold)
+    for kind, path in sources:
+        importer.import_file(path, kind, batch_size)
+    return importer.stats()
+
+
+if __name__ == "__main__":
+    from metrics import configure_logging
+    from persistence import KnowledgeStore
+
+    configure_logging()
+
+    arg_parser = argparse.ArgumentParser(
+        description="Stream MovieLens-style CSV/JSONL files into the knowledge base."
+    )
+    arg_parser.add_argument("--metta", default=os.getenv("METTA_FILE_PATH", "recommendation.metta"))
+    arg_parser.add_argument("--data-dir", default=os.getenv("PERSISTENCE_DIR"),
+                            help="persist the result as a snapshot the server loads on startup")
+    arg_parser.add_argument("--movies", action="append", default=[])
+    arg_parser.add_argument("--likes", action="append", default=[])
+    arg_parser.add_argument("--watched", action="append", default=[])
+    arg_parser.add_argument("--ratings", action="append", default=[])
+    arg_parser.add_argument("--batch-size", type=int, default=10000)
+    arg_parser.add_argument("--like-threshold", type=float, default=None,
+                            help="also record a like for ratings at or above this value")
+    args = arg_parser.parse_args()
+
+    sources = ([("movies", p) for p in args.movies] + [("likes", p) for p in args.likes] +
+               [("watched", p) for p in args.watched] + [("ratings", p) for p in args.ratings])
+    store = KnowledgeStore(args.data_dir) if args.data_dir else None
+    metta = store.open(args.metta) if store else initialize_metta(args.metta)
+    print(json.dumps(bulk_import(metta, sources, args.batch_size, args.like_threshold)))
+    if store:
+        store.snapshot(metta)
+        store.close()
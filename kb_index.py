@@ -0,0 +1,611 @@
+import logging
+import threading
+from bisect import bisect_right, insort
+from collections import defaultdict
+
+from hyperon import AtomKind, E, OperationAtom, S, ValueAtom
+
+from aggregates import MovieAggregates
+from content_engine import ContentEngine
+from graph_engine import MAX_DEPTH, GraphRecommender
+
+logger = logging.getLogger(__name__)
+
+
+def atom_to_value(atom):
+    """
+    Convert a MeTTa atom to a plain Python value (symbol name, grounded value or tuple).
+    """
+    kind = atom.get_metatype()
+    if kind == AtomKind.EXPR:
+        return tuple(atom_to_value(child) for child in atom.get_children())
+    if kind == AtomKind.SYMBOL:
+        return atom.get_name()
+    if kind == AtomKind.GROUNDED:
+        try:
+            return atom.get_object().value
+        except (TypeError, AttributeError):
+            return str(atom)
+    return str(atom)
+
+
+class MovieCatalog:
+    """
+    Movie id -> full record (title, genre, director, rating) built from (movie ...) facts.
+    """
+
+    def __init__(self):
+        self.movies = {}
+
+    def add_movie(self, fact):
+        _, movie_id, title, genre, director, rating = fact
+        self.movies[movie_id] = {
+            'id': movie_id,
+            'title': title,
+            'genre': genre,
+            'director': director,
+            'rating': rating,
+        }
+
+    def ids(self):
+        return list(self.movies)
+
+    def get(self, movie_id):
+        return self.movies.get(movie_id)
+
+    def hydrate(self, movie_ids):
+        """
+        Resolve a list of movie IDs to records in one pass, keeping the input order.
+        Unknown IDs fall back to {'id': movie_id, 'title': movie_id}.
+        """
+        records = []
+        for movie_id in movie_ids:
+            if not movie_id:
+                continue
+            record = self.movies.get(movie_id)
+            records.append(dict(record) if record else {'id': movie_id, 'title': movie_id})
+        return records
+
+
+class SortedRegistry:
+    """
+    Sorted set of IDs (users or movies) kept up to date as facts arrive, so listings are
+    served in order and paged by key without rescanning the space.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._members = set()
+
+    def add(self, item):
+        if item in self._members:
+            return False
+        self._members.add(item)
+        insort(self._items, item)
+        return True
+
+    def page(self, after=None, limit=None):
+        """
+        Up to limit IDs sorted after the given one, and the ID to continue from (None at the end).
+        """
+        start = bisect_right(self._items, after) if after is not None else 0
+        end = len(self._items) if limit is None else start + limit
+        items = self._items[start:end]
+        return items, (items[-1] if items and end < len(self._items) else None)
+
+    def __contains__(self, item):
+        return item in self._members
+
+    def __len__(self):
+        return len(self._items)
+
+
+def describe_evidence(item):
+    """
+    Human-readable explanation for one piece of recommendation evidence,
+    worded like the explain-genre / explain-director / explain-collab rules.
+    """
+    if item[0] == 'genre':
+        return f"Similar genre to {item[1]}"
+    if item[0] == 'director':
+        return f"Same director as {item[1]}"
+    return f"Similar user {item[1]} likes this"
+
+
+def is_movie_fact(fact):
+    return isinstance(fact, tuple) and len(fact) == 6 and fact[0] == 'movie' and isinstance(fact[1], str)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_rating_fact(fact):
+    """
+    (user-rating user movie score) or (rating movie score).
+    """
+    if not isinstance(fact, tuple) or not fact:
+        return False
+    if fact[0] == 'user-rating':
+        return len(fact) == 4 and isinstance(fact[1], str) and isinstance(fact[2], str) and is_number(fact[3])
+    return fact[0] == 'rating' and len(fact) == 3 and isinstance(fact[1], str) and is_number(fact[2])
+
+
+def build_catalog(metta):
+    """
+    Build a MovieCatalog from a single scan of the MeTTa space.
+    """
+    catalog = MovieCatalog()
+    for atom in metta.space().get_atoms():
+        fact = atom_to_value(atom)
+        if is_movie_fact(fact):
+            catalog.add_movie(fact)
+    return catalog
+
+
+class KnowledgeIndex:
+    """
+    Hash indexes over the likes/genre/director facts used by the recommendation rules,
+    plus the watched history, the movie catalog, the popularity/rating aggregates, the
+    content feature matrix, the user-movie-genre/director graph and registries of every
+    known user and movie.
+
+    Facts are indexed under a lock that the lookups below also take, so a request thread
+    never iterates a set while a write changes it. Code outside the index reads a user's
+    likes and watches through liked_movies(), watched_movies() and likes_of(), which return
+    copies, rather than through the sets themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.catalog = MovieCatalog()
+        self.watched_by_user = defaultdict(set)
+        self.likes_by_user = defaultdict(set)
+        self.users_by_movie = defaultdict(set)
+        self.movies_by_genre = defaultdict(set)
+        self.genres_by_movie = defaultdict(set)
+        self.movies_by_director = defaultdict(set)
+        self.directors_by_movie = defaultdict(set)
+        self.rating_facts = {}
+        self.declared_users = set()
+        self.preferences_by_user = defaultdict(set)
+        self.collaborative = None
+        self.aggregates = MovieAggregates()
+        self.content = ContentEngine()
+        self.graph = GraphRecommender()
+        self.user_registry = SortedRegistry()
+        self.movie_registry = SortedRegistry()
+
+    def add_fact(self, fact):
+        """
+        Index a fact given as a tuple like ('likes', 'alice', 'inception').
+        Returns True if the fact belongs to one of the indexed relations.
+        """
+        with self._lock:
+            if is_movie_fact(fact):
+                self.catalog.add_movie(fact)
+                self.movie_registry.add(fact[1])
+                if is_number(fact[5]):
+                    self.aggregates.set_catalog_rating(fact[1], fact[5])
+                    self.content.set_rating(fact[1], fact[5])
+                return True
+            if is_rating_fact(fact):
+                if fact[0] == 'user-rating':
+                    self.aggregates.add_rating(fact[1], fact[2], fact[3])
+                    self.user_registry.add(fact[1])
+                else:
+                    self.rating_facts[fact[1]] = fact[2]
+                    self.aggregates.set_catalog_rating(fact[1], fact[2])
+                return True
+            if isinstance(fact, tuple) and len(fact) == 2 and fact[0] == 'user' and isinstance(fact[1], str):
+                self.declared_users.add(fact[1])
+                self.user_registry.add(fact[1])
+                return True
+            if not isinstance(fact, tuple) or len(fact) != 3 or not isinstance(fact[1], str):
+                return False
+            relation, subject, obj = fact
+            if self.content.indexes(relation):
+                self.content.add_feature(subject, relation, obj)
+            if not isinstance(relation, str) or not isinstance(obj, str):
+                return self.content.indexes(relation)
+            if relation == 'likes':
+                self.user_registry.add(subject)
+                if obj not in self.likes_by_user[subject]:
+                    if self.collaborative is not None:
+                        self.collaborative.add_like(subject, obj)
+                    self.aggregates.add_like(obj)
+                self.likes_by_user[subject].add(obj)
+                self.users_by_movie[obj].add(subject)
+                self.graph.add_edge(('user', subject), ('movie', obj))
+            elif relation == 'watched':
+                self.user_registry.add(subject)
+                self.watched_by_user[subject].add(obj)
+            elif relation == 'preference':
+                self.user_registry.add(subject)
+                self.preferences_by_user[subject].add(obj)
+            elif relation == 'genre':
+                self.movies_by_genre[obj].add(subject)
+                self.genres_by_movie[subject].add(obj)
+                self.aggregates.add_genre(subject, obj)
+                self.graph.add_edge(('movie', subject), ('genre', obj))
+            elif relation == 'director':
+                self.movies_by_director[obj].add(subject)
+                self.directors_by_movie[subject].add(obj)
+                self.graph.add_edge(('movie', subject), ('director', obj))
+            else:
+                return self.content.indexes(relation)
+            return True
+
+    def has_fact(self, fact):
+        """
+        True if an indexed fact (or a movie with the same ID) is already present. A rating
+        is present if the same user (or the catalog) already gave the movie the same score.
+        Facts outside the indexed relations, user declarations and genre preferences are
+        never reported as present.
+        """
+        with self._lock:
+            if is_movie_fact(fact):
+                return self.catalog.get(fact[1]) is not None
+            if is_rating_fact(fact):
+                if fact[0] == 'user-rating':
+                    return self.aggregates.user_ratings.get((fact[1], fact[2])) == fact[3]
+                return self.rating_facts.get(fact[1]) == fact[2]
+            if isinstance(fact, tuple) and len(fact) == 2 and fact[0] == 'user':
+                return fact[1] in self.declared_users
+            if not isinstance(fact, tuple) or len(fact) != 3:
+                return False
+            relation, subject, obj = fact
+            lookup = {
+                'likes': self.likes_by_user,
+                'watched': self.watched_by_user,
+                'preference': self.preferences_by_user,
+                'genre': self.genres_by_movie,
+                'director': self.directors_by_movie,
+            }.get(relation)
+            return lookup is not None and obj in lookup.get(subject, ())
+
+    def content_similarity(self, user):
+        """
+        Movies sharing a genre with any movie the user likes.
+        """
+        with self._lock:
+            movies = set()
+            for liked in self.likes_by_user.get(user, ()):
+                for genre in self.genres_by_movie.get(liked, ()):
+                    movies |= self.movies_by_genre[genre]
+            return movies
+
+    def director_match(self, user):
+        """
+        Movies sharing a director with any movie the user likes.
+        """
+        with self._lock:
+            movies = set()
+            for liked in self.likes_by_user.get(user, ()):
+                for director in self.directors_by_movie.get(liked, ()):
+                    movies |= self.movies_by_director[director]
+            return movies
+
+    def similar_users(self, user):
+        """
+        Other users who like at least one movie the user likes.
+        """
+        with self._lock:
+            users = set()
+            for liked in self.likes_by_user.get(user, ()):
+                users |= self.users_by_movie[liked]
+            users.discard(user)
+            return users
+
+    def collaborative_rec(self, user):
+        """
+        Movies liked by users similar to the given user.
+        """
+        with self._lock:
+            movies = set()
+            for other in self.similar_users(user):
+                movies |= self.likes_by_user[other]
+            return movies
+
+    def recommend_to(self, user):
+        """
+        Union of the content, director and collaborative strategies, as in recommend-to.
+        """
+        with self._lock:
+            return self.content_similarity(user) | self.director_match(user) | self.collaborative_rec(user)
+
+    def related_movies(self, movie):
+        """
+        Movies sharing a genre or director with the movie.
+        """
+        with self._lock:
+            related = set()
+            for genre in self.genres_by_movie.get(movie, ()):
+                related |= self.movies_by_genre[genre]
+            for director in self.directors_by_movie.get(movie, ()):
+                related |= self.movies_by_director[director]
+            return related
+
+    def co_liked_movies(self, movie):
+        """
+        Every movie liked by a user who likes the movie.
+        """
+        with self._lock:
+            movies = set()
+            for liker in self.users_by_movie.get(movie, ()):
+                movies |= self.likes_by_user[liker]
+            return movies
+
+    def users_liking_any(self, movies):
+        with self._lock:
+            users = set()
+            for movie in movies:
+                users |= self.users_by_movie.get(movie, set())
+            return users
+
+    def candidate_users(self, movie):
+        """
+        Users who have the movie among their recommend-to candidates: those who like a movie
+        sharing a genre or director with it (content and director matches), and those who
+        share a like with a user who likes it (collaborative matches).
+        """
+        with self._lock:
+            return self.users_liking_any(self.related_movies(movie) | self.co_liked_movies(movie))
+
+    def affected_users(self, fact):
+        """
+        Users whose recommendations can change because of a newly indexed fact, or None
+        when the fact touches the catalog and every user is affected. A new like reaches
+        the liking user, their collaborative neighbourhood and, since it raises the movie's
+        popularity term in the ranked score, every user who has the movie as a candidate.
+        """
+        with self._lock:
+            if not isinstance(fact, tuple) or len(fact) < 2:
+                return set()
+            relation, subject = fact[0], fact[1]
+            if relation in ('movie', 'genre', 'director'):
+                return None
+            if relation == 'likes':
+                users = {subject} | self.similar_users(subject)
+                if len(fact) == 3 and isinstance(fact[2], str):
+                    users |= self.candidate_users(fact[2])
+                return users
+            return {subject} if isinstance(subject, str) else set()
+
+    def popularity(self, movie):
+        """
+        Number of users who like the movie.
+        """
+        with self._lock:
+            return len(self.users_by_movie.get(movie, ()))
+
+    def users(self):
+        """
+        Every user with at least one like or watched movie.
+        """
+        with self._lock:
+            return sorted(set(self.likes_by_user) | set(self.watched_by_user))
+
+    def liked_movies(self, user):
+        """
+        A copy of the movies the user likes.
+        """
+        with self._lock:
+            return set(self.likes_by_user.get(user, ()))
+
+    def watched_movies(self, user):
+        """
+        A copy of the movies the user has watched.
+        """
+        with self._lock:
+            return set(self.watched_by_user.get(user, ()))
+
+    def likes_of(self, users):
+        """
+        {user: copy of their liked movies} for the given users that have likes.
+        """
+        with self._lock:
+            return {user: set(self.likes_by_user[user]) for user in users if user in self.likes_by_user}
+
+    def content_evidence(self, liked, memo=None):
+        """
+        (movie, evidence) pairs that one liked movie contributes through its genres and
+        directors. Pass the same memo dict across users to compute each liked movie once.
+        """
+        with self._lock:
+            if memo is not None and liked in memo:
+                return memo[liked]
+            items = []
+            for genre in sorted(self.genres_by_movie.get(liked, ())):
+                for movie in self.movies_by_genre[genre]:
+                    items.append((movie, ('genre', liked, genre)))
+            for director in sorted(self.directors_by_movie.get(liked, ())):
+                for movie in self.movies_by_director[director]:
+                    items.append((movie, ('director', liked, director)))
+            if memo is not None:
+                memo[liked] = items
+            return items
+
+    def recommend_with_evidence(self, user, neighbors=None, memo=None, liked=None, neighbor_likes=None):
+        """
+        Same candidates as recommend_to, each mapped to the evidence that produced it:
+        ('genre', liked, genre), ('director', liked, director) or ('collaborative', other_user).
+        Batch callers can pass precomputed neighbours and a shared content_evidence memo;
+        a sharded coordinator passes the user's likes and their neighbours' likes as well.
+        """
+        with self._lock:
+            evidence = defaultdict(list)
+            liked = self.likes_by_user.get(user, ()) if liked is None else liked
+            for movie_liked in sorted(liked):
+                for movie, item in self.content_evidence(movie_liked, memo):
+                    evidence[movie].append(item)
+            if neighbors is None:
+                neighbors = self.similar_users(user)
+            likes = self.likes_by_user if neighbor_likes is None else neighbor_likes
+            for other in sorted(neighbors):
+                for movie in likes.get(other, ()):
+                    evidence[movie].append(('collaborative', other))
+            return dict(evidence)
+
+    def add_summary(self, fact):
+        """
+        Record what a sharded coordinator keeps of a user-scoped fact held on a shard:
+        the user in the registry and the movie's like and rating aggregates.
+        """
+        with self._lock:
+            if is_rating_fact(fact) and fact[0] == 'user-rating':
+                self.aggregates.add_rating(fact[1], fact[2], fact[3])
+            elif isinstance(fact, tuple) and len(fact) == 3 and fact[0] == 'likes':
+                self.aggregates.add_like(fact[2])
+            elif not (isinstance(fact, tuple) and len(fact) >= 2 and fact[0] in ('watched', 'preference', 'user')):
+                return False
+            self.user_registry.add(fact[1])
+            return True
+
+def build_index(metta, index=None):
+    """
+    Build a KnowledgeIndex from the atoms currently in the MeTTa space, filling the
+    given (empty) index if one is passed.
+    """
+    index = index if index is not None else KnowledgeIndex()
+    indexed = 0
+    for atom in metta.space().get_atoms():
+        if index.add_fact(atom_to_value(atom)):
+            indexed += 1
+    logger.info("Indexed %d facts for recommendation lookups", indexed)
+    return index
+
+
+def get_index(metta):
+    """
+    Return the KnowledgeIndex attached to a MeTTa instance, or None.
+    """
+    return getattr(metta, 'kb_index', None)
+
+
+def _symbol_results(lookup):
+    def op(user_atom):
+        return [S(name) for name in sorted(lookup(str(user_atom)))]
+    return op
+
+
+def _ranked_results(lookup):
+    def op(user_atom):
+        user = str(user_atom)
+        return [E(S(name), ValueAtom(score)) for name, score in lookup([user])[user]]
+    return op
+
+
+def _value_result(lookup):
+    def op(movie_atom):
+        value = lookup(str(movie_atom))
+        return [ValueAtom(value if value is not None else 0)]
+    return op
+
+
+def _top_results(aggregates, metric):
+    def op(genre_atom, limit_atom):
+        genre = str(genre_atom)
+        ranked = aggregates.top(metric, None if genre == 'all' else genre, int(atom_to_value(limit_atom)))
+        return [E(S(movie), ValueAtom(round(value, 4))) for movie, value in ranked]
+    return op
+
+
+def register_aggregate_functions(metta, aggregates):
+    """
+    Expose the aggregates as grounded functions, e.g. !(movie-like-count inception) or
+    !(top-rated-in-genre sci-fi 5), which yields (movie score) pairs best first; the genre
+    'all' ranks the whole catalog. Register these before loading rules that call them.
+    """
+    values = {
+        'movie-like-count': aggregates.like_count,
+        'movie-rating-count': aggregates.rating_count,
+        'movie-rating-mean': aggregates.rating_mean,
+        'movie-rating-variance': aggregates.rating_variance,
+        'movie-trending-score': aggregates.trending_score,
+    }
+    for name, lookup in values.items():
+        metta.register_atom(name, OperationAtom(name, _value_result(lookup), ['Atom', 'Atom'], unwrap=False))
+    tops = {
+        'top-popular-in-genre': 'popular',
+        'top-rated-in-genre': 'top-rated',
+        'trending-in-genre': 'trending',
+    }
+    for name, metric in tops.items():
+        metta.register_atom(name, OperationAtom(name, _top_results(aggregates, metric), ['Atom', 'Atom', 'Atom'],
+                                                unwrap=False))
+
+
+def _content_results(index, lookup):
+    def op(key_atom, limit_atom):
+        ranked = lookup(index, str(key_atom), int(atom_to_value(limit_atom)))
+        return [E(S(movie), ValueAtom(round(score, 4))) for movie, score in ranked]
+    return op
+
+
+def register_content_functions(metta, index):
+    """
+    Expose the content engine as grounded functions yielding (movie score) pairs best first:
+    !(content-recommend-to alice 5) ranks movies by similarity to the user's liked movies and
+    !(content-similar-movies inception 5) by similarity to one movie. Register these before
+    loading rules that call them.
+    """
+    lookups = {
+        'content-recommend-to': lambda index, user, k: index.content.recommend([user], index.likes_of([user]), k)[user],
+        'content-similar-movies': lambda index, movie, k: index.content.similar_movies(movie, k),
+    }
+    for name, lookup in lookups.items():
+        metta.register_atom(name, OperationAtom(name, _content_results(index, lookup), ['Atom', 'Atom', 'Atom'],
+                                                unwrap=False))
+
+
+def _graph_results(index, lookup):
+    def op(user_atom, depth_atom):
+        depth = max(1, min(MAX_DEPTH, int(atom_to_value(depth_atom))))
+        names = lookup(index, str(user_atom), depth)
+        return [E(*[S(name) for name in names])] if names else []
+    return op
+
+
+def register_graph_functions(metta, index):
+    """
+    Expose multi-hop graph lookups as grounded functions yielding one expression of names
+    best first: !(graph-recommend-to alice 3) walks up to three hops from the movies alice
+    likes and !(graph-similar-users alice 2) finds users within two hops. The ranking is
+    kept in a single result because the interpreter does not keep the order of separate
+    results once a rule wraps the call. Register these before loading rules that call them.
+    """
+    lookups = {
+        'graph-recommend-to': lambda index, user, depth: [
+            movie for movie, _, _ in index.graph.recommend(user, depth, index.liked_movies(user))[0]],
+        'graph-similar-users': lambda index, user, depth: [
+            other for other, _ in index.graph.similar_users(user, depth)],
+    }
+    for name, lookup in lookups.items():
+        metta.register_atom(name, OperationAtom(name, _graph_results(index, lookup), ['Atom', 'Atom', 'Atom'],
+                                                unwrap=False))
+
+
+def register_index_functions(metta, index):
+    """
+    Attach the index to the MeTTa instance and expose its lookups as grounded functions,
+    e.g. !(index-recommend-to alice). With a collaborative engine attached, ranked
+    (name score) pairs are available through !(cf-similar-users alice).
+    """
+    metta.kb_index = index
+    functions = {
+        'index-content-similarity': index.content_similarity,
+        'index-director-match': index.director_match,
+        'index-similar-users': index.similar_users,
+        'index-collaborative-rec': index.collaborative_rec,
+        'index-recommend-to': index.recommend_to,
+    }
+    for name, lookup in functions.items():
+        metta.register_atom(name, OperationAtom(name, _symbol_results(lookup), ['Atom', 'Atom'], unwrap=False))
+    if index.collaborative is not None:
+        ranked = {
+            'cf-similar-users': index.collaborative.top_neighbors,
+            'cf-collaborative-rec': index.collaborative.recommend,
+        }
+        for name, lookup in ranked.items():
+            metta.register_atom(name, OperationAtom(name, _ranked_results(lookup), ['Atom', 'Atom'], unwrap=False))
@@ -0,0 +1,149 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+
+from metrics import configure_logging
+from persistence import KnowledgeStore
+from utils import initialize_metta, batch_recommendations
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recommendations (
+    user TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    movie TEXT NOT NULL,
+    title TEXT NOT NULL,
+    score REAL NOT NULL,
+    explanations TEXT NOT NULL,
+    PRIMARY KEY (user, rank)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+_worker_metta = None
+
+
+def load_knowledge_base(metta_file_path, persistence_dir=None):
+    """
+    The knowledge base the server would serve: the durable snapshot and mutation log when
+    persistence_dir is set (which is also where importer.py saves), else the source file.
+    Returns (metta, version).
+    """
+    if persistence_dir:
+        store = KnowledgeStore(persistence_dir)
+        return store.open(metta_file_path, read_only=True), store.version
+    return initialize_metta(metta_file_path), 0
+
+
+def _init_worker(metta_file_path, persistence_dir):
+    global _worker_metta
+    _worker_metta, _ = load_knowledge_base(metta_file_path, persistence_dir)
+
+
+def _materialize_chunk(args):
+    users, top_n = args
+    rows = []
+    for user, result in batch_recommendations(_worker_metta, users, top_n).items():
+        for rank, (rec, explanations) in enumerate(zip(result["recommendations"], result["explanations"])):
+            rows.append((user, rank, rec["id"], str(rec.get("title", rec["id"])), rec.get("score", 0), json.dumps(explanations)))
+    return rows
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def materialize(metta_file_path, output_path, users=None, top_n=10, workers=None, chunk_size=256,
+                persistence_dir=None):
+    """
+    Compute every user's top-N recommendations across a pool of worker processes and
+    write them to a SQLite table that MaterializedRecommendations can serve directly.
+    With persistence_dir the workers load the same durable state as the server.
+    """
+    started = time.perf_counter()
+    metta, version = load_knowledge_base(metta_file_path, persistence_dir)
+    if users is None:
+        users = metta.kb_index.users()
+    workers = workers or os.cpu_count() or 1
+    tmp_path = output_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+    tasks = [(chunk, top_n) for chunk in _chunks(list(users), chunk_size)]
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(metta_file_path, persistence_dir)) as pool:
+        for rows in pool.imap_unordered(_materialize_chunk, tasks):
+            conn.executemany("INSERT INTO recommendations VALUES (?, ?, ?, ?, ?, ?)", rows)
+    elapsed = time.perf_counter() - started
+    meta = {
+        "source": metta_file_path,
+        "persistence_dir": persistence_dir or "",
+        "version": str(version),
+        "generated_at": str(time.time()),
+        "top_n": str(top_n),
+        "users": str(len(users)),
+    }
+    conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta.items())
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, output_path)
+    logger.info("Materialized top-%d recommendations for %d users to %s in %.2fs using %d workers",
+                top_n, len(users), output_path, elapsed, workers)
+    return output_path
+
+
+class MaterializedRecommendations:
+    """
+    Read-only access to a table written by materialize().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def meta(self):
+        return dict(self._conn.execute("SELECT key, value FROM meta"))
+
+    def lookup(self, users, limit=None):
+        """
+        Return {user: {"recommendations": [...], "explanations": [...]}} for the given users.
+        Users missing from the table map to empty lists.
+        """
+        results = {}
+        for user in users:
+            query = "SELECT movie, title, score, explanations FROM recommendations WHERE user = ? ORDER BY rank"
+            params = [user]
+            if limit is not None:
+                query += " LIMIT ?"
+                params.append(limit)
+            rows = self._conn.execute(query, params).fetchall()
+            results[user] = {
+                "recommendations": [{"id": movie, "title": title, "score": score} for movie, title, score, _ in rows],
+                "explanations": [json.loads(explanations) for _, _, _, explanations in rows],
+            }
+        return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Materialize every user's top-N recommendations to SQLite.")
+    arg_parser.add_argument("--metta", default=os.getenv("METTA_FILE_PATH", "recommendation.metta"))
+    arg_parser.add_argument("--data-dir", default=os.getenv("PERSISTENCE_DIR"),
+                            help="load the durable snapshot and mutation log the server serves")
+    arg_parser.add_argument("--output", default=os.getenv("MATERIALIZED_RECS_PATH", "materialized_recs.sqlite"))
+    arg_parser.add_argument("--top-n", type=int, default=10)
+    arg_parser.add_argument("--workers", type=int, default=None, help="defaults to the number of CPU cores")
+    arg_parser.add_argument("--chunk-size", type=int, default=256)
+    arg_parser.add_argument("--users", nargs="*", help="defaults to all users")
+    args = arg_parser.parse_args()
+    configure_logging()
+    materialize(args.metta, args.output, args.users, args.top_n, args.workers, args.chunk_size, args.data_dir)
@@ -0,0 +1,215 @@
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("slow_queries")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 0))
+_RULE_PATTERN = re.compile(r"!?\(\s*([^\s()]+)")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter with labels, rendered in Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """
+    Value that can go up and down, read from a callback at render time when one is given,
+    rendered in Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.value = 0.0
+        REGISTRY.append(self)
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        value = self.callback() if self.callback is not None else self.value
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Histogram:
+    """
+    Latency histogram with labels and cumulative buckets, rendered in Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+QUERY_SECONDS = Histogram("metta_query_seconds", "Latency of MeTTa queries by rule.", ["rule"])
+QUERY_RESULTS = Counter("metta_query_results_total", "Results returned by MeTTa queries by rule.", ["rule"])
+REQUEST_SECONDS = Histogram("http_request_seconds", "Latency of HTTP requests by route.",
+                            ["method", "route", "status"])
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Response cache lookups by route and result.", ["route", "result"])
+STARTUP_SECONDS = Gauge("process_startup_seconds", "Seconds spent loading the knowledge base before serving.")
+RESIDENT_MEMORY = Gauge("process_resident_memory_bytes", "Resident set size of this process.",
+                        lambda: memory_usage()["rss"])
+PROPORTIONAL_MEMORY = Gauge("process_proportional_memory_bytes",
+                            "Proportional set size of this process: shared pages split between their users.",
+                            lambda: memory_usage()["pss"])
+
+
+def render_metrics():
+    """
+    Every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def memory_usage(pid="self"):
+    """
+    {'rss', 'pss', 'shared'} in bytes for a process, from /proc (Linux). PSS splits each
+    shared page between the processes mapping it, so it shows what copy-on-write sharing
+    saves where RSS does not. Values are 0 where /proc is unavailable.
+    """
+    usage = {"rss": 0, "pss": 0, "shared": 0}
+    fields = {"Rss:": "rss", "Pss:": "pss", "Shared_Clean:": "shared", "Shared_Dirty:": "shared"}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if parts and parts[0] in fields:
+                    usage[fields[parts[0]]] += int(parts[1]) * 1024
+    except OSError:
+        pass
+    return usage
+
+
+def query_rule(query):
+    """
+    The rule a query calls, e.g. '!(recommend-to alice $movie)' -> 'recommend-to', used as the
+    metric label so that per-user arguments do not create new series.
+    """
+    match = _RULE_PATTERN.match(query.strip())
+    return match.group(1) if match else "unknown"
+
+
+class QueryTimer:
+    def __init__(self, template, query=None, cache=None):
+        self.template = template
+        self.query = query
+        self.results = None
+        self.cache = cache
+        self.seconds = None
+
+
+@contextmanager
+def timed_query(template, query=None, cache=None):
+    """
+    Time the enclosed block as one query. Set .results (and .cache) on the yielded timer;
+    on exit the latency is recorded, a debug line is logged and, above SLOW_QUERY_MS,
+    the query goes to the slow-query log.
+    """
+    timer = QueryTimer(template, query, cache)
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - started
+        QUERY_SECONDS.observe(timer.seconds, template)
+        if timer.results is not None:
+            QUERY_RESULTS.inc(template, amount=timer.results)
+        logger.debug("query template=%s latency_ms=%.2f results=%s cache=%s",
+                     template, timer.seconds * 1000, timer.results, timer.cache)
+        log_if_slow("query", template, timer.seconds, query=query or template, results=timer.results,
+                    cache=timer.cache)
+
+
+def log_if_slow(kind, name, seconds, **fields):
+    """
+    Write one line to the slow-query log when seconds is at or above SLOW_QUERY_MS.
+    """
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        details = " ".join(f"{key}={value}" for key, value in fields.items() if value is not None)
+        slow_logger.warning("slow %s %s latency_ms=%.2f %s", kind, name, seconds * 1000, details)
+
+
+def configure_logging(level=None, slow_query_log=None):
+    """
+    Set up levelled logging from LOG_LEVEL (default INFO) and, when SLOW_QUERY_LOG is set,
+    write the slow-query log to that file as well.
+    """
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    slow_query_log = slow_query_log or os.getenv("SLOW_QUERY_LOG")
+    if slow_query_log:
+        handler = logging.FileHandler(slow_query_log)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_logger.addHandler(handler)
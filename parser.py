@@ -1,51 +1,202 @@
 import os, json
+import logging
 from dotenv import load_dotenv
+import copy
 import re
-import google.generativeai as genai
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from rec_cache import RecommendationCache
+from prepared import get_query, render_query
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 KEY = os.getenv("GEMINI_API_KEY")
-print(f"GEMINI_API_KEY loaded: {'Yes' if KEY else 'No'}")
+logger.info("GEMINI_API_KEY loaded: %s", 'Yes' if KEY else 'No')
 if not KEY:
-    print("Warning: GEMINI_API_KEY missing, using fallback parser")
-else:
-    try:
-        genai.configure(api_key=KEY)
-        print("Gemini API configured successfully")
-    except Exception as e:
-        print(f"Warning: Failed to configure Gemini API: {str(e)}, using fallback parser")
+    logger.warning("GEMINI_API_KEY missing, using fallback parser")
+
+class StubModel:
+    """
+    Offline stand-in for the Gemini model: answers with the local parse (or the default
+    'any' query) as JSON, with optional latency and failures for testing the breaker.
+    """
+
+    def __init__(self, latency=0.0, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("Stub model failure")
+        prompt = contents[0]["parts"][0]["text"]
+        question = prompt.rsplit("User question: ", 1)[-1]
+        subject = re.match(r"\(Assume subject: (\w+)\) ", question)
+        if subject:
+            question = question[subject.end():]
+        parsed = _local_parse(question) or {
+            "subject": subject.group(1) if subject else None,
+            "relation": "any",
+            "target_attribute": None,
+            "max_depth": 1
+        }
+        return type("StubResponse", (), {"text": json.dumps(parsed)})()
 
 # Model
 MODEL = None
 MODEL_IS_OBJ = False
-if KEY:
-    try:
-        MODEL = genai.GenerativeModel("gemini-2.0-flash")
-        MODEL_IS_OBJ = True
-        print("Gemini model initialized: gemini-2.0-flash")
-    except Exception as e:
-        print(f"Warning: Failed to initialize Gemini model: {str(e)}")
-        MODEL = None
+if os.getenv("PARSER_MODEL", "gemini").lower() == "stub":
+    MODEL = StubModel(latency=float(os.getenv("PARSER_STUB_LATENCY", 0)))
+    MODEL_IS_OBJ = True
+    logger.info("Using offline stub parser model")
+_gemini_pending = MODEL is None and bool(KEY)
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """
+    The parser model. The Gemini client is imported and configured on first use, so
+    processes that never call it (or a master that preloads and forks) skip the
+    google.generativeai import.
+    """
+    global MODEL, MODEL_IS_OBJ, _gemini_pending
+    if not _gemini_pending:
+        return MODEL
+    with _model_lock:
+        if _gemini_pending:
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=KEY)
+                MODEL = genai.GenerativeModel("gemini-2.0-flash")
+                MODEL_IS_OBJ = True
+                logger.info("Gemini model initialized: gemini-2.0-flash")
+            except Exception as e:
+                logger.warning("Failed to initialize Gemini model: %s, using fallback parser", e)
+                MODEL = None
+            _gemini_pending = False
+    return MODEL
 
 SCHEMA = ('Reply with ONLY one JSON object like: '
           '{"subject":<string|null>,"relation":"any"|"Watched"|"Likes"|"SimilarUser",'
           '"target_attribute":{"type":"Genre"|"Director","value":"<string>"},"max_depth":<int>}')
 
+MODEL_TIMEOUT = float(os.getenv("PARSER_MODEL_TIMEOUT", 5))
+_model_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PARSER_MODEL_WORKERS", 4)))
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive model failures; while open, questions go
+    straight to the fallback parser. After reset_timeout one trial call is let through.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.state != "half-open":
+                return self.state == "closed"
+            # Let one trial call through and re-arm the timer for everyone else.
+            self.opened_at = self.clock()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+BREAKER = CircuitBreaker(
+    failure_threshold=int(os.getenv("PARSER_BREAKER_FAILURES", 3)),
+    reset_timeout=float(os.getenv("PARSER_BREAKER_RESET", 30))
+)
+PARSE_CACHE = RecommendationCache(
+    max_entries=int(os.getenv("PARSER_CACHE_SIZE", 2048)),
+    ttl=float(os.getenv("PARSER_CACHE_TTL", 3600))
+)
+STATS = {
+    "local_hits": 0,
+    "model_calls": 0,
+    "model_failures": 0,
+    "model_timeouts": 0,
+    "breaker_skips": 0,
+    "model_latency_total": 0.0,
+    "model_latency_max": 0.0,
+}
+_stats_lock = threading.Lock()
+
+def _count(name, amount=1):
+    with _stats_lock:
+        STATS[name] += amount
+
+def parser_stats():
+    """
+    Counters for the parse layer: local pattern hits, cache hit rate, model latency and breaker state.
+    """
+    with _stats_lock:
+        stats = dict(STATS)
+    cache = PARSE_CACHE.stats()
+    stats["cache_hits"] = cache["hits"]
+    stats["cache_misses"] = cache["misses"]
+    stats["cache_hit_rate"] = cache["hit_rate"]
+    stats["model_latency_avg"] = stats["model_latency_total"] / stats["model_calls"] if stats["model_calls"] else 0.0
+    stats["breaker_state"] = BREAKER.state
+    return stats
+
 def _call(prompt):
-    print(f"_call invoked with prompt: {prompt[:200]}...")
-    if MODEL and MODEL_IS_OBJ:
+    logger.debug("_call invoked with prompt: %s...", prompt[:200])
+    model = get_model()
+    if model and MODEL_IS_OBJ:
+        started = time.perf_counter()
+        _count("model_calls")
+        future = _model_executor.submit(model.generate_content, [{"role": "user", "parts": [{"text": prompt}]}])
         try:
-            response = MODEL.generate_content([{"role": "user", "parts": [{"text": prompt}]}])
-            print("Gemini API call successful")
+            response = future.result(timeout=MODEL_TIMEOUT)
+            logger.debug("Gemini API call successful")
             return response
+        except FutureTimeoutError:
+            future.cancel()
+            _count("model_timeouts")
+            logger.warning("Gemini generate_content timed out after %.1fs", MODEL_TIMEOUT)
+            raise RuntimeError(f"Gemini API call timed out after {MODEL_TIMEOUT}s")
         except Exception as e:
-            print(f"Gemini generate_content failed: {str(e)}")
+            logger.warning("Gemini generate_content failed: %s", e)
             raise RuntimeError(f"Gemini API call failed: {str(e)}")
-    print("No valid Gemini model available")
+        finally:
+            latency = time.perf_counter() - started
+            with _stats_lock:
+                STATS["model_latency_total"] += latency
+                STATS["model_latency_max"] = max(STATS["model_latency_max"], latency)
+    logger.debug("No valid Gemini model available")
     raise RuntimeError("No valid Gemini call method available.")
 
 def _txt(resp):
-    print("Extracting text from Gemini response")
+    logger.debug("Extracting text from Gemini response")
     text = None
 
     # Candidate flow
@@ -68,7 +219,7 @@ def _txt(resp):
         text = str(resp)
 
     text = text.strip()
-    print(f"Raw extracted text: {text[:200]}...")
+    logger.debug("Raw extracted text: %s...", text[:200])
 
     # Strip code block markers ```json ... ```
     cleaned_text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text, flags=re.MULTILINE).strip()
@@ -78,79 +229,89 @@ def _txt(resp):
     if match:
         cleaned_text = match.group(0)
 
-    print(f"Cleaned text: {cleaned_text[:200]}...")
+    logger.debug("Cleaned text: %s...", cleaned_text[:200])
     return cleaned_text
 
+_LOCAL_PATTERNS = [
+    # "Does <user> like <genre> movies?"
+    (re.compile(r"Does (\w+) like (\w+([- ]?\w+)*) movies\??", re.IGNORECASE),
+     lambda m: {"subject": m.group(1).lower(), "relation": "Likes",
+                "target_attribute": {"type": "Genre", "value": m.group(2).replace(" ", "-").lower()},
+                "max_depth": 1}),
+    # "What movies has <user> watched?"
+    (re.compile(r"What movies has (\w+) watched\??", re.IGNORECASE),
+     lambda m: {"subject": m.group(1).lower(), "relation": "Watched", "target_attribute": None, "max_depth": 1}),
+    # "Who are similar to <user>?"
+    (re.compile(r"Who are similar to (\w+)\??", re.IGNORECASE),
+     lambda m: {"subject": m.group(1).lower(), "relation": "SimilarUser", "target_attribute": None, "max_depth": 1}),
+]
+
+def _local_parse(question):
+    """
+    Parse the known intents (Likes / Watched / SimilarUser) with precompiled patterns.
+    Returns None when no pattern matches.
+    """
+    for pattern, build in _LOCAL_PATTERNS:
+        match = pattern.match(question.strip())
+        if match:
+            return build(match)
+    return None
+
+def _normalize_question(question):
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?!. ")
+
 def _fallback_parse(question, assumed_subject):
-    print(f"_fallback_parse invoked with question: '{question}', assumed_subject: '{assumed_subject}'")
+    logger.debug("_fallback_parse invoked with question: '%s', assumed_subject: '%s'", question, assumed_subject)
     try:
-        # Handle "Does <user> like <genre> movies?"
-        match = re.match(r"Does (\w+) like (\w+([- ]?\w+)*) movies\??", question, re.IGNORECASE)
-        if match:
-            subject = match.group(1).lower()
-            genre = match.group(2).replace(" ", "-").lower()
-            result = {
-                "subject": subject,
-                "relation": "Likes",
-                "target_attribute": {"type": "Genre", "value": genre},
-                "max_depth": 1
-            }
-            print(f"Fallback parsed 'Does ... like ...' match: {result}")
+        result = _local_parse(question)
+        if result:
+            logger.debug("Fallback parsed local pattern match: %s", result)
             return result
-    
-        match = re.match(r"What movies has (\w+) watched\??", question, re.IGNORECASE)
-        if match:
-            subject = match.group(1).lower()
-            result = {
-                "subject": subject,
-                "relation": "Watched",
-                "target_attribute": None,
-                "max_depth": 1
-            }
-            print(f"Fallback parsed 'What movies has ...' match: {result}")
-            return result
-        
-        match = re.match(r"Who are similar to (\w+)\??", question, re.IGNORECASE)
-        if match:
-            subject = match.group(1).lower()
-            result = {
-                "subject": subject,
-                "relation": "SimilarUser",
-                "target_attribute": None,
-                "max_depth": 1
-            }
-            print(f"Fallback parsed 'Who are similar to ...' match: {result}")
-            return result
-        
         result = {
             "subject": assumed_subject.lower() if assumed_subject else None,
             "relation": "any",
             "target_attribute": None,
             "max_depth": 1
         }
-        print(f"Fallback default result (no regex match): {result}")
+        logger.debug("Fallback default result (no regex match): %s", result)
         return result
     except Exception as e:
-        print(f"Fallback parser error: {str(e)}")
+        logger.error("Fallback parser error: %s", e)
         raise ValueError(f"Failed to parse question with fallback parser: {str(e)}")
 
 def parse_question_to_json(q, assumed_subject=None):
-    print(f"parse_question_to_json invoked with question: '{q}', assumed_subject: '{assumed_subject}'")
+    logger.debug("parse_question_to_json invoked with question: '%s', assumed_subject: '%s'", q, assumed_subject)
     if not q or not q.strip():
-        print("Empty question provided")
+        logger.debug("Empty question provided")
         raise ValueError("Empty question")
+    local = _local_parse(q)
+    if local:
+        _count("local_hits")
+        logger.debug("Local pattern parsed question: %s", local)
+        return local
+    cache_key = _normalize_question(q)
+    cached = PARSE_CACHE.get(assumed_subject, cache_key)
+    if cached is not None:
+        logger.debug("Parse cache hit for question: '%s'", cache_key)
+        return copy.deepcopy(cached)
     prompt = SCHEMA + "\n\nUser question: " + (f"(Assume subject: {assumed_subject}) " if assumed_subject else "") + q.strip()
-    print(f"Generated prompt for Gemini: {prompt[:200]}...")
-    if not MODEL:
-        print("No Gemini model, using fallback parser")
+    logger.debug("Generated prompt for Gemini: %s...", prompt[:200])
+    if not get_model():
+        logger.debug("No Gemini model, using fallback parser")
+        return _fallback_parse(q, assumed_subject)
+    if not BREAKER.allow():
+        _count("breaker_skips")
+        logger.info("Gemini circuit breaker open, using fallback parser")
         return _fallback_parse(q, assumed_subject)
     try:
         resp = _call(prompt)
         text = _txt(resp).strip()
-        print(f"Gemini response text (clean): {text[:200]}...")
+        logger.debug("Gemini response text (clean): %s...", text[:200])
         i, j = text.find("{"), text.rfind("}")
         if i == -1 or j == -1 or j <= i:
-            print(f"No valid JSON found in Gemini output: {text[:200]}..., switching to fallback parser")
+            logger.warning("No valid JSON found in Gemini output: %s..., switching to fallback parser", text[:200])
+            _count("model_failures")
+            BREAKER.record_failure()
             return _fallback_parse(q, assumed_subject)
         parsed = json.loads(text[i:j+1])
         parsed["subject"] = (parsed.get("subject") or assumed_subject).lower() if parsed.get("subject") or assumed_subject else None
@@ -160,34 +321,49 @@ def parse_question_to_json(q, assumed_subject=None):
            
             if parsed["target_attribute"]["value"] == "<string>":
                 parsed["target_attribute"] = None
-                print("Fixed invalid target_attribute value '<string>' to None")
-        print(f"Gemini parsed JSON: {parsed}")
+                logger.debug("Fixed invalid target_attribute value '<string>' to None")
+        logger.debug("Gemini parsed JSON: %s", parsed)
+        BREAKER.record_success()
+        PARSE_CACHE.put(assumed_subject, cache_key, copy.deepcopy(parsed))
         return parsed
     except Exception as e:
-        print(f"Gemini parsing failed: {str(e)}, switching to fallback parser")
+        logger.warning("Gemini parsing failed: %s, switching to fallback parser", e)
+        _count("model_failures")
+        BREAKER.record_failure()
         return _fallback_parse(q, assumed_subject)
 
 def map_json_to_metta(parsed_json):
-    print(f"map_json_to_metta invoked with parsed_json: {parsed_json}")
+    """
+    Map a parsed question to a prepared query: (query name, parameters).
+    """
+    logger.debug("map_json_to_metta invoked with parsed_json: %s", parsed_json)
     subject = parsed_json.get('subject')
     if not subject:
-        print("No subject provided in parsed JSON")
+        logger.debug("No subject provided in parsed JSON")
         raise ValueError("No subject provided in parsed JSON")
     relation = parsed_json.get('relation')
     target_attribute = parsed_json.get('target_attribute')
+    depth = parsed_json.get('max_depth') or 1
     if relation == "Likes" and target_attribute and target_attribute['type'] == "Genre":
-        query = f'!(match &self (preference {subject} "{target_attribute["value"]}") "{target_attribute["value"]}")'
-        print(f"Mapped to Likes query: {query}")
+        query = ("likes-genre", {"user": subject, "genre": target_attribute["value"]})
+        logger.debug("Mapped to Likes query: %s", query)
     elif relation == "Watched":
-        query = f'!(watched {subject} $movie)'
-        print(f"Mapped to Watched query: {query}")
+        query = ("watched", {"user": subject})
+        logger.debug("Mapped to Watched query: %s", query)
+    elif relation == "SimilarUser" and depth > 1:
+        query = ("multi-hop-similar-users", {"user": subject, "depth": depth})
+        logger.debug("Mapped to multi-hop SimilarUser query: %s", query)
     elif relation == "SimilarUser":
-        query = f'!(similar-users {subject} $user)'
-        print(f"Mapped to SimilarUser query: {query}")
+        query = ("similar-users", {"user": subject})
+        logger.debug("Mapped to SimilarUser query: %s", query)
+    elif depth > 1:
+        query = ("multi-hop-recommend", {"user": subject, "depth": depth})
+        logger.debug("Mapped to multi-hop recommend query: %s", query)
     else:
-        query = f'!(recommend-to {subject} $movie)'
-        print(f"Mapped to default recommend-to query: {query}")
-    print(f"Final MeTTa query: {query}")
+        query = ("recommend-to", {"user": subject})
+        logger.debug("Mapped to default recommend-to query: %s", query)
+    get_query(query[0]).validate(**query[1])
+    logger.debug("Final MeTTa query: %s %s", *query)
     return query
 
 if __name__ == "__main__":
@@ -201,7 +377,7 @@ if __name__ == "__main__":
         try:
             parsed = parse_question_to_json(test['question'], test['assumed_subject'])
             print(f"Parsed result: {parsed}")
-            metta_query = map_json_to_metta(parsed)
+            metta_query = render_query(*map_json_to_metta(parsed))
             print(f"Generated MeTTa query: {metta_query}")
         except Exception as e:
             print(f"Test failed for '{test['question']}': {str(e)}")
@@ -0,0 +1,294 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import defaultdict
+
+from hyperon import AtomKind, E, MeTTa, S, ValueAtom
+
+from cf_engine import build_engine
+from kb_index import (KnowledgeIndex, register_aggregate_functions, register_content_functions,
+                      register_graph_functions, register_index_functions)
+from metrics import configure_logging
+from utils import add_metta_atom, initialize_metta
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+_KIND_CODES = {"String": "T", "Number": "N", "Bool": "B"}
+
+
+def split_top_level(source):
+    """
+    Split MeTTa source text into its top-level expressions, keeping a leading '!'
+    and skipping ';' comments.
+    """
+    segments = []
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+    i = 0
+    while i < len(source):
+        ch = source[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == ";":
+            newline = source.find("\n", i)
+            i = len(source) if newline == -1 else newline
+            continue
+        elif ch == '"':
+            in_string = True
+        elif ch == "(":
+            if depth == 0:
+                start = i - 1 if i > 0 and source[i - 1] == "!" else i
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0 and start is not None:
+                segments.append(source[start:i + 1])
+                start = None
+        i += 1
+    return segments
+
+
+def encode_fact(atom):
+    """
+    Encode a flat ground fact as (signature, values), e.g. ('SSTTTN', ('movie', 'inception', ...)).
+    Returns None for anything that is not a flat fact (rules, nested expressions, variables).
+    """
+    if atom.get_metatype() != AtomKind.EXPR:
+        return None
+    signature = []
+    values = []
+    for child in atom.get_children():
+        kind = child.get_metatype()
+        if kind == AtomKind.SYMBOL:
+            signature.append("S")
+            values.append(child.get_name())
+        elif kind == AtomKind.GROUNDED:
+            code = _KIND_CODES.get(str(child.get_grounded_type()))
+            if code is None:
+                return None
+            signature.append(code)
+            values.append(child.get_object().value)
+        else:
+            return None
+    if not values or signature[0] != "S":
+        return None
+    return "".join(signature), tuple(values)
+
+
+def decode_fact(signature, values):
+    return E(*[S(value) if code == "S" else ValueAtom(value) for code, value in zip(signature, values)])
+
+
+def write_snapshot(metta, path, version, rules, source_digest=None):
+    """
+    Write the facts currently in the space as typed per-signature tables, plus the rule
+    source text, to a pickle file that loads without parsing the facts.
+    """
+    tables = defaultdict(list)
+    for atom in metta.space().get_atoms():
+        encoded = encode_fact(atom)
+        if encoded is not None:
+            tables[encoded[0]].append(encoded[1])
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "created_at": time.time(),
+        "source_digest": source_digest,
+        "rules": rules,
+        "tables": dict(tables),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    facts = sum(len(rows) for rows in tables.values())
+    logger.info("Wrote snapshot %s: version %d, %d facts, %d rules", path, version, facts, len(rules))
+
+
+def load_snapshot(path, cf_metric="cosine"):
+    """
+    Rebuild a MeTTa space, fact index and collaborative engine from a snapshot.
+    Returns (metta, snapshot) where snapshot holds the version and rules.
+    """
+    with open(path, "rb") as f:
+        snapshot = pickle.load(f)
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format in {path}: {snapshot.get('format')}")
+    metta = MeTTa()
+    space = metta.space()
+    index = KnowledgeIndex()
+    register_aggregate_functions(metta, index.aggregates)
+    register_content_functions(metta, index)
+    register_graph_functions(metta, index)
+    for rule in snapshot["rules"]:
+        for atom in metta.parse_all(rule):
+            space.add_atom(atom)
+    for signature, rows in snapshot["tables"].items():
+        for values in rows:
+            space.add_atom(decode_fact(signature, values))
+            index.add_fact(values)
+    index.collaborative = build_engine(index, cf_metric)
+    register_index_functions(metta, index)
+    return metta, snapshot
+
+
+def read_log_entries(path, after_version=0):
+    """
+    Yield (version, atom_text) for every logged mutation newer than after_version.
+    A torn last line from a crash is ignored.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Skipping unreadable mutation log line in %s", path)
+                continue
+            if entry["version"] > after_version:
+                yield entry["version"], entry["atom"]
+
+
+class MutationLog:
+    """
+    Append-only JSON-lines log of mutations, one {"version": n, "atom": "..."} per line.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, version, atom_text):
+        self._file.write(json.dumps({"version": version, "atom": atom_text}) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def entries(self, after_version=0):
+        return read_log_entries(self.path, after_version)
+
+    def compact(self, through_version):
+        """
+        Drop entries already covered by a snapshot at through_version.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for version, atom_text in self.entries(through_version):
+                f.write(json.dumps({"version": version, "atom": atom_text}) + "\n")
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self._file.close()
+
+
+class KnowledgeStore:
+    """
+    Durable knowledge base: a compacted snapshot plus an append-only mutation log.
+
+    open() loads the snapshot and replays the log tail; on first use it loads the .metta
+    source instead and writes the initial snapshot. record() logs each mutation and
+    compacts into a new snapshot every snapshot_every writes.
+    """
+
+    def __init__(self, data_dir, snapshot_every=1000, fsync=False):
+        self.data_dir = data_dir
+        self.snapshot_every = snapshot_every
+        self.snapshot_path = os.path.join(data_dir, "snapshot.pkl")
+        self.log_path = os.path.join(data_dir, "mutations.jsonl")
+        self.fsync = fsync
+        self.version = 0
+        self.rules = []
+        self.source_digest = None
+        self.log = None
+        self._writes_since_snapshot = 0
+        self._lock = threading.Lock()
+
+    def open(self, metta_file_path, cf_metric="cosine", read_only=False):
+        """
+        Return a loaded MeTTa instance at the latest durable version.
+        """
+        started = time.perf_counter()
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open(metta_file_path, "rb") as f:
+            source = f.read()
+        self.source_digest = hashlib.sha256(source).hexdigest()
+        if os.path.exists(self.snapshot_path):
+            metta, snapshot = load_snapshot(self.snapshot_path, cf_metric)
+            self.version = snapshot["version"]
+            self.rules = snapshot["rules"]
+            if snapshot.get("source_digest") != self.source_digest:
+                logger.warning("%s changed since the snapshot was taken; serving the snapshot. "
+                               "Remove %s to reload from source.", metta_file_path, self.data_dir)
+            origin = "snapshot"
+        else:
+            metta = initialize_metta(metta_file_path, cf_metric)
+            self.rules = [segment for segment in split_top_level(source.decode("utf-8"))
+                          if not segment.startswith("!") and encode_fact(metta.parse_single(segment)) is None]
+            origin = "source"
+        self.log = MutationLog(self.log_path, self.fsync) if not read_only else None
+        replayed = 0
+        if os.path.exists(self.log_path):
+            for version, atom_text in read_log_entries(self.log_path, self.version):
+                add_metta_atom(metta, atom_text)
+                self.version = version
+                replayed += 1
+        self._writes_since_snapshot = replayed
+        if origin == "source" and not read_only:
+            self.snapshot(metta)
+        logger.info("Knowledge base loaded from %s at version %d (%d mutations replayed) in %.2fs",
+                    origin, self.version, replayed, time.perf_counter() - started)
+        return metta
+
+    def record(self, atom_text, metta=None):
+        """
+        Durably log a mutation that has been applied to metta and return its version.
+        """
+        with self._lock:
+            self.version += 1
+            self.log.append(self.version, atom_text)
+            self._writes_since_snapshot += 1
+            if metta is not None and self.snapshot_every and self._writes_since_snapshot >= self.snapshot_every:
+                self.snapshot(metta)
+            return self.version
+
+    def snapshot(self, metta):
+        """
+        Write a snapshot at the current version and drop the log entries it covers.
+        """
+        write_snapshot(metta, self.snapshot_path, self.version, self.rules, self.source_digest)
+        if self.log is not None:
+            self.log.compact(self.version)
+        self._writes_since_snapshot = 0
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compact the durable knowledge base into a fresh snapshot.")
+    arg_parser.add_argument("command", choices=["snapshot"])
+    arg_parser.add_argument("--metta", default=os.getenv("METTA_FILE_PATH", "recommendation.metta"))
+    arg_parser.add_argument("--data-dir", default=os.getenv("PERSISTENCE_DIR", "data"))
+    args = arg_parser.parse_args()
+    configure_logging()
+    store = KnowledgeStore(args.data_dir)
+    store.snapshot(store.open(args.metta))
+    store.close()
@@ -0,0 +1,230 @@
+import math
+import re
+import threading
+
+from hyperon import AtomKind, E, MeTTa, S, SExprParser, V, ValueAtom
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\w+)(?::(\w+))?\}|([^\s()"]+))')
+_SYMBOL = re.compile(r'^[^\s()";$&\\][^\s()";\\]*$')
+_NUMBER = re.compile(r'^-?\d+(\.\d+)?$')
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def _compile(template):
+    """
+    Read a template into a tree of ('expr', children), ('const', atom), ('var', name)
+    and ('param', name, kind) nodes. {name} is a symbol parameter, {name:str} a string
+    and {name:num} a number.
+    """
+    stack = [[]]
+    position = 0
+    template = template.strip()
+    while position < len(template):
+        match = _TOKEN.match(template, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Cannot read query template at {position}: {template}")
+        position = match.end()
+        opening, closing, string, param, kind, word = match.groups()
+        if opening:
+            stack.append([])
+        elif closing:
+            children = stack.pop()
+            stack[-1].append(("expr", children))
+        elif string is not None:
+            stack[-1].append(("const", ValueAtom(string)))
+        elif param:
+            if kind not in (None, "str", "num"):
+                raise ValueError(f"Unknown parameter type {kind} in {template}")
+            stack[-1].append(("param", param, kind or "symbol"))
+        elif word.startswith("$"):
+            stack[-1].append(("var", word[1:]))
+        elif _NUMBER.match(word):
+            stack[-1].append(("const", ValueAtom(float(word) if "." in word else int(word))))
+        else:
+            stack[-1].append(("const", S(word)))
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise ValueError(f"Unbalanced query template: {template}")
+    return stack[0][0]
+
+
+def _params(node):
+    if node[0] == "param":
+        return {node[1]: node[2]}
+    if node[0] == "expr":
+        found = {}
+        for child in node[1]:
+            found.update(_params(child))
+        return found
+    return {}
+
+
+def _reads_as_symbol(value):
+    """
+    Whether MeTTa source text reads `value` back as the same symbol, rather than as a number,
+    a boolean or a grounded operation such as '+' or 'match'.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = MeTTa().tokenizer()
+    atom = SExprParser(value).parse(_tokenizer)
+    return atom is not None and atom.get_metatype() == AtomKind.SYMBOL and atom.get_name() == value
+
+
+def bind_value(name, kind, value):
+    """
+    Check one parameter value and turn it into an atom. Symbols may not contain whitespace,
+    parentheses, quotes or ';' and may not start with '$' or '&', so a bound value can
+    never change the shape of the query. Facts are logged and replicated as text, so a
+    symbol must also read back as itself: '42' or 'True' would come back as a number or a
+    boolean. Numbers must be finite.
+    """
+    if kind == "num":
+        if isinstance(value, bool):
+            raise ValueError(f"Invalid number for {name}: {value!r}")
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid number for {name}: {value!r}")
+        if not math.isfinite(number):
+            raise ValueError(f"Invalid number for {name}: {value!r}")
+        return ValueAtom(int(number) if number.is_integer() else number)
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid value for {name}: {value!r}")
+    if kind == "str":
+        if '"' in value or "\\" in value or "\n" in value:
+            raise ValueError(f"Invalid string for {name}: {value!r}")
+        return ValueAtom(value)
+    if not _SYMBOL.match(value) or not _reads_as_symbol(value):
+        raise ValueError(f"Invalid symbol for {name}: {value!r}")
+    return S(value)
+
+
+class PreparedQuery:
+    """
+    A MeTTa query read once into atoms, with {name} parameters bound at execution time.
+
+    With a result template the query is a pattern run through the space's query interface,
+    like !(match &self pattern result); otherwise the expression is evaluated, like
+    !(expression). Parameters are bound as atoms, never spliced into source text.
+    """
+
+    def __init__(self, name, template, result=None):
+        self.name = name
+        self.template = template
+        self.result_template = result
+        self._tree = _compile(template)
+        self._result = _compile(result) if result is not None else None
+        self.params = _params(self._tree)
+        if self._result is not None:
+            self.params.update(_params(self._result))
+
+    def _bound(self, params):
+        missing = set(self.params) - set(params)
+        unknown = set(params) - set(self.params)
+        if missing or unknown:
+            raise ValueError(f"{self.name} takes parameters {sorted(self.params)}, got {sorted(params)}")
+        return {name: bind_value(name, kind, params[name]) for name, kind in self.params.items()}
+
+    def _build(self, node, values, bindings=None):
+        tag = node[0]
+        if tag == "expr":
+            return E(*[self._build(child, values, bindings) for child in node[1]])
+        if tag == "param":
+            return values[node[1]]
+        if tag == "var":
+            if bindings is not None and node[1] in bindings:
+                return bindings[node[1]]
+            return V(node[1])
+        return node[1]
+
+    def validate(self, **params):
+        """
+        Check the parameters as bind() would, without building the query. Raises ValueError.
+        """
+        self._bound(params)
+
+    def bind(self, **params):
+        """
+        The query atom with the parameters bound.
+        """
+        return self._build(self._tree, self._bound(params))
+
+    def execute(self, metta, **params):
+        """
+        Run the query against the MeTTa instance and return the result atoms.
+        """
+        values = self._bound(params)
+        atom = self._build(self._tree, values)
+        if self._result is None:
+            return metta.evaluate_atom(atom)
+        return [self._build(self._result, values, bindings) for bindings in metta.space().query(atom)]
+
+    def render(self, **params):
+        """
+        MeTTa source text for the bound query, e.g. for logs or for fact templates written to
+        the mutation log. Parameter values are validated exactly as for execute().
+        """
+        values = self._bound(params)
+        text = self._render(self._tree, values)
+        if self._result is not None:
+            return f"!(match &self {text} {self._render(self._result, values)})"
+        return text
+
+    def _render(self, node, values):
+        tag = node[0]
+        if tag == "expr":
+            return "(" + " ".join(self._render(child, values) for child in node[1]) + ")"
+        if tag == "var":
+            return f"${node[1]}"
+        return str(values[node[1]] if tag == "param" else node[1])
+
+
+QUERIES = {}
+
+
+def prepare(name, template, result=None):
+    QUERIES[name] = PreparedQuery(name, template, result)
+    return QUERIES[name]
+
+
+def get_query(name):
+    query = QUERIES.get(name)
+    if query is None:
+        raise ValueError(f"Unknown prepared query: {name}")
+    return query
+
+
+def bind_query(name, params):
+    return get_query(name).bind(**params)
+
+
+def render_query(name, params):
+    return get_query(name).render(**params)
+
+
+# Lookups answered by the space's query interface
+prepare("watched", "(watched {user} $movie)", "$movie")
+prepare("watched-users", "(watched $user $movie)", "$user")
+prepare("user-atom", "(user {user})", "{user}")
+prepare("preferences", "(preference {user} $genre)", "$genre")
+prepare("likes-genre", "(preference {user} {genre:str})", "{genre:str}")
+
+# Rules evaluated by the interpreter
+prepare("recommend-to", "(recommend-to {user} $movie)")
+prepare("filter-recommendations", "(filter-recommendations {user} $movie)")
+prepare("similar-users", "(similar-users {user} $other)")
+prepare("collaborative-rec", "(collaborative-rec {user} $movie)")
+prepare("explain-genre", "(explain-genre {user} {movie} $explanation)")
+prepare("explain-director", "(explain-director {user} {movie} $explanation)")
+prepare("explain-collab", "(explain-collab {user} {movie} $explanation)")
+prepare("multi-hop-recommend", "(multi-hop-recommend {user} {depth:num})")
+prepare("multi-hop-similar-users", "(multi-hop-similar-users {user} {depth:num})")
+
+# Facts written by the API
+prepare("user-fact", "(user {user})")
+prepare("preference-fact", "(preference {user} {genre:str})")
+prepare("rating-fact", "(user-rating {user} {movie} {rating:num})")
+prepare("likes-fact", "(likes {user} {movie})")
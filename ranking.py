@@ -0,0 +1,51 @@
+import heapq
+import math
+
+DEFAULT_WEIGHTS = {
+    "genre": 1.0,
+    "director": 1.5,
+    "collaborative": 2.0,
+    "rating": 0.5,
+    "popularity": 0.25,
+}
+
+
+def score_candidate(items, record, popularity, neighbor_scores=None, weights=DEFAULT_WEIGHTS):
+    """
+    Score one candidate from its evidence items, its catalog record and its like count.
+
+    Genre and director evidence add a fixed weight each; collaborative evidence adds the
+    weight scaled by the neighbour's similarity; the movie's rating (1-10 scale) and
+    log-popularity add smaller terms.
+    """
+    score = 0.0
+    for item in items:
+        if item[0] == "collaborative":
+            similarity = neighbor_scores.get(item[1], 1.0) if neighbor_scores else 1.0
+            score += weights["collaborative"] * similarity
+        else:
+            score += weights[item[0]]
+    rating = record.get("rating") if record else None
+    if isinstance(rating, (int, float)):
+        score += weights["rating"] * rating / 10.0
+    score += weights["popularity"] * math.log1p(popularity)
+    return score
+
+
+def rank_candidates(evidence, exclude, catalog, popularity, neighbor_scores=None, limit=None, offset=0,
+                    weights=DEFAULT_WEIGHTS):
+    """
+    Drop excluded movies, score the rest and return ([(movie, score), ...], total) for the
+    requested page, best first. With a limit only offset + limit candidates are selected,
+    through a heap rather than a full sort.
+    """
+    scored = [
+        (score_candidate(items, catalog.get(movie), popularity(movie), neighbor_scores, weights), movie)
+        for movie, items in evidence.items() if movie not in exclude
+    ]
+    key = lambda candidate: (-candidate[0], candidate[1])
+    if limit is None:
+        ordered = sorted(scored, key=key)[offset:]
+    else:
+        ordered = heapq.nsmallest(offset + limit, scored, key=key)[offset:]
+    return [(movie, score) for score, movie in ordered], len(scored)
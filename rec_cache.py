@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class RecommendationCache:
+    """
+    LRU/TTL cache of per-user query results.
+
+    Entries are keyed by (user, template). Writes evict only the users they affect;
+    writes that touch the whole catalog bump a generation counter instead, which
+    makes every older entry stale without walking the cache. A caller that computes a
+    result reads version(user) first and passes it to put(), so a result that a write
+    invalidated while it was being computed is dropped rather than cached.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._keys_by_user = defaultdict(set)
+        self._user_versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def version(self, user):
+        """
+        Token that changes whenever the user's cached results are invalidated.
+        """
+        with self._lock:
+            return self.generation, self._user_versions.get(user, 0)
+
+    def get(self, user, template):
+        """
+        Return the cached value for (user, template), or None on a miss.
+        """
+        key = (user, template)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                generation, expires_at, value = entry
+                if generation == self.generation and expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, user, template, value, version=None):
+        """
+        Cache a value. With the version read before the value was computed, the value is
+        only cached if the user has not been invalidated since; returns whether it was.
+        """
+        key = (user, template)
+        with self._lock:
+            if version is not None and version != (self.generation, self._user_versions.get(user, 0)):
+                return False
+            self._entries[key] = (self.generation, self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._keys_by_user[user].add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate_users(self, users):
+        """
+        Evict every template cached for the given users. None invalidates everything.
+        """
+        with self._lock:
+            if users is None:
+                self.generation += 1
+                self._entries.clear()
+                self._keys_by_user.clear()
+                self._user_versions.clear()
+                return
+            for user in users:
+                self._user_versions[user] += 1
+                for key in list(self._keys_by_user.get(user, ())):
+                    self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        keys = self._keys_by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[key[0]]
@@ -0,0 +1,190 @@
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+
+import utils
+from persistence import KnowledgeStore
+
+logger = logging.getLogger(__name__)
+
+
+def _replica_main(conn, metta_file_path, persistence_dir):
+    """
+    Replica process loop: hold one loaded MeTTa space, apply replicated writes in order
+    and answer read calls against it.
+    """
+    if persistence_dir:
+        metta = KnowledgeStore(persistence_dir).open(metta_file_path, read_only=True)
+    else:
+        metta = utils.initialize_metta(metta_file_path)
+    conn.send(("ready", None))
+    while True:
+        message = conn.recv()
+        kind = message[0]
+        if kind == "stop":
+            break
+        try:
+            if kind == "apply":
+                for atom_text in message[1]:
+                    utils.add_metta_atom(metta, atom_text)
+                conn.send(("ok", None))
+            elif kind == "call":
+                _, name, args, kwargs = message
+                if name not in ReplicaPool.READ_OPERATIONS:
+                    raise ValueError(f"{name} is not a replica read operation")
+                conn.send(("ok", getattr(utils, name)(metta, *args, **kwargs)))
+            else:
+                raise ValueError(f"Unknown replica message: {kind}")
+        except Exception as e:
+            conn.send(("error", str(e)))
+    conn.close()
+
+
+class Replica:
+    """
+    One worker process holding a loaded MeTTa space, answering requests over a pipe.
+    """
+
+    def __init__(self, ctx, replica_id, metta_file_path, persistence_dir, version):
+        self.replica_id = replica_id
+        self.version = version
+        self.lock = threading.Lock()
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_replica_main, args=(child_conn, metta_file_path, persistence_dir),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def request(self, message):
+        self.conn.send(message)
+        status, payload = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(f"Replica {self.replica_id}: {payload}")
+        return payload
+
+
+class ReplicaPool:
+    """
+    Pool of worker processes, each holding its own loaded copy of the knowledge base.
+
+    Reads are spread across idle replicas so they run in parallel on separate cores.
+    Writes take a single writer path: each one is appended to an ordered log and gets
+    the next version number, and replicas replay the log in order. With read_your_writes
+    a replica is caught up to the current version before it serves a read; otherwise a
+    background thread replicates writes and reads may briefly see an older version.
+
+    When the knowledge base is persisted, replicas load the same snapshot and log as the
+    primary and version numbers continue from base_version.
+    """
+
+    READ_OPERATIONS = {
+        "execute_simple_list",
+        "execute_query",
+        "execute_prepared",
+        "describe_movies",
+        "watched_movies",
+        "get_explanations",
+        "recommend_to",
+        "recommend_with_explanations",
+        "ranked_recommendations",
+        "graph_recommendations",
+        "batch_recommendations",
+        "similar_users",
+        "similar_users_scored",
+        "collaborative_scored",
+        "user_exists",
+        "top_movies",
+        "user_profile",
+        "user_likes",
+        "shard_similar_users",
+        "fact_present",
+        "co_liked_movies",
+        "users_liking_any",
+    }
+
+    def __init__(self, metta_file_path, size=None, read_your_writes=True, persistence_dir=None, base_version=0):
+        self.size = size or multiprocessing.cpu_count()
+        self.read_your_writes = read_your_writes
+        self.base_version = base_version
+        self._log = []
+        self._write_lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._pending_sync = threading.Event()
+        self._closed = False
+        ctx = multiprocessing.get_context("spawn")
+        self.replicas = [Replica(ctx, replica_id, metta_file_path, persistence_dir, base_version)
+                         for replica_id in range(self.size)]
+        for replica in self.replicas:
+            replica.conn.recv()
+            self._idle.put(replica)
+        self._syncer = threading.Thread(target=self._sync_loop, daemon=True)
+        self._syncer.start()
+        logger.info("Replica pool started with %d replicas, read_your_writes=%s", self.size, read_your_writes)
+
+    @property
+    def version(self):
+        return self.base_version + len(self._log)
+
+    def replica_versions(self):
+        return [replica.version for replica in self.replicas]
+
+    def write(self, atom_text):
+        """
+        Append a mutation to the replication log and return its version number.
+        """
+        with self._write_lock:
+            self._log.append(atom_text)
+            version = self.base_version + len(self._log)
+        self._pending_sync.set()
+        return version
+
+    def _catch_up(self, replica, target=None):
+        target = self.version if target is None else target
+        if replica.version >= target:
+            return
+        with replica.lock:
+            missing = self._log[replica.version - self.base_version:target - self.base_version]
+            if missing:
+                replica.request(("apply", missing))
+                replica.version += len(missing)
+
+    def read(self, name, *args, min_version=None, **kwargs):
+        """
+        Run utils.<name>(metta, *args, **kwargs) on an idle replica and return its result.
+        """
+        if name not in self.READ_OPERATIONS:
+            raise ValueError(f"{name} is not a replica read operation")
+        replica = self._idle.get()
+        try:
+            if self.read_your_writes or min_version is not None:
+                self._catch_up(replica, self.version if min_version is None else min_version)
+            with replica.lock:
+                return replica.request(("call", name, args, kwargs))
+        finally:
+            self._idle.put(replica)
+
+    def _sync_loop(self):
+        for replica in itertools.cycle(self.replicas):
+            if self._closed:
+                return
+            if all(r.version >= self.version for r in self.replicas):
+                self._pending_sync.clear()
+                self._pending_sync.wait(timeout=1.0)
+                continue
+            try:
+                self._catch_up(replica)
+            except Exception as e:
+                logger.warning("Replica %s sync failed: %s", replica.replica_id, e)
+
+    def close(self):
+        self._closed = True
+        self._pending_sync.set()
+        for replica in self.replicas:
+            with replica.lock:
+                try:
+                    replica.conn.send(("stop",))
+                except (BrokenPipeError, OSError):
+                    pass
+            replica.process.join(timeout=5)
@@ -0,0 +1,136 @@
+import argparse
+import gc
+import logging
+import os
+import secrets
+import signal
+import socket
+import time
+
+from werkzeug.serving import make_server
+
+from metrics import STARTUP_SECONDS, memory_usage
+
+logger = logging.getLogger(__name__)
+
+# Settings that start processes or threads, or append to shared files, which forked
+# workers cannot inherit.
+FORK_UNSAFE_SETTINGS = ("REPLICA_POOL_SIZE", "SHARD_COUNT", "PERSISTENCE_DIR")
+
+
+def preload():
+    """
+    Import the app in the master, which loads the knowledge base, its indexes and the
+    engines once. Returns the module and the seconds it took.
+    """
+    enabled = [name for name in FORK_UNSAFE_SETTINGS if os.getenv(name, "0") not in ("", "0")]
+    if enabled:
+        raise ValueError(f"{', '.join(enabled)} cannot be used with the preforking server")
+    start = time.perf_counter()
+    import app as application
+    application.open_knowledge_base()
+    elapsed = time.perf_counter() - start
+    STARTUP_SECONDS.set(elapsed)
+    return application, elapsed
+
+
+def format_memory(usage):
+    return ", ".join(f"{key}={value / 2 ** 20:.1f}MiB" for key, value in usage.items())
+
+
+def serve(application, sock, host, port):
+    """
+    Worker loop: a threaded WSGI server accepting on the socket inherited from the master.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = make_server(host, port, application.app, threaded=True, fd=sock.fileno())
+    logger.info("Worker %d serving: %s", os.getpid(), format_memory(memory_usage()))
+    server.serve_forever()
+
+
+def spawn_worker(application, sock, host, port):
+    pid = os.fork()
+    if pid == 0:
+        # Each worker versions its own copy of the space, so its ETags must not validate
+        # against another worker's, nor against a worker that replaced it.
+        application.instance_id = secrets.token_hex(4)
+        status = 0
+        try:
+            serve(application, sock, host, port)
+        except Exception as e:
+            logger.exception("Worker %d failed: %s", os.getpid(), e)
+            status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+
+def report_memory(workers):
+    """
+    Log each worker's RSS, PSS and shared memory. Pages still shared copy-on-write with the
+    master count fully towards every worker's RSS but are split between them in PSS.
+    """
+    total_rss = total_pss = 0
+    for pid in sorted(workers):
+        usage = memory_usage(pid)
+        total_rss += usage["rss"]
+        total_pss += usage["pss"]
+        logger.info("Worker %d: %s", pid, format_memory(usage))
+    logger.info("Workers: %d, summed rss=%.1fMiB, summed pss=%.1fMiB", len(workers),
+                total_rss / 2 ** 20, total_pss / 2 ** 20)
+
+
+def run(host, port, workers, report_interval=0.0):
+    """
+    Preload the knowledge base, then fork `workers` processes that share its pages
+    copy-on-write and serve on one listening socket. Dead workers are replaced; SIGINT or
+    SIGTERM stops them all.
+    """
+    application, elapsed = preload()
+    logger.info("Knowledge base loaded in %.2fs: %s", elapsed, format_memory(memory_usage()))
+    sock = socket.create_server((host, port))
+    sock.set_inheritable(True)
+    # Move everything loaded so far out of the collector's generations, so collections in
+    # the workers do not touch (and copy) the preloaded objects.
+    gc.collect()
+    gc.freeze()
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    children = {spawn_worker(application, sock, host, port) for _ in range(workers)}
+    logger.info("Serving on %s:%d with %d workers, started in %.2fs", host, port, workers, elapsed)
+    next_report = time.monotonic() + max(report_interval, 1.0)
+    while not stopping:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid in children:
+            children.discard(pid)
+            logger.warning("Worker %d exited with status %d, restarting", pid, os.waitstatus_to_exitcode(status))
+            children.add(spawn_worker(application, sock, host, port))
+            continue
+        if time.monotonic() >= next_report:
+            report_memory(children)
+            next_report = time.monotonic() + report_interval if report_interval > 0 else float("inf")
+        time.sleep(0.2)
+    logger.info("Stopping %d workers", len(children))
+    for pid in children:
+        os.kill(pid, signal.SIGTERM)
+    for pid in children:
+        os.waitpid(pid, 0)
+    sock.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Load the knowledge base once, then fork workers that share it copy-on-write.")
+    arg_parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    arg_parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 5000)))
+    arg_parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    arg_parser.add_argument("--report-interval", type=float, default=0.0,
+                            help="seconds between worker memory reports; by default only one report after startup")
+    args = arg_parser.parse_args()
+    run(args.host, args.port, args.workers, args.report_interval)
@@ -0,0 +1,344 @@
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+from kb_index import atom_to_value, describe_evidence, get_index
+from metrics import timed_query
+from persistence import split_top_level
+from prepared import get_query
+from ranking import rank_candidates
+from replica_pool import Replica
+
+logger = logging.getLogger(__name__)
+
+USER_RELATIONS = ("likes", "watched", "preference", "user", "user-rating")
+_USER_FACT = re.compile(r'^\(\s*(' + "|".join(USER_RELATIONS) + r')\s+([^\s()"]+)')
+
+
+def shard_for(user, shards):
+    """
+    The shard a user's facts live on: a stable hash of the user ID.
+    """
+    return zlib.crc32(user.encode("utf-8")) % shards
+
+
+def fact_owner(atom_text):
+    """
+    (relation, user) for a user-scoped fact such as (likes alice inception), else None.
+    """
+    match = _USER_FACT.match(atom_text.strip())
+    return match.groups() if match else None
+
+
+def partition_source(source, shards):
+    """
+    Split MeTTa source into the part every shard loads (rules and the movie catalog) and
+    one list of user-scoped facts per shard. Top-level '!' queries are dropped and
+    repeated user facts are kept once.
+    """
+    shared = []
+    partitions = [[] for _ in range(shards)]
+    seen = set()
+    for form in split_top_level(source):
+        if form.startswith("!"):
+            continue
+        owner = fact_owner(form)
+        if owner is None:
+            shared.append(form)
+        elif form not in seen:
+            seen.add(form)
+            partitions[shard_for(owner[1], shards)].append(form)
+    return shared, partitions
+
+
+class ShardedKnowledgeBase:
+    """
+    Users and their likes/watched/preference/rating facts partitioned across worker
+    processes by a hash of the user ID, with the rules and the movie catalog on every shard.
+
+    The coordinator keeps the catalog, the user registry and the movie aggregates. Reads
+    scoped to one user go to that user's shard; collaborative reads scatter the user's
+    likes to every shard, merge each shard's partial top-k neighbours, gather the
+    neighbours' likes from their shards and rank on the coordinator. Writes are applied to
+    the owning shard, or to every shard for catalog facts, before they return.
+    """
+
+    HOME_OPERATIONS = {"watched_movies", "user_exists", "graph_recommendations"}
+    LOCAL_OPERATIONS = {"describe_movies", "top_movies"}
+    SCATTER_OPERATIONS = {
+        "execute_simple_list",
+        "execute_query",
+        "execute_prepared",
+        "get_explanations",
+        "recommend_to",
+        "recommend_with_explanations",
+        "ranked_recommendations",
+        "batch_recommendations",
+        "similar_users",
+        "similar_users_scored",
+        "collaborative_scored",
+    }
+    READ_OPERATIONS = HOME_OPERATIONS | LOCAL_OPERATIONS | SCATTER_OPERATIONS
+    # Prepared queries that read the user's neighbours, answered by scatter-gather
+    COLLABORATIVE_QUERIES = {"recommend-to", "filter-recommendations", "collaborative-rec", "explain-collab"}
+
+    def __init__(self, metta_file_path, shards, shard_dir=None):
+        self.shards = shards
+        self.read_your_writes = True
+        self.shard_dir = shard_dir or tempfile.mkdtemp(prefix="metta-shards-")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        with open(metta_file_path, "r") as f:
+            shared, partitions = partition_source(f.read(), shards)
+        paths = []
+        for shard_id, facts in enumerate(partitions):
+            paths.append(self._write_partition(f"shard-{shard_id}.metta", shared + facts))
+        registered = [fact for facts in partitions for fact in facts if fact_owner(fact)[0] == "user"]
+        coordinator_path = self._write_partition("coordinator.metta", shared + registered)
+        ctx = multiprocessing.get_context("spawn")
+        self.workers = [Replica(ctx, shard_id, path, None, 0) for shard_id, path in enumerate(paths)]
+        self.metta = utils.initialize_metta(coordinator_path)
+        index = get_index(self.metta)
+        for facts in partitions:
+            for fact in facts:
+                index.add_summary(atom_to_value(self.metta.parse_single(fact)))
+        for worker in self.workers:
+            worker.conn.recv()
+        self._executor = ThreadPoolExecutor(max_workers=shards)
+        self._write_lock = threading.Lock()
+        self._writes = 0
+        logger.info("Sharded knowledge base started: %d shards, %s", shards,
+                    ", ".join(f"{len(facts)} user facts" for facts in partitions))
+
+    def _write_partition(self, name, forms):
+        path = os.path.join(self.shard_dir, name)
+        with open(path, "w") as f:
+            f.write("\n".join(forms) + "\n")
+        return path
+
+    @property
+    def version(self):
+        return self._writes
+
+    def replica_versions(self):
+        return [worker.version for worker in self.workers]
+
+    def home(self, user):
+        return self.workers[shard_for(user, self.shards)]
+
+    def _call(self, worker, name, *args, **kwargs):
+        with worker.lock:
+            return worker.request(("call", name, args, kwargs))
+
+    def _scatter(self, name, *args, **kwargs):
+        futures = [self._executor.submit(self._call, worker, name, *args, **kwargs) for worker in self.workers]
+        return [future.result() for future in futures]
+
+    def write(self, atom_text):
+        """
+        Apply a fact to its user's shard (or every shard for catalog facts) and update the
+        coordinator's catalog, registry and aggregates. Returns the new write count, or None
+        when the fact is already present and was ignored.
+        """
+        owner = fact_owner(atom_text)
+        with self._write_lock:
+            if owner is None:
+                targets = self.workers
+                if utils.add_metta_atom(self.metta, atom_text) is None:
+                    return None
+            else:
+                targets = [self.home(owner[1])]
+                if self._call(targets[0], "fact_present", atom_text):
+                    return None
+                get_index(self.metta).add_summary(atom_to_value(self.metta.parse_single(atom_text)))
+                if owner[0] == "user":
+                    utils.add_metta_atom(self.metta, atom_text)
+            for worker in targets:
+                with worker.lock:
+                    worker.request(("apply", [atom_text]))
+                    worker.version += 1
+            self._writes += 1
+            return self._writes
+
+    def affected_users(self, atom):
+        """
+        Users whose recommendations can change because of a fact, or None for catalog facts.
+        A like reaches every user who has the movie as a candidate, gathered from the shards
+        as users who like a related movie or a movie co-liked with it.
+        """
+        fact = atom_to_value(atom)
+        if not isinstance(fact, tuple) or len(fact) < 2 or not isinstance(fact[1], str):
+            return set()
+        if fact[0] == "likes":
+            users = {fact[1]} | set(self.similar_users(fact[1]))
+            if len(fact) == 3 and isinstance(fact[2], str):
+                movies = get_index(self.metta).related_movies(fact[2])
+                for co_liked in self._scatter("co_liked_movies", fact[2]):
+                    movies.update(co_liked)
+                for found in self._scatter("users_liking_any", sorted(movies)):
+                    users.update(found)
+            return users
+        if fact[0] in USER_RELATIONS:
+            return {fact[1]}
+        return None
+
+    def read(self, name, *args, min_version=None, **kwargs):
+        """
+        Run a read helper by name: on the user's shard, on the coordinator, or by
+        scatter-gather across the shards.
+        """
+        if name not in self.READ_OPERATIONS:
+            raise ValueError(f"{name} is not available on a sharded knowledge base")
+        if name in self.LOCAL_OPERATIONS:
+            return getattr(utils, name)(self.metta, *args, **kwargs)
+        if name in self.HOME_OPERATIONS:
+            return self._call(self.home(args[0]), name, *args, **kwargs)
+        return getattr(self, name)(*args, **kwargs)
+
+    def similar_users_scored(self, users, k=None):
+        """
+        Ranked (neighbour, score) lists: each user's likes are scattered to every shard and
+        the shards' partial top-k lists are merged.
+        """
+        results = {}
+        for user in users:
+            liked, _ = self._call(self.home(user), "user_profile", user)
+            partial = self._scatter("shard_similar_users", liked, user, k) if liked else []
+            merged = heapq.merge(*partial, key=lambda pair: (-pair[1], pair[0]))
+            results[user] = list(merged if k is None else itertools.islice(merged, k))
+        return results
+
+    def similar_users(self, user):
+        return [other for other, _ in self.similar_users_scored([user])[user]]
+
+    def _user_likes(self, users):
+        """
+        {user: liked movies}, gathered from the shards holding the users.
+        """
+        by_shard = defaultdict(list)
+        for user in users:
+            by_shard[shard_for(user, self.shards)].append(user)
+        likes = {}
+        workers = [self.workers[shard_id] for shard_id in by_shard]
+        for result in self._scatter_each("user_likes", workers, list(by_shard.values())):
+            likes.update(result)
+        return likes
+
+    def _scatter_each(self, name, workers, args):
+        futures = [self._executor.submit(self._call, worker, name, arg) for worker, arg in zip(workers, args)]
+        return [future.result() for future in futures]
+
+    def collaborative_scored(self, users, k_neighbors=None):
+        """
+        Ranked (movie, score) candidates: every movie liked by a neighbour, scored by the
+        summed similarity of the neighbours who like it.
+        """
+        neighbors = self.similar_users_scored(users, k_neighbors)
+        likes = self._user_likes({other for user in users for other, _ in neighbors[user]})
+        results = {}
+        for user in users:
+            scores = defaultdict(float)
+            for other, score in neighbors[user]:
+                for movie in likes.get(other, ()):
+                    scores[movie] += score
+            results[user] = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))
+        return results
+
+    def _evidence(self, user):
+        liked, watched = self._call(self.home(user), "user_profile", user)
+        neighbors = self.similar_users_scored([user])[user] if liked else []
+        names = [other for other, _ in neighbors]
+        evidence = get_index(self.metta).recommend_with_evidence(user, names, None, liked, self._user_likes(names))
+        return evidence, set(liked) | set(watched), neighbors
+
+    def ranked_recommendations(self, user, limit=None, offset=0):
+        """
+        One page of a user's recommendations ranked on the coordinator from the scattered
+        neighbours, with explanations and the total number of candidates.
+        """
+        with timed_query("sharded-ranked-recommendations", user) as timer:
+            evidence, exclude, neighbors = self._evidence(user)
+            index = get_index(self.metta)
+            ranked, total = rank_candidates(evidence, exclude, index.catalog, index.aggregates.like_count,
+                                            dict(neighbors), limit, offset)
+            recs = utils.describe_movies(self.metta, [movie for movie, _ in ranked])
+            for rec, (_, score) in zip(recs, ranked):
+                rec["score"] = round(score, 4)
+            timer.results = total
+        return {
+            "recommendations": recs,
+            "explanations": utils.explanations_from_evidence(evidence, recs),
+            "similar_users": [other for other, _ in neighbors],
+            "total": total
+        }
+
+    def recommend_with_explanations(self, user, limit=None, offset=0):
+        result = self.ranked_recommendations(user, limit, offset)
+        return result["recommendations"], result["explanations"]
+
+    def batch_recommendations(self, users=None, top_n=None):
+        if users is None:
+            users, _ = get_index(self.metta).user_registry.page()
+        return {user: self.ranked_recommendations(user, top_n) for user in users}
+
+    def recommend_to(self, user):
+        evidence, _, _ = self._evidence(user)
+        return sorted(evidence)
+
+    def get_explanations(self, user, movies, evidence=None):
+        if evidence is None:
+            evidence, _, _ = self._evidence(user)
+        return utils.explanations_from_evidence(evidence, movies)
+
+    def execute_prepared(self, name, **params):
+        """
+        Prepared queries about one user run on that user's shard, except similar-users and
+        the queries that read the user's neighbours, which are answered by scatter-gather
+        like the index-backed helpers of a single space. Queries without a user are run on
+        every shard and merged.
+        """
+        if name == "similar-users":
+            get_query(name).validate(**params)
+            return self.similar_users(params["user"])
+        if name in self.COLLABORATIVE_QUERIES:
+            get_query(name).validate(**params)
+            return self._collaborative_query(name, **params)
+        if "user" in params:
+            return self._call(self.home(params["user"]), "execute_prepared", name, **params)
+        return sorted({item for result in self._scatter("execute_prepared", name, **params) for item in result})
+
+    def _collaborative_query(self, name, user, movie=None):
+        if name == "collaborative-rec":
+            return [movie for movie, _ in self.collaborative_scored([user])[user]]
+        evidence, _, _ = self._evidence(user)
+        if name == "recommend-to":
+            return sorted(evidence)
+        if name == "filter-recommendations":
+            liked, _ = self._call(self.home(user), "user_profile", user)
+            return sorted(set(evidence) - set(liked))
+        return list(dict.fromkeys(describe_evidence(item) for item in evidence.get(movie, ())
+                                  if item[0] == "collaborative"))
+
+    def execute_simple_list(self, query):
+        return sorted({item for result in self._scatter("execute_simple_list", query) for item in result})
+
+    def execute_query(self, query):
+        return utils.describe_movies(self.metta, self.execute_simple_list(query))
+
+    def close(self):
+        for worker in self.workers:
+            with worker.lock:
+                try:
+                    worker.conn.send(("stop",))
+                except (BrokenPipeError, OSError):
+                    pass
+            worker.process.join(timeout=5)
+        self._executor.shutdown(wait=False)
@@ -1,21 +1,35 @@
 // src/static/js/main.js
 let usersList = [];
 
-async function fetchUsers() {
-    try {
-        console.log('Fetching users from /get-users');
-        const response = await fetch('/get-users', {
+// Follows next_cursor through every page of a registry listing (/get-users, /get-movies).
+// The browser revalidates each page with its ETag, so unchanged pages come back as 304s.
+async function fetchAllPages(url, key) {
+    const items = [];
+    let cursor = null;
+    do {
+        const response = await fetch(cursor ? `${url}?cursor=${encodeURIComponent(cursor)}` : url, {
             method: 'GET',
             headers: {'Content-Type': 'application/json'}
         });
         const data = await response.json();
+        if (data.error) return {error: data.error};
+        items.push(...(Array.isArray(data[key]) ? data[key] : []));
+        cursor = data.next_cursor;
+    } while (cursor);
+    return {[key]: items};
+}
+
+async function fetchUsers() {
+    try {
+        console.log('Fetching users from /get-users');
+        const data = await fetchAllPages('/get-users', 'users');
         console.log('Fetched users:', data);
         if (data.error) {
             console.error('Error fetching users:', data.error);
             showNotification('Failed to load users: ' + data.error);
             return [];
         }
-        const users = Array.isArray(data.users) ? data.users : [];
+        const users = data.users;
         if (users.length === 0) {
             console.log('No users returned from server');
             showNotification('No users found in the system');
@@ -65,47 +79,86 @@ function showNotification(message, isError = true) {
     setTimeout(() => { notification.style.display = 'none'; }, 5000);
 }
 
+function formatTitle(m, fallback = 'Unknown') {
+    const title = m.title || m.id || fallback;
+    return title.charAt(0).toUpperCase() + title.slice(1).replace(/-/g, ' ');
+}
+
+// Reads an NDJSON response line by line, calling onEvent for each {event, data} object as it arrives.
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const {done, value} = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), {stream: !done});
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (line) onEvent(JSON.parse(line));
+        }
+        if (done) break;
+    }
+    if (buffer.trim()) onEvent(JSON.parse(buffer));
+}
+
 async function getRecommendations() {
     const user = document.getElementById('user').value;
     if (!user) return showNotification('Please select a user');
     console.log(`Fetching recommendations for user: ${user}`);
+    const recommendationsDiv = document.getElementById('recommendations');
+    const explanationsDiv = document.getElementById('explanations');
+    const similarUsersDiv = document.getElementById('similar-users');
+    const viewingHistoryDiv = document.getElementById('viewing-history');
+    if (!viewingHistoryDiv) {
+        console.error('Viewing history div not found');
+        showNotification('Error: Viewing history element not found');
+        return;
+    }
+    recommendationsDiv.innerHTML = '';
+    explanationsDiv.innerHTML = '';
+    similarUsersDiv.innerHTML = '';
+    viewingHistoryDiv.innerHTML = '';
     try {
         const response = await fetch('/get-recommendations', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({user})
+            headers: {'Content-Type': 'application/json', 'Accept': 'application/x-ndjson'},
+            body: JSON.stringify({user, stream: 'ndjson'})
         });
-        const data = await response.json();
-        console.log('Recommendations response:', data);
-        if (data.error) {
-            showNotification(data.error);
+        if (!response.ok || !(response.headers.get('Content-Type') || '').includes('ndjson')) {
+            const data = await response.json();
+            showNotification(data.error || 'Unable to fetch recommendations');
             return;
         }
-        // Debug watched data
-        console.log('Watched movies:', data.watched);
-        const recommendationsDiv = document.getElementById('recommendations');
-        recommendationsDiv.innerHTML = data.recommendations && data.recommendations.length
-            ? data.recommendations.map(r => `<p>${(r.title || r.id || 'Unknown').charAt(0).toUpperCase() + (r.title || r.id || 'unknown').slice(1).replace(/-/g, ' ')}</p>`).join('')
-            : '<p>No recommendations available.</p>';
-        const explanationsDiv = document.getElementById('explanations');
-        explanationsDiv.innerHTML = data.explanations && data.explanations.length
-            ? data.explanations.map((expList, i) => `<div><h3>${(data.recommendations[i]?.title || data.recommendations[i]?.id || 'Movie').charAt(0).toUpperCase() + (data.recommendations[i]?.title || data.recommendations[i]?.id || 'movie').slice(1).replace(/-/g, ' ')}</h3>${expList.map(e => `<p>${e}</p>`).join('')}</div>`).join('')
-            : '<p>No explanations available.</p>';
-        document.getElementById('similar-users').innerHTML = data.similar_users && data.similar_users.length
-            ? data.similar_users.map(u => `<p>${u.charAt(0).toUpperCase() + u.slice(1)}</p>`).join('')
-            : '<p>No similar users found.</p>';
-        const viewingHistoryDiv = document.getElementById('viewing-history');
-        if (!viewingHistoryDiv) {
-            console.error('Viewing history div not found');
-            showNotification('Error: Viewing history element not found');
-            return;
+        let received = 0;
+        let failed = false;
+        // Render each part as soon as it is streamed instead of waiting for the whole response.
+        await readEventStream(response, ({event, data}) => {
+            console.log('Recommendation event:', event, data);
+            if (event === 'similar_users') {
+                similarUsersDiv.innerHTML = data.length
+                    ? data.map(u => `<p>${u.charAt(0).toUpperCase() + u.slice(1)}</p>`).join('')
+                    : '<p>No similar users found.</p>';
+            } else if (event === 'recommendation') {
+                received++;
+                recommendationsDiv.insertAdjacentHTML('beforeend', `<p>${formatTitle(data.movie)}</p>`);
+                explanationsDiv.insertAdjacentHTML('beforeend',
+                    `<div><h3>${formatTitle(data.movie, 'Movie')}</h3>${data.explanations.map(e => `<p>${e}</p>`).join('')}</div>`);
+            } else if (event === 'watched') {
+                viewingHistoryDiv.innerHTML = data.length
+                    ? data.map(m => `<p>${formatTitle(m)}</p>`).join('')
+                    : '<p>No viewing history available.</p>';
+            } else if (event === 'error') {
+                failed = true;
+                showNotification(data.error);
+            }
+        });
+        if (failed) return;
+        if (!received) {
+            recommendationsDiv.innerHTML = '<p>No recommendations available.</p>';
+            explanationsDiv.innerHTML = '<p>No explanations available.</p>';
         }
-        viewingHistoryDiv.innerHTML = data.watched && data.watched.length
-            ? data.watched.map(m => {
-                console.log('Rendering movie:', m);
-                return `<p>${(m.title || m.id || 'Unknown').charAt(0).toUpperCase() + (m.title || m.id || 'unknown').slice(1).replace(/-/g, ' ')}</p>`;
-              }).join('')
-            : '<p>No viewing history available.</p>';
         showNotification('Recommendations loaded successfully', false);
     } catch (error) {
         console.error('Error fetching recommendations:', error);
@@ -201,11 +254,7 @@ async function refreshMovieDropdown() {
     console.log('Refreshing movie dropdown');
     movieSelect.innerHTML = '<option value="" disabled selected>Select a movie</option>';
     try {
-        const response = await fetch('/get-movies', {
-            method: 'GET',
-            headers: {'Content-Type': 'application/json'}
-        });
-        const data = await response.json();
+        const data = await fetchAllPages('/get-movies', 'movies');
         console.log('Fetched movies:', data);
         let movies = data.movies || ['inception', 'interstellar', 'the-matrix', 'titanic', 'avatar'];
         movies.sort();
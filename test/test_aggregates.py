@@ -0,0 +1,87 @@
+import statistics
+
+import pytest
+
+from aggregates import MovieAggregates, RankedIndex
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_welford_matches_batch_statistics_with_re_ratings():
+    aggregates = MovieAggregates()
+    ratings = {"alice": 7, "bob": 9, "carol": 4, "dave": 8}
+    for user, rating in ratings.items():
+        aggregates.add_rating(user, "heat", rating)
+    aggregates.add_rating("carol", "heat", 6)
+    ratings["carol"] = 6
+    assert aggregates.rating_count("heat") == 4
+    assert aggregates.rating_mean("heat") == pytest.approx(statistics.mean(ratings.values()))
+    assert aggregates.rating_variance("heat") == pytest.approx(statistics.pvariance(ratings.values()))
+
+
+def test_single_re_rating_replaces_the_only_rating():
+    aggregates = MovieAggregates()
+    aggregates.add_rating("alice", "heat", 3)
+    aggregates.add_rating("alice", "heat", 9)
+    assert aggregates.rating_count("heat") == 1
+    assert aggregates.rating_mean("heat") == 9
+    assert aggregates.rating_variance("heat") == 0
+
+
+def test_trending_score_halves_every_half_life():
+    clock = Clock()
+    aggregates = MovieAggregates(half_life=100, clock=clock)
+    aggregates.add_like("heat")
+    clock.now = 100
+    aggregates.add_like("amelie")
+    assert aggregates.trending_score("heat") == pytest.approx(0.5)
+    assert aggregates.trending_score("amelie") == pytest.approx(1.0)
+    assert [movie for movie, _ in aggregates.top("trending")] == ["amelie", "heat"]
+    clock.now = 200
+    assert aggregates.top("trending")[0][1] == pytest.approx(0.5)
+
+
+def test_trending_rebase_keeps_scores():
+    clock = Clock()
+    aggregates = MovieAggregates(half_life=1, clock=clock)
+    aggregates.add_like("heat")
+    clock.now = 600
+    aggregates.add_like("amelie")
+    assert aggregates.trending_score("amelie") == pytest.approx(1.0)
+    assert aggregates.top("trending", limit=1) == [("amelie", pytest.approx(1.0))]
+
+
+def test_top_lists_per_genre_and_catalog_fallback():
+    aggregates = MovieAggregates()
+    aggregates.add_genre("heat", "crime")
+    aggregates.add_genre("amelie", "romance")
+    aggregates.set_catalog_rating("heat", 8.3)
+    aggregates.set_catalog_rating("amelie", 8.5)
+    aggregates.add_like("heat")
+    assert aggregates.top("top-rated") == [("amelie", 8.5), ("heat", 8.3)]
+    aggregates.add_rating("alice", "amelie", 2)
+    assert aggregates.top("top-rated") == [("heat", 8.3), ("amelie", 2.0)]
+    assert aggregates.top("popular", "crime") == [("heat", 1)]
+    assert aggregates.top("popular", "western") == []
+
+
+@pytest.mark.parametrize("limit, offset", [(0, 0), (-1, 0), (5, -1)])
+def test_top_rejects_invalid_pages(limit, offset):
+    with pytest.raises(ValueError):
+        MovieAggregates().top("popular", limit=limit, offset=offset)
+
+
+def test_ranked_index_moves_updated_movies():
+    ranked = RankedIndex()
+    ranked.update("heat", 1)
+    ranked.update("amelie", 2)
+    ranked.update("heat", 3)
+    assert ranked.top() == [("heat", 3), ("amelie", 2)]
+    assert ranked.top(1, 1) == [("amelie", 2)]
+    assert len(ranked) == 2
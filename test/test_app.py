@@ -0,0 +1,124 @@
+import pytest
+
+import app
+import utils
+from prepared import bind_query
+
+
+@pytest.fixture(scope="module")
+def client():
+    app.open_knowledge_base()
+    return app.app.test_client()
+
+
+def test_write_during_computation_is_not_cached(client, monkeypatch):
+    def ranked_then_write(metta, user, limit=None, offset=0):
+        result = utils.ranked_recommendations(metta, user, limit, offset)
+        app.record_fact(bind_query("likes-fact", {"user": user, "movie": "titanic"}))
+        return result
+
+    monkeypatch.setattr(app, "ranked_recommendations", ranked_then_write)
+    response = client.post('/get-recommendations', json={'user': 'alice', 'limit': 3})
+    assert response.status_code == 200
+    assert app.rec_cache.get('alice', 'get-recommendations:3:0') is None
+
+
+def test_recommendations_are_cached_until_a_write(client):
+    first = client.post('/get-recommendations', json={'user': 'bob', 'limit': 3})
+    assert first.status_code == 200
+    assert app.rec_cache.get('bob', 'get-recommendations:3:0') == first.get_json()
+    client.post('/add-rating', json={'user': 'bob', 'movie': 'interstellar', 'rating': 9})
+    assert app.rec_cache.get('bob', 'get-recommendations:3:0') is None
+
+
+@pytest.mark.parametrize("body", [
+    {"users": ["alice"], "limit": "abc"},
+    {"users": ["alice"], "limit": -3},
+    {"users": ["alice"], "limit": 0},
+    {"users": "alice"},
+    {"users": ["alice", 3]},
+    {"users": []},
+])
+@pytest.mark.parametrize("path", ["/batch-recommendations", "/materialized-recommendations"])
+def test_batch_endpoints_reject_invalid_users_and_limits(client, path, body):
+    assert client.post(path, json=body).status_code == 400
+
+
+def test_batch_recommendations_apply_the_limit(client):
+    response = client.post('/batch-recommendations', json={'users': ['alice', 'eve'], 'limit': '2'})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert set(results) == {'alice', 'eve'}
+    assert all(len(result["recommendations"]) <= 2 for result in results.values())
+
+
+def test_repeated_write_leaves_version_and_cache_alone(client):
+    body = {'user': 'eve', 'movie': 'inception', 'rating': 8}
+    assert client.post('/add-rating', json=body).status_code == 200
+    version = client.get('/kb-version').get_json()["version"]
+    client.post('/get-recommendations', json={'user': 'eve', 'limit': 3})
+    assert client.post('/add-rating', json=body).status_code == 200
+    assert client.get('/kb-version').get_json()["version"] == version
+    assert app.rec_cache.get('eve', 'get-recommendations:3:0') is not None
+
+
+def test_repeated_preference_leaves_version_alone(client):
+    body = {'user': 'eve', 'new_genre': 'Film Noir'}
+    assert client.post('/update-preferences', json=body).status_code == 200
+    version = client.get('/kb-version').get_json()["version"]
+    assert client.post('/update-preferences', json=body).status_code == 200
+    assert client.get('/kb-version').get_json()["version"] == version
+
+
+def test_recommendation_pages_concatenate_to_the_full_list(client):
+    full = client.post('/get-recommendations', json={'user': 'frank', 'limit': 100}).get_json()
+    pages = [client.post('/get-recommendations', json={'user': 'frank', 'limit': 2, 'offset': offset}).get_json()
+             for offset in range(0, full["total"], 2)]
+    assert [rec["id"] for page in pages for rec in page["recommendations"]] == \
+        [rec["id"] for rec in full["recommendations"]]
+    assert all(page["total"] == full["total"] for page in pages)
+
+
+@pytest.mark.parametrize("body, status", [
+    ({'limit': None, 'offset': None}, 200),
+    ({'limit': 'x'}, 400),
+    ({'limit': 0}, 400),
+    ({'offset': -1}, 400),
+    ({'limit': [1]}, 400),
+])
+def test_recommendation_page_parameters(client, body, status):
+    response = client.post('/get-recommendations', json=dict(body, user='frank'))
+    assert response.status_code == status
+    if status == 200:
+        assert response.get_json()["limit"] == app.default_limit
+
+
+def test_cursor_pages_cover_the_registry(client):
+    users, cursor = [], None
+    while True:
+        response = client.get('/get-users', query_string={'limit': 3, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        body = response.get_json()
+        users.extend(body["users"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert users == sorted(set(users))
+    assert len(users) == body["total"]
+    assert client.get('/get-users', query_string={'cursor': '!!'}).status_code == 400
+
+
+def test_etag_validates_until_the_next_write(client):
+    first = client.get('/get-movies')
+    etag = first.headers['ETag']
+    assert client.get('/get-movies', headers={'If-None-Match': etag}).status_code == 304
+    client.post('/add-rating', json={'user': 'frank', 'movie': 'heat-1995', 'rating': 3})
+    second = client.get('/get-movies', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+
+
+def test_etag_is_scoped_to_the_instance(client, monkeypatch):
+    etag = client.get('/get-movies').headers['ETag']
+    monkeypatch.setattr(app, "instance_id", "other")
+    assert client.get('/get-movies', headers={'If-None-Match': etag}).status_code == 200
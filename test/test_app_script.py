@@ -0,0 +1,66 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_json(port, path):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return json.loads(response.read())
+
+
+def run_app_script(env, path="/kb-version", timeout=120):
+    """
+    Start `python app.py` with the given settings and return the JSON from `path` once the
+    server answers. Fails if the script exits first.
+    """
+    port = free_port()
+    process_env = dict(os.environ, PORT=str(port), PARSER_MODEL="stub", LOG_LEVEL="WARNING", **env)
+    process = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=process_env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                pytest.fail(f"app.py exited with {process.returncode}:\n{process.stdout.read()}")
+            try:
+                return get_json(port, path)
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.5)
+        pytest.fail("app.py did not start serving in time")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def test_app_script_with_replica_pool():
+    response = run_app_script({"REPLICA_POOL_SIZE": "2", "DEBUG": "False"})
+    assert response["version"] == 0
+    assert response["replicas"] == [0, 0]
+
+
+def test_app_script_with_replica_pool_and_reloader():
+    response = run_app_script({"REPLICA_POOL_SIZE": "2", "DEBUG": "True"})
+    assert response["replicas"] == [0, 0]
+
+
+def test_app_script_with_shards():
+    response = run_app_script({"SHARD_COUNT": "2", "DEBUG": "False"})
+    assert response["replicas"] == [0, 0]
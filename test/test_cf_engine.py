@@ -0,0 +1,72 @@
+import math
+
+import pytest
+
+import cf_engine
+from cf_engine import CollaborativeEngine
+
+LIKES = {
+    "alice": {"inception", "interstellar", "avatar"},
+    "bob": {"inception", "avatar", "titanic"},
+    "carol": {"titanic", "amelie"},
+    "dave": {"heat"},
+}
+
+
+def make_engine(metric="cosine"):
+    engine = CollaborativeEngine(metric)
+    for user, movies in LIKES.items():
+        for movie in sorted(movies):
+            engine.add_like(user, movie)
+    return engine
+
+
+def expected(user, other, metric):
+    shared = len(LIKES[user] & LIKES[other])
+    if metric == "cosine":
+        return shared / math.sqrt(len(LIKES[user]) * len(LIKES[other]))
+    return shared / len(LIKES[user] | LIKES[other])
+
+
+@pytest.mark.parametrize("metric", ["cosine", "jaccard"])
+def test_neighbors_match_set_similarity(metric):
+    engine = make_engine(metric)
+    neighbors = engine.top_neighbors(list(LIKES))
+    for user in LIKES:
+        want = sorted(((other, expected(user, other, metric)) for other in LIKES
+                       if other != user and LIKES[user] & LIKES[other]), key=lambda pair: (-pair[1], pair[0]))
+        assert [other for other, _ in neighbors[user]] == [other for other, _ in want]
+        assert [score for _, score in neighbors[user]] == pytest.approx([score for _, score in want])
+    assert neighbors["dave"] == []
+
+
+def test_recommend_sums_neighbor_similarity():
+    engine = make_engine()
+    scores = dict(engine.recommend(["alice"])["alice"])
+    bob = expected("alice", "bob", "cosine")
+    assert scores["titanic"] == pytest.approx(bob)
+    assert scores["inception"] == pytest.approx(bob)
+    assert "amelie" not in scores and "heat" not in scores
+
+
+def test_likes_added_after_a_query_are_folded_in():
+    engine = make_engine()
+    engine.top_neighbors(["dave"])
+    assert engine.add_like("dave", "titanic")
+    assert not engine.add_like("dave", "titanic")
+    assert [other for other, _ in engine.top_neighbors(["dave"])["dave"]] == ["carol", "bob"]
+
+
+def test_neighbors_of_matches_top_neighbors_for_the_same_likes():
+    engine = make_engine()
+    remote = engine.neighbors_of(LIKES["alice"], exclude=["alice"])
+    local = engine.top_neighbors(["alice"])["alice"]
+    assert [other for other, _ in remote] == [other for other, _ in local]
+    assert [score for _, score in remote] == pytest.approx([score for _, score in local])
+
+
+def test_chunked_batches_match_one_batch(monkeypatch):
+    engine = make_engine()
+    whole = engine.recommend(list(LIKES))
+    monkeypatch.setattr(cf_engine, "_CHUNK_ROWS", 1)
+    assert engine.recommend(list(LIKES)) == whole
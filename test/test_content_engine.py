@@ -0,0 +1,74 @@
+import math
+
+import pytest
+
+from content_engine import ContentEngine, rating_bucket
+
+MOVIES = {
+    "inception": {"genre": "sci-fi", "director": "nolan", "rating": 8.8},
+    "interstellar": {"genre": "sci-fi", "director": "nolan", "rating": 8.6},
+    "memento": {"genre": "thriller", "director": "nolan", "rating": 8.4},
+    "amelie": {"genre": "romance", "director": "jeunet", "rating": 8.3},
+    "heat": {"genre": "crime", "director": "mann", "rating": 7.3},
+}
+
+
+def make_engine(**kwargs):
+    engine = ContentEngine(**kwargs)
+    for movie, features in MOVIES.items():
+        engine.add_feature(movie, "genre", features["genre"])
+        engine.add_feature(movie, "director", features["director"])
+        engine.set_rating(movie, features["rating"])
+    return engine
+
+
+def vector(movie):
+    features = MOVIES[movie]
+    entries = {("genre", features["genre"]): 1.0, ("director", features["director"]): 1.0,
+               ("rating", rating_bucket(features["rating"])): 0.5}
+    norm = math.sqrt(sum(weight * weight for weight in entries.values()))
+    return {key: weight / norm for key, weight in entries.items()}
+
+
+def cosine(a, b):
+    return sum(weight * b.get(key, 0.0) for key, weight in a.items())
+
+
+def test_similar_movies_use_cosine_over_weighted_features():
+    engine = make_engine()
+    ranked = engine.similar_movies("inception")
+    assert [movie for movie, _ in ranked] == ["interstellar", "memento", "amelie"]
+    for movie, score in ranked:
+        assert score == pytest.approx(cosine(vector("inception"), vector(movie)), rel=1e-5)
+    assert engine.similar_movies("unknown") == []
+
+
+def test_recommend_scores_against_the_liked_profile():
+    engine = make_engine()
+    ranked = dict(engine.recommend(["alice"], {"alice": {"inception", "amelie"}})["alice"])
+    assert "inception" not in ranked and "amelie" not in ranked
+    assert ranked["interstellar"] > ranked["memento"] > 0
+    assert "heat" not in ranked
+    assert engine.recommend(["nobody"], {})["nobody"] == []
+
+
+def test_neighbor_table_keeps_the_top_k():
+    engine = make_engine(neighbors=1)
+    assert [movie for movie, _ in engine.similar_movies("inception")] == ["interstellar"]
+    assert [movie for movie, _ in engine.recommend(["alice"], {"alice": {"inception"}})["alice"]] == ["interstellar"]
+
+
+def test_new_rating_replaces_the_bucket():
+    engine = make_engine()
+    engine.set_rating("heat", 8.9)
+    assert ("rating", "8") in engine.feature_ids
+    row = engine._rows[engine.item_ids["heat"]]
+    assert [engine.features[fid] for fid in row if engine.features[fid][0] == "rating"] == [("rating", "8")]
+    assert [movie for movie, _ in engine.similar_movies("heat")] == ["amelie", "inception", "interstellar", "memento"]
+
+
+def test_features_added_after_a_query_are_scored():
+    engine = make_engine()
+    assert engine.similar_movies("heat") == []
+    engine.add_feature("heat", "genre", "thriller")
+    assert [movie for movie, _ in engine.similar_movies("heat")] == ["memento"]
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from graph_engine import GraphRecommender, walk_steps
+
+EDGES = [
+    (("user", "alice"), ("movie", "inception")),
+    (("user", "bob"), ("movie", "inception")),
+    (("user", "bob"), ("movie", "titanic")),
+    (("movie", "inception"), ("genre", "sci-fi")),
+    (("movie", "interstellar"), ("genre", "sci-fi")),
+    (("movie", "titanic"), ("genre", "romance")),
+    (("movie", "amelie"), ("genre", "romance")),
+]
+
+
+def make_graph(**kwargs):
+    graph = GraphRecommender(restart=0.2, **kwargs)
+    for source, target in EDGES:
+        graph.add_edge(source, target)
+    return graph
+
+
+def dense_pagerank(graph, user, steps):
+    n = len(graph.nodes)
+    adjacency = np.zeros((n, n))
+    for source, target in EDGES:
+        i, j = graph.node_ids[source], graph.node_ids[target]
+        adjacency[i, j] = adjacency[j, i] = 1
+    transition = adjacency / adjacency.sum(axis=0)
+    frontier = np.zeros(n)
+    frontier[graph.node_ids[("user", user)]] = 1
+    scores = np.zeros(n)
+    for step in range(steps + 1):
+        scores += 0.2 * 0.8 ** step * frontier
+        frontier = transition @ frontier
+    return scores
+
+
+def test_walk_matches_dense_truncated_pagerank():
+    graph = make_graph()
+    scores, reached = graph.walk("alice", walk_steps(2))
+    assert scores == pytest.approx(dense_pagerank(graph, "alice", walk_steps(2)), rel=1e-5)
+    assert reached[graph.node_ids[("movie", "inception")]] == 1
+    assert reached[graph.node_ids[("user", "bob")]] == 2
+
+
+def test_depth_bounds_the_movies_reached():
+    graph = make_graph()
+    one, total_one = graph.recommend("alice", 1, exclude={"inception"})
+    assert {movie for movie, _, _ in one} == {"interstellar", "titanic"}
+    assert all(hops == 1 for _, _, hops in one)
+    two, total_two = graph.recommend("alice", 2, exclude={"inception"})
+    assert dict((movie, hops) for movie, _, hops in two)["amelie"] == 2
+    assert total_two == total_one + 1
+    page, total = graph.recommend("alice", 2, exclude={"inception"}, limit=1, offset=1)
+    assert page == two[1:2] and total == total_two
+
+
+def test_similar_users_exclude_the_user():
+    graph = make_graph()
+    assert [other for other, _ in graph.similar_users("alice", 1)] == ["bob"]
+    assert graph.similar_users("nobody", 3) == []
+
+
+def test_new_edges_drop_memoised_walks():
+    graph = make_graph()
+    before = {movie for movie, _, _ in graph.recommend("alice", 1)[0]}
+    assert "amelie" not in before
+    graph.add_edge(("user", "alice"), ("movie", "amelie"))
+    after = {movie for movie, _, _ in graph.recommend("alice", 1)[0]}
+    assert after == before | {"amelie"}
+
+
+def test_memo_stays_within_its_byte_budget():
+    graph = make_graph(memo_bytes=len(EDGES) * 4 * 8)
+    for user in ("alice", "bob"):
+        graph.recommend(user, 2)
+        assert graph._memo_used <= graph.memo_bytes
+    graph = make_graph(memo_bytes=0)
+    graph.recommend("alice", 2)
+    assert graph._memo_used == 0 and not graph._frontiers
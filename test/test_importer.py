@@ -0,0 +1,45 @@
+from hyperon import MeTTa
+
+from importer import BulkImporter, slug
+from kb_index import KnowledgeIndex, register_index_functions
+
+
+def make_metta():
+    metta = MeTTa()
+    register_index_functions(metta, KnowledgeIndex())
+    return metta
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_numeric_ids_become_prefixed_symbols():
+    assert slug("42", "user") == "user-42"
+    assert slug("Christopher Nolan") == "christopher-nolan"
+
+
+def test_movie_without_rating_is_not_scored_as_zero(tmp_path):
+    metta = make_metta()
+    movies = write(tmp_path / "movies.csv", "movieId,title,genres\n1,Heat,Crime|Thriller\n")
+    BulkImporter(metta).import_file(movies, "movies")
+    index = metta.kb_index
+    assert index.catalog.get("movie-1")["rating"] == ""
+    assert "movie-1" not in index.aggregates.catalog_ratings
+    assert not any(kind == "rating" for kind, _ in index.content.features)
+    assert index.movies_by_genre["crime"] == {"movie-1"}
+
+
+def test_reimport_adds_no_duplicates(tmp_path):
+    metta = make_metta()
+    ratings = write(tmp_path / "ratings.csv", "userId,movieId,rating\n1,1,4\n1,2,5\n2,1,3\n")
+    first = BulkImporter(metta, like_threshold=4)
+    first.import_file(ratings, "ratings")
+    atoms = len(metta.space().get_atoms())
+    second = BulkImporter(metta, like_threshold=4)
+    second.import_file(ratings, "ratings")
+    assert second.stats()["facts_added"] == 0
+    assert second.stats()["duplicates_skipped"] == first.stats()["facts_added"]
+    assert len(metta.space().get_atoms()) == atoms
+    assert metta.kb_index.likes_by_user["user-1"] == {"movie-1", "movie-2"}
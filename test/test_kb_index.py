@@ -0,0 +1,105 @@
+import threading
+
+from kb_index import KnowledgeIndex
+
+
+def build(facts):
+    index = KnowledgeIndex()
+    for fact in facts:
+        index.add_fact(fact)
+    return index
+
+
+CATALOG = [
+    ('movie', 'inception', 'Inception', 'sci-fi', 'nolan', 8.8),
+    ('movie', 'interstellar', 'Interstellar', 'sci-fi', 'nolan', 8.6),
+    ('movie', 'memento', 'Memento', 'thriller', 'nolan', 8.4),
+    ('movie', 'amelie', 'Amelie', 'romance', 'jeunet', 8.3),
+    ('genre', 'inception', 'sci-fi'),
+    ('genre', 'interstellar', 'sci-fi'),
+    ('genre', 'memento', 'thriller'),
+    ('genre', 'amelie', 'romance'),
+    ('director', 'inception', 'nolan'),
+    ('director', 'interstellar', 'nolan'),
+    ('director', 'memento', 'nolan'),
+    ('director', 'amelie', 'jeunet'),
+]
+
+
+def test_recommend_to_unions_content_director_and_collaborative():
+    index = build(CATALOG + [('likes', 'alice', 'inception'), ('likes', 'bob', 'inception'),
+                             ('likes', 'bob', 'amelie')])
+    assert index.content_similarity('alice') == {'inception', 'interstellar'}
+    assert index.director_match('alice') == {'inception', 'interstellar', 'memento'}
+    assert index.similar_users('alice') == {'bob'}
+    assert index.recommend_to('alice') == {'inception', 'interstellar', 'memento', 'amelie'}
+    evidence = index.recommend_with_evidence('alice')
+    assert ('collaborative', 'bob') in evidence['amelie']
+    assert ('director', 'inception', 'nolan') in evidence['memento']
+
+
+def test_has_fact_tracks_indexed_facts_and_current_ratings():
+    index = build(CATALOG + [('likes', 'alice', 'inception'), ('user-rating', 'alice', 'memento', 6),
+                             ('rating', 'amelie', 8.3)])
+    assert index.has_fact(('likes', 'alice', 'inception'))
+    assert not index.has_fact(('likes', 'alice', 'memento'))
+    assert index.has_fact(('user-rating', 'alice', 'memento', 6))
+    assert not index.has_fact(('user-rating', 'alice', 'memento', 7))
+    assert index.has_fact(('rating', 'amelie', 8.3))
+    assert not index.has_fact(('preference', 'alice', 'sci-fi'))
+
+
+def test_affected_users_include_every_candidate_of_a_liked_movie():
+    index = build(CATALOG + [('likes', 'alice', 'interstellar'), ('likes', 'carol', 'amelie'),
+                             ('likes', 'dave', 'memento'), ('likes', 'erin', 'amelie')])
+    affected = index.affected_users(('likes', 'bob', 'inception'))
+    # alice and dave have inception as a genre or director candidate; carol and erin do not
+    assert affected == {'bob', 'alice', 'dave'}
+    assert index.affected_users(('movie', 'tenet', 'Tenet', 'sci-fi', 'nolan', 7.3)) is None
+    assert index.affected_users(('watched', 'carol', 'inception')) == {'carol'}
+
+
+def test_accessors_return_copies():
+    index = build([('likes', 'alice', 'inception'), ('watched', 'alice', 'memento')])
+    liked = index.liked_movies('alice')
+    liked.add('amelie')
+    assert index.liked_movies('alice') == {'inception'}
+    assert index.watched_movies('alice') == {'memento'}
+    assert index.likes_of(['alice', 'nobody']) == {'alice': {'inception'}}
+
+
+def test_lookups_run_while_likes_are_written():
+    index = build(CATALOG + [('likes', 'alice', 'inception')])
+    errors = []
+    done = threading.Event()
+
+    def write():
+        for i in range(20000):
+            index.add_fact(('likes', f'user-{i}', 'inception'))
+            index.add_fact(('likes', 'alice', f'movie-{i}'))
+        done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                index.recommend_with_evidence('alice')
+                index.similar_users('alice')
+                index.users()
+        except Exception as e:
+            errors.append(e)
+            done.set()
+
+    threads = [threading.Thread(target=write), threading.Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_has_fact_tracks_declared_users_and_preferences():
+    index = build([('user', 'alice'), ('likes', 'bob', 'inception'), ('preference', 'alice', 'Sci-Fi')])
+    assert index.has_fact(('user', 'alice'))
+    assert not index.has_fact(('user', 'bob'))
+    assert index.has_fact(('preference', 'alice', 'Sci-Fi'))
+    assert not index.has_fact(('preference', 'alice', 'Drama'))
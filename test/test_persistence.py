@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from persistence import KnowledgeStore, decode_fact, encode_fact, split_top_level
+from prepared import bind_query
+from utils import add_metta_atom, execute_prepared, user_exists
+
+FACTS = [
+    ("user-fact", {"user": "user-42"}),
+    ("likes-fact", {"user": "user-42", "movie": "inception"}),
+    ("rating-fact", {"user": "user-42", "movie": "titanic", "rating": 6.5}),
+    ("preference-fact", {"user": "user-42", "genre": "Science Fiction"}),
+]
+
+
+def write_facts(store, metta):
+    for name, params in FACTS:
+        atom = bind_query(name, params)
+        if add_metta_atom(metta, atom) is not None:
+            store.record(str(atom), metta)
+
+
+def check_facts(metta):
+    assert user_exists(metta, "user-42")
+    assert "inception" in metta.kb_index.liked_movies("user-42")
+    assert metta.kb_index.has_fact(("user-rating", "user-42", "titanic", 6.5))
+    assert execute_prepared(metta, "preferences", user="user-42") == ['"Science Fiction"']
+
+
+@pytest.mark.parametrize("snapshot_every", [0, 2])
+def test_writes_survive_a_restart(tmp_path, snapshot_every):
+    store = KnowledgeStore(str(tmp_path), snapshot_every=snapshot_every)
+    metta = store.open("recommendation.metta")
+    write_facts(store, metta)
+    version = store.version
+    store.close()
+
+    reopened = KnowledgeStore(str(tmp_path))
+    metta = reopened.open("recommendation.metta")
+    assert reopened.version == version == len(FACTS)
+    check_facts(metta)
+    write_facts(reopened, metta)
+    assert reopened.version == version
+    reopened.close()
+
+
+def test_snapshot_compacts_the_log(tmp_path):
+    store = KnowledgeStore(str(tmp_path), snapshot_every=len(FACTS))
+    metta = store.open("recommendation.metta")
+    write_facts(store, metta)
+    store.close()
+    assert os.path.getsize(os.path.join(str(tmp_path), "mutations.jsonl")) == 0
+    check_facts(KnowledgeStore(str(tmp_path)).open("recommendation.metta", read_only=True))
+
+
+def test_facts_encode_with_their_types():
+    atom = bind_query("rating-fact", {"user": "alice", "movie": "titanic", "rating": 7})
+    encoded = encode_fact(atom)
+    assert encoded == ("SSSN", ("user-rating", "alice", "titanic", 7))
+    assert decode_fact(*encoded) == atom
+
+
+def test_split_top_level_keeps_rules_and_skips_comments():
+    source = '; comment (x)\n(likes a b)\n!(match &self (likes $x $y) $y)\n(= (f $x) "a (b")\n'
+    assert split_top_level(source) == ['(likes a b)', '!(match &self (likes $x $y) $y)', '(= (f $x) "a (b")']
@@ -0,0 +1,36 @@
+import pytest
+from hyperon import AtomKind, MeTTa
+
+from prepared import bind_query, get_query
+
+
+def test_bind_builds_fact_atoms():
+    fact = bind_query("rating-fact", {"user": "alice", "movie": "inception", "rating": "8.5"})
+    assert str(fact) == "(user-rating alice inception 8.5)"
+    assert fact.get_children()[1].get_metatype() == AtomKind.SYMBOL
+
+
+@pytest.mark.parametrize("value", ["42", "-3", "1e5", "True", "+", "match", "a b", "(x)", "$x", "&self", ""])
+def test_bind_rejects_symbols_that_do_not_read_back(value):
+    with pytest.raises(ValueError):
+        bind_query("likes-fact", {"user": value, "movie": "inception"})
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "1e999", True, "eight", None])
+def test_bind_rejects_invalid_numbers(value):
+    with pytest.raises(ValueError):
+        bind_query("rating-fact", {"user": "alice", "movie": "inception", "rating": value})
+
+
+def test_bound_facts_round_trip_through_text():
+    metta = MeTTa()
+    for value in ["alice", "user-42", "movie-1917", "sci-fi"]:
+        fact = bind_query("likes-fact", {"user": value, "movie": "inception"})
+        assert metta.parse_single(str(fact)) == fact
+
+
+def test_bind_checks_parameter_names():
+    with pytest.raises(ValueError):
+        get_query("watched").validate(user="alice", movie="inception")
+    with pytest.raises(ValueError):
+        get_query("watched").validate()
@@ -0,0 +1,50 @@
+import math
+
+import pytest
+
+from kb_index import MovieCatalog
+from ranking import DEFAULT_WEIGHTS, rank_candidates, score_candidate
+
+EVIDENCE = {
+    "interstellar": [("genre", "inception", "sci-fi"), ("director", "inception", "nolan")],
+    "titanic": [("collaborative", "bob"), ("collaborative", "carol")],
+    "memento": [("director", "inception", "nolan")],
+    "inception": [("genre", "interstellar", "sci-fi")],
+    "heat": [("genre", "memento", "thriller")],
+}
+
+
+def make_catalog():
+    catalog = MovieCatalog()
+    catalog.add_movie(("movie", "interstellar", "Interstellar", "Sci-Fi", "Nolan", 8.6))
+    catalog.add_movie(("movie", "heat", "Heat", "Crime", "", ""))
+    return catalog
+
+
+def test_score_adds_evidence_rating_and_popularity_terms():
+    record = {"rating": 8.0}
+    score = score_candidate([("genre", "a", "g"), ("collaborative", "bob")], record, 3, {"bob": 0.5})
+    assert score == pytest.approx(DEFAULT_WEIGHTS["genre"] + DEFAULT_WEIGHTS["collaborative"] * 0.5
+                                  + DEFAULT_WEIGHTS["rating"] * 0.8 + DEFAULT_WEIGHTS["popularity"] * math.log1p(3))
+
+
+def test_missing_rating_adds_nothing():
+    assert score_candidate([], {"rating": ""}, 0) == 0
+    assert score_candidate([], None, 0) == 0
+
+
+def test_pages_partition_the_full_ranking():
+    catalog = make_catalog()
+    popularity = {"titanic": 4}.get
+    full, total = rank_candidates(EVIDENCE, {"inception"}, catalog, lambda movie: popularity(movie, 0))
+    assert total == 4
+    assert [movie for movie, _ in full] == ["titanic", "interstellar", "memento", "heat"]
+    pages = [rank_candidates(EVIDENCE, {"inception"}, catalog, lambda movie: popularity(movie, 0), limit=2,
+                             offset=offset)[0] for offset in (0, 2, 4)]
+    assert pages[0] + pages[1] == full and pages[2] == []
+
+
+def test_ties_break_by_movie_id():
+    evidence = {"b": [("genre", "x", "g")], "a": [("genre", "x", "g")]}
+    ranked, _ = rank_candidates(evidence, set(), MovieCatalog(), lambda movie: 0, limit=1)
+    assert ranked == [("a", DEFAULT_WEIGHTS["genre"])]
@@ -0,0 +1,61 @@
+from rec_cache import RecommendationCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = RecommendationCache(ttl=10, clock=clock)
+    cache.put("alice", "recs", [1])
+    assert cache.get("alice", "recs") == [1]
+    clock.now = 11
+    assert cache.get("alice", "recs") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RecommendationCache(max_entries=2)
+    cache.put("alice", "recs", 1)
+    cache.put("bob", "recs", 2)
+    cache.get("alice", "recs")
+    cache.put("carol", "recs", 3)
+    assert cache.get("bob", "recs") is None
+    assert cache.get("alice", "recs") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidation_is_scoped_to_users():
+    cache = RecommendationCache()
+    cache.put("alice", "recs", 1)
+    cache.put("alice", "similar", 2)
+    cache.put("bob", "recs", 3)
+    cache.invalidate_users({"alice"})
+    assert cache.get("alice", "recs") is None
+    assert cache.get("alice", "similar") is None
+    assert cache.get("bob", "recs") == 3
+    cache.invalidate_users(None)
+    assert cache.get("bob", "recs") is None
+
+
+def test_result_invalidated_while_computed_is_not_cached():
+    cache = RecommendationCache()
+    version = cache.version("alice")
+    cache.invalidate_users({"alice"})
+    assert not cache.put("alice", "recs", "stale", version)
+    assert cache.get("alice", "recs") is None
+    version = cache.version("alice")
+    cache.invalidate_users({"bob"})
+    assert cache.put("alice", "recs", "fresh", version)
+    assert cache.get("alice", "recs") == "fresh"
+
+
+def test_catalog_write_while_computed_drops_every_result():
+    cache = RecommendationCache()
+    version = cache.version("alice")
+    cache.invalidate_users(None)
+    assert not cache.put("alice", "recs", "stale", version)
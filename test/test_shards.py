@@ -0,0 +1,71 @@
+import pytest
+
+import utils
+from kb_index import describe_evidence, get_index
+from shards import ShardedKnowledgeBase, fact_owner, partition_source, shard_for
+
+
+@pytest.fixture(scope="module")
+def single():
+    return utils.initialize_metta("recommendation.metta")
+
+
+@pytest.fixture(scope="module")
+def sharded(tmp_path_factory):
+    kb = ShardedKnowledgeBase("recommendation.metta", 3, str(tmp_path_factory.mktemp("shards")))
+    yield kb
+    kb.close()
+
+
+def test_user_facts_are_partitioned_by_owner():
+    source = '(movie m "M" "Drama" "D" 7)\n(likes alice m)\n(watched bob m)\n!(likes $x $y)\n(likes alice m)\n'
+    shared, partitions = partition_source(source, 2)
+    assert shared == ['(movie m "M" "Drama" "D" 7)']
+    assert partitions[shard_for("alice", 2)].count("(likes alice m)") == 1
+    assert "(watched bob m)" in partitions[shard_for("bob", 2)]
+    assert fact_owner("(user-rating carol m 5)") == ("user-rating", "carol")
+    assert fact_owner("(genre m drama)") is None
+
+
+def test_merged_neighbors_match_one_space(single, sharded):
+    users = get_index(single).users()
+    merged = sharded.similar_users_scored(users)
+    for user, want in utils.similar_users_scored(single, users).items():
+        assert [other for other, _ in merged[user]] == [other for other, _ in want]
+        assert [score for _, score in merged[user]] == pytest.approx([score for _, score in want])
+
+
+def test_ranked_pages_match_one_space(single, sharded):
+    for user in get_index(single).users():
+        want = utils.ranked_recommendations(single, user, 5, 1)
+        got = sharded.ranked_recommendations(user, 5, 1)
+        assert [rec["id"] for rec in got["recommendations"]] == [rec["id"] for rec in want["recommendations"]]
+        assert got["explanations"] == want["explanations"]
+        assert got["total"] == want["total"]
+
+
+def test_collaborative_prepared_queries_match_the_index(single, sharded):
+    index = get_index(single)
+    for user in index.users():
+        evidence = index.recommend_with_evidence(user)
+        assert sorted(sharded.execute_prepared("recommend-to", user=user)) == sorted(index.recommend_to(user))
+        assert (sorted(sharded.execute_prepared("filter-recommendations", user=user))
+                == sorted(set(evidence) - index.liked_movies(user)))
+        assert sorted(sharded.execute_prepared("collaborative-rec", user=user)) == sorted(index.collaborative_rec(user))
+        want = sorted({describe_evidence(item) for item in evidence.get("titanic", ()) if item[0] == "collaborative"})
+        assert sorted(sharded.execute_prepared("explain-collab", user=user, movie="titanic")) == want
+    with pytest.raises(ValueError):
+        sharded.execute_prepared("recommend-to", user="a b)")
+
+
+def test_writes_reach_the_owning_shard_once(single, sharded):
+    fact = "(likes zed inception)"
+    expected = get_index(single).affected_users(("likes", "zed", "inception"))
+    version = sharded.write(fact)
+    assert version is not None
+    assert sharded.write(fact) is None
+    assert sharded.version == version
+    assert sharded.execute_prepared("watched", user="zed") == []
+    liked, _ = sharded._call(sharded.home("zed"), "user_profile", "zed")
+    assert liked == ["inception"]
+    assert sharded.affected_users(single.parse_single(fact)) == expected | {"zed"}
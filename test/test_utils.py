@@ -0,0 +1,48 @@
+import pytest
+
+import utils
+from kb_index import get_index
+
+
+@pytest.fixture(scope="module")
+def metta():
+    return utils.initialize_metta("recommendation.metta")
+
+
+@pytest.mark.parametrize("depth", [1, 2, 3])
+def test_multi_hop_similar_users_keep_their_ranking(metta, depth):
+    ranked = [other for other, _ in get_index(metta).graph.similar_users("alice", depth)]
+    assert ranked
+    assert utils.execute_prepared(metta, "multi-hop-similar-users", user="alice", depth=depth) == ranked
+
+
+def test_multi_hop_recommendations_keep_their_ranking(metta):
+    index = get_index(metta)
+    ranked = [movie for movie, _, _ in index.graph.recommend("alice", 2, index.liked_movies("alice"))[0]]
+    assert utils.execute_prepared(metta, "multi-hop-recommend", user="alice", depth=2) == ranked
+
+
+def test_explanations_name_the_shared_facts(metta):
+    index = get_index(metta)
+    liked = index.liked_movies("alice")
+    neighbors = index.similar_users("alice")
+    recs, explanations = utils.recommend_with_explanations(metta, "alice")
+    assert recs
+    for rec, reasons in zip(recs, explanations):
+        movie = rec["id"]
+        expected = {f"Similar genre to {other}" for other in liked
+                    if index.genres_by_movie[other] & index.genres_by_movie[movie]}
+        expected |= {f"Same director as {other}" for other in liked
+                     if index.directors_by_movie[other] & index.directors_by_movie[movie]}
+        expected |= {f"Similar user {other} likes this" for other in neighbors
+                     if movie in index.liked_movies(other)}
+        assert set(reasons) == expected
+
+
+def test_explanations_follow_the_movie_order(metta):
+    evidence = get_index(metta).recommend_with_evidence("alice")
+    movies = [{"id": movie} for movie in sorted(evidence)]
+    forward = utils.explanations_from_evidence(evidence, movies)
+    backward = utils.explanations_from_evidence(evidence, movies[::-1])
+    assert backward == forward[::-1]
+    assert utils.explanations_from_evidence(evidence, [{"id": "no-such-movie"}]) == [["No explanation available."]]
@@ -1,21 +1,41 @@
+import logging
+
 from hyperon import MeTTa
+from cf_engine import build_engine
+from ranking import rank_candidates
+from graph_engine import MAX_DEPTH
+from kb_index import (KnowledgeIndex, atom_to_value, build_catalog, build_index, describe_evidence, get_index,
+                      register_aggregate_functions, register_content_functions, register_graph_functions,
+                      register_index_functions)
+from metrics import query_rule, timed_query
+from prepared import bind_query, get_query
+
+logger = logging.getLogger(__name__)
 
-def initialize_metta(metta_file_path):
+def initialize_metta(metta_file_path, cf_metric="cosine"):
     """
-    Initialize MeTTa and load the specified knowledge base file.
+    Initialize MeTTa, load the specified knowledge base file and build the fact index
+    and collaborative-filtering engine over it.
     """
     metta = MeTTa()
+    index = KnowledgeIndex()
+    register_aggregate_functions(metta, index.aggregates)
+    register_content_functions(metta, index)
+    register_graph_functions(metta, index)
     try:
         with open(metta_file_path, 'r') as f:
             content = f.read()
-            print(f"MeTTa file contents: {content[:200]}...")  # Log first 200 chars
+            logger.debug("MeTTa file contents: %s...", content[:200])
             metta.run(content)
-            print(f"Loaded MeTTa file: {metta_file_path}")
+            logger.info("Loaded MeTTa file: %s", metta_file_path)
+        build_index(metta, index)
+        index.collaborative = build_engine(index, cf_metric)
+        register_index_functions(metta, index)
     except FileNotFoundError:
-        print(f"Error: MeTTa file {metta_file_path} not found")
+        logger.error("MeTTa file %s not found", metta_file_path)
         raise Exception(f"MeTTa file {metta_file_path} not found")
     except Exception as e:
-        print(f"Error initializing MeTTa: {str(e)}")
+        logger.error("Error initializing MeTTa: %s", e)
         raise
     return metta
 
@@ -24,35 +44,60 @@ def execute_simple_list(metta, query):
     Execute a MeTTa query and return a flat list of strings.
     """
     try:
-        print(f"Executing MeTTa query: {query}")
-        results = metta.run(query)
-        print(f"Raw MeTTa results: {results}")
-        flat_results = []
-        def flatten_result(r):
-            if r is None:
-                return
-            if isinstance(r, list):
-                for sub_r in r:
-                    flatten_result(sub_r)
-            elif hasattr(r, 'get_children'):
-                children = r.get_children()
-                if children:
-                    flatten_result(children)
-                else:
-                    flat_results.append(str(r))
-            else:
-                flat_results.append(str(r))
-        for result in results:
-            flatten_result(result)
-        unique_results = list(set(flat_results))
-        print(f"execute_simple_list query '{query}' returned: {unique_results}")
+        with timed_query(query_rule(query), query) as timer:
+            results = metta.run(query)
+            logger.debug("Raw MeTTa results for %s: %s", query, results)
+            unique_results = _flatten_results(results)
+            timer.results = len(unique_results)
+        logger.debug("execute_simple_list query '%s' returned: %s", query, unique_results)
         if not unique_results:
-            print(f"Warning: No results for query '{query}'")
+            logger.debug("No results for query '%s'", query)
+        return unique_results
+    except Exception as e:
+        logger.error("Error in execute_simple_list query '%s': %s", query, e)
+        return []
+
+def execute_prepared(metta, name, **params):
+    """
+    Execute a prepared query by name with its parameters bound as atoms, and return a flat
+    list of strings like execute_simple_list. Invalid parameter values raise ValueError.
+    """
+    query = get_query(name)
+    atom = query.bind(**params)
+    try:
+        with timed_query(name, str(atom)) as timer:
+            unique_results = _flatten_results(query.execute(metta, **params))
+            timer.results = len(unique_results)
+        logger.debug("execute_prepared %s %s returned: %s", name, params, unique_results)
         return unique_results
     except Exception as e:
-        print(f"Error in execute_simple_list query '{query}': {str(e)}")
+        logger.error("Error in execute_prepared %s %s: %s", name, params, e)
         return []
 
+def _flatten_results(results):
+    """
+    Flatten nested MeTTa results into a list of unique strings, in the order they were
+    returned so that ranked results keep their ranking.
+    """
+    flat_results = []
+    def flatten_result(r):
+        if r is None:
+            return
+        if isinstance(r, list):
+            for sub_r in r:
+                flatten_result(sub_r)
+        elif hasattr(r, 'get_children'):
+            children = r.get_children()
+            if children:
+                flatten_result(children)
+            else:
+                flat_results.append(str(r))
+        else:
+            flat_results.append(str(r))
+    for result in results:
+        flatten_result(result)
+    return list(dict.fromkeys(flat_results))
+
 def execute_query(metta, query):
     """
     Execute a MeTTa query and return structured results (id and title from movie atom).
@@ -60,69 +105,345 @@ def execute_query(metta, query):
     try:
         results = execute_simple_list(metta, query)
         if not results:
-            print(f"No movies found for query '{query}'")
-        parsed = []
-        for movie_id in results:
-            if not movie_id:
-                print(f"Skipping empty movie_id in query '{query}'")
-                continue
-            movie_query = f'!(match &self (movie {movie_id} $title $genre $director $rating) (movie {movie_id} $title $genre $director $rating))'
-            print(f"Fetching movie details for ID: {movie_id}")
-            movie_results = metta.run(movie_query)
-            print(f"Movie query results for {movie_id}: {movie_results}")
-            movie_atom = None
-            for result in movie_results:
-                if result and hasattr(result, 'get_children'):
-                    movie_atom = result
-                    break
-                elif isinstance(result, list):
-                    for sub_result in result:
-                        if sub_result and hasattr(sub_result, 'get_children'):
-                            movie_atom = sub_result
-                            break
-                    if movie_atom:
-                        break
-            if movie_atom and movie_atom.get_children():
-                children = movie_atom.get_children()
-                title = str(children[1]) if len(children) > 1 else movie_id
-                parsed.append({'id': movie_id, 'title': title})
-            else:
-                print(f"No movie details found for ID: {movie_id}")
-                parsed.append({'id': movie_id, 'title': movie_id})
-        print(f"execute_query query '{query}' returned: {parsed}")
+            logger.debug("No movies found for query '%s'", query)
+        parsed = describe_movies(metta, results)
+        logger.debug("execute_query query '%s' returned: %s", query, parsed)
         return parsed
     except Exception as e:
-        print(f"Error in execute_query query '{query}': {str(e)}")
+        logger.error("Error in execute_query query '%s': %s", query, e)
         return []
 
-def get_explanations(metta, user, movies):
+def get_catalog(metta):
+    """
+    Return the movie catalog kept by the fact index, or build one from a single space scan.
+    """
+    index = get_index(metta)
+    if index is not None:
+        return index.catalog
+    return build_catalog(metta)
+
+def registry_page(metta, kind, after=None, limit=None):
+    """
+    One page of the sorted user or movie registry: (ids, last id to continue from or None, total).
+    Without the fact index the space is scanned instead.
+    """
+    index = get_index(metta)
+    if index is None:
+        ids = sorted(execute_prepared(metta, "watched-users") if kind == "users" else build_catalog(metta).ids())
+        ids = [item for item in ids if after is None or item > after]
+        page = ids if limit is None else ids[:limit]
+        return page, (page[-1] if page and len(page) < len(ids) else None), len(ids)
+    registry = index.user_registry if kind == "users" else index.movie_registry
+    page, next_after = registry.page(after, limit)
+    return page, next_after, len(registry)
+
+def describe_movies(metta, movie_ids):
+    """
+    Resolve movie IDs to {'id', 'title', 'genre', 'director', 'rating'} records in one pass.
+    """
+    return get_catalog(metta).hydrate(movie_ids)
+
+def watched_movies(metta, user):
+    """
+    Movies the user has watched, as catalog records.
+    """
+    index = get_index(metta)
+    if index is not None:
+        movie_ids = sorted(index.watched_movies(user))
+    else:
+        movie_ids = execute_prepared(metta, "watched", user=user)
+    return describe_movies(metta, movie_ids)
+
+def recommend_to(metta, user):
+    """
+    Hybrid recommendations for a user, answered from the fact index when available.
+    """
+    index = get_index(metta)
+    if index is None:
+        return execute_prepared(metta, "recommend-to", user=user)
+    return sorted(index.recommend_to(user))
+
+def similar_users(metta, user):
+    """
+    Users sharing a liked movie with the given user, most similar first when the
+    collaborative engine is available.
+    """
+    index = get_index(metta)
+    if index is None:
+        return execute_prepared(metta, "similar-users", user=user)
+    if index.collaborative is not None:
+        return [other for other, _ in index.collaborative.top_neighbors([user])[user]]
+    return sorted(index.similar_users(user))
+
+def similar_users_scored(metta, users, k=None):
+    """
+    Ranked (neighbour, score) lists for a batch of users from the collaborative engine.
+    """
+    index = get_index(metta)
+    if index is None or index.collaborative is None:
+        return {user: [(other, 1.0) for other in similar_users(metta, user)][:k] for user in users}
+    return index.collaborative.top_neighbors(users, k)
+
+def collaborative_scored(metta, users, k_neighbors=None):
+    """
+    Ranked (movie, score) collaborative candidates for a batch of users.
+    """
+    index = get_index(metta)
+    if index is None or index.collaborative is None:
+        return {user: [(movie, 1.0) for movie in execute_prepared(metta, "collaborative-rec", user=user)]
+                for user in users}
+    return index.collaborative.recommend(users, k_neighbors)
+
+def add_metta_atom(metta, fact):
+    """
+    Add a single fact, given as an atom or as MeTTa text, to the MeTTa space and keep the
+    fact index in sync. Indexed facts that are already present are not added twice; for
+    those None is returned instead of the atom.
+    """
+    atom = metta.parse_single(fact) if isinstance(fact, str) else fact
+    index = get_index(metta)
+    if index is not None:
+        fact = atom_to_value(atom)
+        if index.has_fact(fact):
+            logger.debug("Atom already present: %s", atom)
+            return None
+        index.add_fact(fact)
+    metta.space().add_atom(atom)
+    logger.info("Added atom: %s", atom)
+    return atom
+
+def affected_users(metta, atom):
+    """
+    Users whose cached results are stale after adding the atom, or None for all users.
+    """
+    index = get_index(metta)
+    if index is None:
+        return None
+    return index.affected_users(atom_to_value(atom))
+
+def get_explanations(metta, user, movies, evidence=None):
     """
-    Generate explanations for recommended movies using MeTTa explanation functions.
+    Generate explanations for recommended movies. When the fact index is available they
+    come from one provenance-tracking pass (or the evidence already computed by the caller),
+    otherwise from the MeTTa explanation functions.
     """
+    index = get_index(metta)
+    if evidence is None and index is not None:
+        evidence = index.recommend_with_evidence(user)
+    if evidence is not None:
+        return explanations_from_evidence(evidence, movies)
     explanations = []
     for movie in movies:
         movie_id = movie["id"]
-        exp_queries = [
-            f'!(explain-genre {user} {movie_id} $explanation)',
-            f'!(explain-director {user} {movie_id} $explanation)',
-            f'!(explain-collab {user} {movie_id} $explanation)'
-        ]
         movie_explanations = []
-        for query in exp_queries:
-            results = execute_simple_list(metta, query)
-            movie_explanations.extend(results)
+        for query in ("explain-genre", "explain-director", "explain-collab"):
+            movie_explanations.extend(execute_prepared(metta, query, user=user, movie=movie_id))
         explanations.append(movie_explanations if movie_explanations else ["No explanation available."])
-    print(f"Explanations for user {user}: {explanations}")
+    logger.debug("Explanations for user %s: %s", user, explanations)
     return explanations
 
+def explanations_from_evidence(evidence, movies):
+    """
+    Format the evidence recorded for each movie, in the order of the movies list.
+    """
+    explanations = []
+    for movie in movies:
+        movie_explanations = list(dict.fromkeys(describe_evidence(item) for item in evidence.get(movie["id"], ())))
+        explanations.append(movie_explanations if movie_explanations else ["No explanation available."])
+    return explanations
+
+def _ranked_page(index, user, neighbors, limit=None, offset=0, memo=None):
+    evidence = index.recommend_with_evidence(user, [other for other, _ in neighbors], memo)
+    exclude = index.liked_movies(user) | index.watched_movies(user)
+    ranked, total = rank_candidates(evidence, exclude, index.catalog, index.popularity, dict(neighbors),
+                                    limit, offset)
+    return ranked, total, evidence
+
+def _rank_user(metta, index, user, neighbors, limit=None, offset=0, memo=None):
+    names = [other for other, _ in neighbors]
+    ranked, total, evidence = _ranked_page(index, user, neighbors, limit, offset, memo)
+    recs = describe_movies(metta, [movie for movie, _ in ranked])
+    for rec, (_, score) in zip(recs, ranked):
+        rec["score"] = round(score, 4)
+    return {
+        "recommendations": recs,
+        "explanations": explanations_from_evidence(evidence, recs),
+        "similar_users": names,
+        "total": total
+    }
+
+def ranked_recommendations(metta, user, limit=None, offset=0):
+    """
+    One page of a user's recommendations, best first, with explanations and the total number
+    of candidates. Candidates the user already likes or has watched are dropped.
+    """
+    index = get_index(metta)
+    if index is None:
+        recs = describe_movies(metta, execute_prepared(metta, "filter-recommendations", user=user))
+        page = recs[offset:offset + limit if limit is not None else None]
+        return {
+            "recommendations": page,
+            "explanations": get_explanations(metta, user, page),
+            "similar_users": similar_users(metta, user),
+            "total": len(recs)
+        }
+    with timed_query("ranked-recommendations", user) as timer:
+        neighbors = similar_users_scored(metta, [user])[user]
+        result = _rank_user(metta, index, user, neighbors, limit, offset)
+        timer.results = result['total']
+    logger.debug("Ranked %d candidates for user %s", result['total'], user)
+    return result
+
+def graph_recommendations(metta, user, depth=1, limit=None, offset=0):
+    """
+    One page of a user's recommendations from a walk of up to depth hops (1-5) over the
+    likes/genre/director graph, with the users reached within the same depth. Movies the
+    user already likes or has watched are dropped.
+    """
+    index = get_index(metta)
+    if index is None:
+        return ranked_recommendations(metta, user, limit, offset)
+    depth = max(1, min(MAX_DEPTH, int(depth)))
+    with timed_query("graph-recommendations", f"{user} depth={depth}") as timer:
+        exclude = index.liked_movies(user) | index.watched_movies(user)
+        ranked, total = index.graph.recommend(user, depth, exclude, limit, offset)
+        recs = describe_movies(metta, [movie for movie, _, _ in ranked])
+        explanations = []
+        for rec, (_, score, hops) in zip(recs, ranked):
+            rec["score"] = round(score, 6)
+            rec["hops"] = hops
+            explanations.append([f"{hops}-hop connection to movies you like"])
+        similar = [other for other, _ in index.graph.similar_users(user, depth)]
+        timer.results = total
+    return {
+        "recommendations": recs,
+        "explanations": explanations,
+        "similar_users": similar,
+        "total": total
+    }
+
+def recommend_with_explanations(metta, user, limit=None, offset=0):
+    """
+    Ranked recommendations for a user together with their explanations, from a single evaluation.
+    """
+    result = ranked_recommendations(metta, user, limit, offset)
+    return result["recommendations"], result["explanations"]
+
+def iter_recommendations(metta, user, limit=None, offset=0):
+    """
+    Yield a user's recommendations as (event, data) pairs while they are produced:
+    ('similar_users', [...]) first, then one ('recommendation', {'rank', 'movie', 'explanations'})
+    per movie, best first, with its explanations resolved just before it is yielded, then
+    ('watched', [...]) and finally ('done', {'total': n}).
+    """
+    index = get_index(metta)
+    if index is None:
+        yield "similar_users", similar_users(metta, user)
+        movie_ids = execute_prepared(metta, "filter-recommendations", user=user)
+        page = movie_ids[offset:offset + limit if limit is not None else None]
+        for rank, record in enumerate(describe_movies(metta, page), offset):
+            yield "recommendation", {
+                "rank": rank,
+                "movie": record,
+                "explanations": get_explanations(metta, user, [record])[0]
+            }
+        total = len(movie_ids)
+    else:
+        neighbors = similar_users_scored(metta, [user])[user]
+        yield "similar_users", [other for other, _ in neighbors]
+        ranked, total, evidence = _ranked_page(index, user, neighbors, limit, offset)
+        for rank, (movie, score) in enumerate(ranked, offset):
+            record = describe_movies(metta, [movie])[0]
+            record["score"] = round(score, 4)
+            yield "recommendation", {
+                "rank": rank,
+                "movie": record,
+                "explanations": explanations_from_evidence(evidence, [record])[0]
+            }
+    yield "watched", watched_movies(metta, user)
+    yield "done", {"total": total}
+
+def batch_recommendations(metta, users=None, top_n=None):
+    """
+    Ranked recommendations, explanations and similar users for many users at once (all known
+    users when users is None). Neighbours are computed in one batched engine call and the
+    genre/director candidates of each liked movie are shared across users.
+    """
+    index = get_index(metta)
+    if index is None:
+        return {user: ranked_recommendations(metta, user, top_n) for user in users or []}
+    if users is None:
+        users = index.users()
+    with timed_query("batch-recommendations", f"{len(users)} users") as timer:
+        neighbors = similar_users_scored(metta, users)
+        memo = {}
+        results = {user: _rank_user(metta, index, user, neighbors[user], top_n, 0, memo) for user in users}
+        timer.results = len(results)
+    logger.info("Batch recommendations computed for %d users", len(results))
+    return results
+
+def top_movies(metta, metric="popular", genre=None, limit=10, offset=0):
+    """
+    Most popular, top-rated or trending movies overall or in one genre, read from the
+    sorted aggregate indexes. Each record carries its score.
+    """
+    ranked = get_index(metta).aggregates.top(metric, genre, limit, offset)
+    records = describe_movies(metta, [movie for movie, _ in ranked])
+    for record, (_, value) in zip(records, ranked):
+        record["score"] = round(value, 4)
+    return records
+
+def user_profile(metta, user):
+    """
+    The movies a user likes and has watched, as two sorted lists.
+    """
+    index = get_index(metta)
+    return sorted(index.liked_movies(user)), sorted(index.watched_movies(user))
+
+def user_likes(metta, users):
+    """
+    {user: sorted liked movies} for the given users that have likes here.
+    """
+    index = get_index(metta)
+    return {user: sorted(movies) for user, movies in index.likes_of(users).items()}
+
+def shard_similar_users(metta, liked, user, k=None):
+    """
+    This space's top-k (neighbour, score) pairs for a user with the given likes, who may be
+    held elsewhere; the user themselves is left out.
+    """
+    index = get_index(metta)
+    if index.collaborative is None:
+        return []
+    return index.collaborative.neighbors_of(liked, k, {user})
+
+def co_liked_movies(metta, movie):
+    """
+    Movies liked by this space's users who like the movie, as a sorted list.
+    """
+    return sorted(get_index(metta).co_liked_movies(movie))
+
+def users_liking_any(metta, movies):
+    """
+    This space's users who like any of the movies, as a sorted list.
+    """
+    return sorted(get_index(metta).users_liking_any(movies))
+
+def fact_present(metta, atom_text):
+    """
+    True if an indexed fact is already in the space.
+    """
+    index = get_index(metta)
+    return index is not None and index.has_fact(atom_to_value(metta.parse_single(atom_text)))
+
 def user_exists(metta, user):
     """
     Check if a user exists in MeTTa by verifying watched movies or preferences.
     """
-    watched = execute_simple_list(metta, f'!(watched {user} $movie)')
-    preferences = execute_simple_list(metta, f'!(preference {user} $genre)')
+    watched = execute_prepared(metta, "watched", user=user)
+    preferences = execute_prepared(metta, "preferences", user=user)
     exists = bool(watched or preferences)
-    print(f"User {user} exists: {exists}")
+    logger.debug("User %s exists: %s", user, exists)
     return exists
 
 def add_new_user(metta, user, preferences=[]):
@@ -130,5 +451,5 @@ def add_new_user(metta, user, preferences=[]):
     Add a new user with optional genre preferences.
     """
     for genre in preferences:
-        metta.run(f'(preference {user} {genre})')
-    print(f"Added new user: {user}")
\ No newline at end of file
+        add_metta_atom(metta, bind_query("preference-fact", {"user": user, "genre": genre}))
+    logger.info("Added new user: %s", user)
\ No newline at end of file